@@ -0,0 +1,209 @@
+import numpy as np
+from utils import plogp
+
+
+class Batch_Info:
+    """
+    This is the batched, vectorized version of class Simple_Info. It
+    calculates various information theory metrics for N distributions at
+    once. The nth distribution is P_n(x, y) where x and y take values in
+    {0, 1, ..., k-1}
+
+    P_n(x, y) = P_n(y|x) P_n(x)
+
+    The k=2 case is the one treated by class Simple_Info, for a single n.
+    Zero probabilities are handled using the convention 0*log(0) = 0.
+
+    Attributes
+    ----------
+    prob_y_if_x: np.array
+        P_n(y|x) specified as an array of shape (N, k, k). prob_y_if_x[n, y,
+        x] = P_n(y|x), the same (y, x) index convention as in Simple_Info
+    px: np.array
+        P_n(x) specified as an array of shape (N, k)
+    py: np.array
+        P_n(y) specified as an array of shape (N, k)
+
+    """
+
+    def __init__(self, prob_y_if_x, px):
+        """
+        constructor
+
+        Parameters
+        ----------
+        prob_y_if_x: np.array
+            shape (N, k, k), or (k, k) for a single distribution
+        px: np.array
+            shape (N, k), or (k,) for a single distribution
+        """
+        prob_y_if_x = np.asarray(prob_y_if_x, dtype=float)
+        px = np.asarray(px, dtype=float)
+        if prob_y_if_x.ndim == 2:
+            prob_y_if_x = prob_y_if_x[np.newaxis, :, :]
+        if px.ndim == 1:
+            px = px[np.newaxis, :]
+        assert prob_y_if_x.ndim == 3 and \
+               prob_y_if_x.shape[1] == prob_y_if_x.shape[2], \
+            "prob_y_if_x must have shape (N, k, k)"
+        assert px.shape == (prob_y_if_x.shape[0], prob_y_if_x.shape[2]), \
+            "px must have shape (N, k)"
+        self.prob_y_if_x = prob_y_if_x
+        self.px = px
+        self.py = self.get_py()
+
+    def get_joint_prob(self):
+        """
+        This method returns P_n(y, x) = P_n(y|x) P_n(x) as an array of shape
+        (N, k, k)
+
+        Returns
+        -------
+        np.array
+
+        """
+        return self.prob_y_if_x * self.px[:, np.newaxis, :]
+
+    def get_py(self):
+        """
+        This method returns P_n(y) as an array of shape (N, k)
+
+        Returns
+        -------
+        np.array
+
+        """
+        return np.einsum("nyx,nx->ny", self.prob_y_if_x, self.px)
+
+    def mutual_info(self):
+        """
+        This method returns the mutual information H_n(y:x) as an array of
+        shape (N,)
+
+        Returns
+        -------
+        np.array
+
+        """
+        joint = self.get_joint_prob()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_ratio = np.log(self.prob_y_if_x / self.py[:, :, np.newaxis])
+            terms = np.where(joint > 0, joint * log_ratio, 0.0)
+        return terms.sum(axis=(1, 2))
+
+    @staticmethod
+    def entropy(probs):
+        """
+        This static method returns the entropy of each distribution in
+        probs. The last axis of probs labels the states.
+
+        Parameters
+        ----------
+        probs: np.array
+            shape (N, k)
+
+        Returns
+        -------
+        np.array
+            shape (N,)
+
+        """
+        return 0.0 - plogp(probs).sum(axis=-1)
+
+    def cond_info_y_if_x(self):
+        """
+        This method returns the conditional information H_n(y|x) as an
+        array of shape (N,)
+
+        Returns
+        -------
+        np.array
+
+        """
+        return 0.0 - np.einsum("nyx,nx->n", plogp(self.prob_y_if_x), self.px)
+
+    def efficiency(self):
+        """
+        This method returns the efficiency H_n(y:x)/H_n(y) as an array of
+        shape (N,). The efficiency is set to np.nan whenever H_n(y) is zero.
+
+        Returns
+        -------
+        np.array
+
+        """
+        ent_y = Batch_Info.entropy(self.py)
+        mi = self.mutual_info()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(ent_y > 1e-12, mi / ent_y, np.nan)
+
+    def get_all(self):
+        """
+        This method returns a dictionary with all the metrics calculated by
+        this class. Each value is an array of shape (N,)
+
+        Returns
+        -------
+        dict[str, np.array]
+
+        """
+        ent_y = Batch_Info.entropy(self.py)
+        mi = self.mutual_info()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eff = np.where(ent_y > 1e-12, mi / ent_y, np.nan)
+        return {"mi": mi,
+                "ent_y": ent_y,
+                "ent_x": Batch_Info.entropy(self.px),
+                "cond_info": self.cond_info_y_if_x(),
+                "eff": eff}
+
+    def report(self):
+        """
+        This method prints a report, one line per distribution, with the
+        values it calculates.
+
+        Returns
+        -------
+        None
+
+        """
+        metrics = self.get_all()
+        for n in range(len(self.px)):
+            print(f"n={n}, mi={metrics['mi'][n]:.4f}, "
+                  f"ent_y={metrics['ent_y'][n]:.4f}, "
+                  f"ent_x={metrics['ent_x'][n]:.4f}, "
+                  f"cond_info={metrics['cond_info'][n]:.4f}, "
+                  f"eff={metrics['eff'][n]:.4f}")
+
+
+if __name__ == "__main__":
+    from time import time
+    from Simple_Info import Simple_Info
+
+    def main1():
+        prob_y_if_x = np.array([[[1, 0], [0, 1]],
+                                [[0, 1], [1, 0]],
+                                [[1, 1], [0, 0]],
+                                [[.5, .5], [.5, .5]],
+                                [[.3, .1], [.7, .9]]])
+        px = np.array([[.3, .7]] * len(prob_y_if_x))
+        Batch_Info(prob_y_if_x, px).report()
+        print("compare with Simple_Info:")
+        Simple_Info(prob_y_if_x[-1], px[-1]).report()
+
+
+    def main2():
+        num_dists = 10**6
+        rng = np.random.default_rng(1234)
+        prob_y_if_x = rng.dirichlet([1, 1, 1], size=(num_dists, 3))
+        # make each column x of P(y|x) a distribution over y
+        prob_y_if_x = np.swapaxes(prob_y_if_x, 1, 2)
+        px = rng.dirichlet([1, 1, 1], size=num_dists)
+        t0 = time()
+        metrics = Batch_Info(prob_y_if_x, px).get_all()
+        print(f"k=3, N={num_dists}, time={time() - t0:.3f} s, "
+              f"mean eff={np.nanmean(metrics['eff']):.4f}")
+
+
+    main1()
+    main2()
@@ -42,7 +42,8 @@ class Cond_Prob:
         self.h = h
         self.lam = lam
 
-    def calc_cond_probs_y_if_abcd_x(self, abcd_states, x_state):
+    def calc_cond_probs_y_if_abcd_x(self, abcd_states, x_state,
+                                    abcd_jj=None, h=None, lam=None):
         """
         This method calculates the conditional probability
 
@@ -67,6 +68,15 @@ class Cond_Prob:
             are not corners
         x_state: int
             state of  S_i^X, either -1 or 1
+        abcd_jj: list[float]|None
+            coupling constant of the bond to each of the nearest neighbors,
+            for lattices with heterogeneous (e.g., random) bonds. The energy
+            contribution is then $-S_i^Y \\sum_a jj_a S_a^X$. If None,
+            self.jj is used for every bond
+        h: float|None
+            magnetic field at site i. If None, self.h is used
+        lam: float|None
+            lam at site i. If None, self.lam is used
 
         Returns
         -------
@@ -77,9 +87,16 @@ class Cond_Prob:
         assert set(abcd_states).issubset(set([-1, 1])), \
             str(abcd_states) + " is illegal"
         assert x_state in [-1, 1]
-        abcd_sum = np.sum(abcd_states)
-        energy_plus = -self.jj * abcd_sum - self.h - self.lam * x_state
-        energy_minus = self.jj * abcd_sum + self.h + self.lam * x_state
+        if h is None:
+            h = self.h
+        if lam is None:
+            lam = self.lam
+        if abcd_jj is None:
+            jj_abcd_sum = self.jj * np.sum(abcd_states)
+        else:
+            jj_abcd_sum = np.dot(abcd_jj, abcd_states)
+        energy_plus = -jj_abcd_sum - h - lam * x_state
+        energy_minus = jj_abcd_sum + h + lam * x_state
         cond_prob_p = 1.0
         cond_prob_m = np.exp(-self.beta * (energy_minus - energy_plus))
 
@@ -94,6 +111,8 @@ if __name__ == "__main__":
     def main():
         cpt = Cond_Prob(beta=1.0, jj=0, h=0, lam=1)
         print(cpt.calc_cond_probs_y_if_abcd_x([1, -1, -1, -1], -1))
+        print(cpt.calc_cond_probs_y_if_abcd_x([1, -1, -1, -1], -1,
+                                              abcd_jj=[.5, 1, 1, 1.5]))
 
 
     main()
@@ -0,0 +1,411 @@
+import numpy as np
+
+from Lattice_Stats import *
+from globals import *
+from utils import *
+
+'''
+
+This module calculates exactly, with a transfer matrix, the stationary
+state of the X -> Y dynamics of class Net on a narrow strip, i.e., a
+lattice with few rows (or few columns). It is a reference for the
+factorized approximation of Net, and for Multispin_MC.
+
+Each iteration samples every S_i^Y independently from
+
+P(S_i^Y|S^X) = exp(beta*S_i^Y*u_i)/(2*cosh(beta*u_i)),
+u_i = jj*\\sum_{j nearest neighbor of i} S_j^X + h + lam*S_i^X,
+
+then sets S^X = S^Y. Since the couplings are symmetric, this Markov chain
+is reversible, and its stationary joint distribution of (S^X, S^Y) is
+
+P(S^X, S^Y) = exp(beta*[h*\\sum_i S_i^X + \\sum_i S_i^Y*u_i])/Z,
+
+where u_i already contains the field h of S_i^Y.
+
+For lam=0, the only couplings are between S_i^Y and the S_j^X of the
+nearest neighbors j of i. Coloring the sites like a checkerboard, the
+S_i^X of the black sites and the S_i^Y of the white sites then form an
+ordinary square lattice Ising model, with coupling jj and field h, which
+is independent of the one formed by the other half of the spins, and has
+the same distribution. Hence P(S_i^Y, S_a^X, ..., S_d^X), the joint
+distribution of S_i^Y and of its parents (nearest neighbors), is the
+joint distribution of spin i and of its nearest neighbors in the Ising
+model on the same lattice. From it follow P(S_i^Y=-1), the entropy
+H(S_i^Y), the conditional info H(S_i^Y|S_a^X, ..., S_d^X, S_i^X), and the
+mutual information (their difference), which are the quantities that
+Net.calc_y_node_params() calculates from the product of the marginals.
+
+The Ising model is solved by a transfer matrix over the 2^num_rows states
+of a column. It is never stored as a matrix: its horizontal bonds make it
+a Kronecker product of num_rows 2x2 matrices, applied to a vector one
+axis at a time (O(num_rows*2^num_rows) operations instead of
+O(4^num_rows)), and its vertical bonds and field a diagonal matrix. The
+vectors of the columns on the left and on the right of each column are
+calculated once, by a forward and a backward sweep, and reused for all
+the sites of the column. Strips up to 16 rows wide take seconds.
+
+Beware that, on a finite lattice with h=0, the stationary state is
+symmetric under S -> -S, so the exact magnetization is 0 at all beta,
+whereas Net, started from p0 != .5, can converge to a magnetized fixed
+point. The entropies and conditional infos are comparable at all beta.
+
+'''
+
+
+def apply_kron_factor(vec, kk, axis):
+    """
+    This method multiplies the tensor vec by the 2x2 symmetric matrix kk
+    along axis `axis`.
+
+    Parameters
+    ----------
+    vec: np.array
+        shape (2, 2, ..., 2)
+    kk: np.array
+        shape (2, 2)
+    axis: int
+
+    Returns
+    -------
+    np.array
+        same shape as vec
+
+    """
+    shape = vec.shape
+    vec = vec.reshape(int(np.prod(shape[:axis])), 2, -1)
+    if vec.shape[2] >= 8:
+        return np.matmul(kk, vec).reshape(shape)
+    # matmul is slow for many tiny matrices
+    out = np.empty_like(vec)
+    for a in range(2):
+        np.multiply(kk[a, 0], vec[:, 0], out=out[:, a])
+        out[:, a] += kk[a, 1] * vec[:, 1]
+    return out.reshape(shape)
+
+
+def apply_kron_all_but_one(vec, kk, axes):
+    """
+    This method returns, for each axis r in axes, the tensor vec multiplied
+    by kk along all the axes in `axes` except r. The axes are split in two
+    halves, and the products along one half are shared by all the axes of
+    the other half, so this takes O(len(axes)*log(len(axes))) products
+    instead of O(len(axes)^2).
+
+    Parameters
+    ----------
+    vec: np.array
+        shape (2, 2, ..., 2)
+    kk: np.array
+        shape (2, 2)
+    axes: list[int]
+
+    Returns
+    -------
+    dict[int, np.array]
+
+    """
+    if len(axes) == 1:
+        return {axes[0]: vec}
+    half = len(axes) // 2
+    left_axes, right_axes = axes[:half], axes[half:]
+    left_vec, right_vec = vec, vec
+    for axis in right_axes:
+        left_vec = apply_kron_factor(left_vec, kk, axis)
+    for axis in left_axes:
+        right_vec = apply_kron_factor(right_vec, kk, axis)
+    axis_to_vec = apply_kron_all_but_one(left_vec, kk, left_axes)
+    axis_to_vec.update(apply_kron_all_but_one(right_vec, kk, right_axes))
+    return axis_to_vec
+
+
+class Exact_Strip:
+    """
+    This class calculates the exact stationary P(S_i^Y=-1), H(S_i^Y),
+    H(S_i^Y|S_a^X, ..., S_d^X, S_i^X) and efficiency of every site of the
+    lattice, for the dynamics of class Net with uniform coupling constants
+    and lam=0. See the docstring of this module. The attributes y_prob_m,
+    y_entropy, y_cond_info, y_efficiency have the same meaning as in
+    Multispin_MC.
+
+    The transfer matrix runs along the longer side of the lattice, so the
+    cost is exponential only in its shorter side, the width.
+
+    Attributes
+    ----------
+    av_eff: float
+    av_eff_flag: bool
+    beta: float
+    h: float
+    jj: float
+    lam: float
+    mag: float
+    nei_ids: np.array
+        shape (num_dnodes, 4), as in Net
+    num_cols: int
+    num_dnodes: int
+    num_rows: int
+    stats: Lattice_Stats
+        aggregates of the Y nodes, see Net
+    width: int
+        min(num_rows, num_cols)
+    y_cond_info: np.array
+        shape (num_dnodes,), H(S_i^Y|S_a^X, ..., S_d^X, S_i^X)
+    y_efficiency: np.array
+        shape (num_dnodes,), np.nan when undefined
+    y_entropy: np.array
+        shape (num_dnodes,), H(S_i^Y)
+    y_mutual_info: np.array
+        shape (num_dnodes,), H(S_i^Y) - H(S_i^Y|S_a^X, ..., S_d^X, S_i^X)
+    y_prob_m: np.array
+        shape (num_dnodes,), P(S_i^Y=-1)
+
+    """
+
+    def __init__(self, beta, jj, h=0, lam=0, num_rows=DGRAPH_NUM_ROWS,
+                 num_cols=DGRAPH_NUM_COLS, max_width=20, verbose=True):
+        """
+        constructor
+
+        Parameters
+        ----------
+        beta: float
+        jj: float
+        h: float
+        lam: float
+            must be 0
+        num_rows: int
+        num_cols: int
+        max_width: int
+            the calculation takes memory and time proportional to
+            2^width, so wider lattices are refused
+        verbose: bool
+            True iff mag and av_eff are printed
+        """
+        for x in [jj, h, lam]:
+            assert np.ndim(x) == 0, "only uniform couplings are supported"
+        # for lam != 0, S_i^Y is also coupled to S_i^X, and the two Ising
+        # models merge into one with 2 spins per site
+        assert lam == 0, "only lam=0 is supported"
+        self.beta = beta
+        self.jj = jj
+        self.h = h
+        self.lam = lam
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_dnodes = num_rows * num_cols
+        self.width = min(num_rows, num_cols)
+        assert self.width <= max_width, \
+            f"width {self.width} > max_width {max_width}"
+        self.nei_ids = get_nei_ids(num_rows, num_cols)
+
+        self.y_prob_m = None
+        self.y_entropy = None
+        self.y_cond_info = None
+        self.y_mutual_info = None
+        self.y_efficiency = None
+        self.stats = None
+        self.calc_y_node_params()
+        self.mag = self.get_mag()
+        self.av_eff, self.av_eff_flag = self.get_av_eff2()
+        if verbose:
+            print(f"exact {num_rows}x{num_cols}, mag={self.mag:.5f}, "
+                  f"av_eff={self.av_eff}")
+
+    def get_cluster_probs(self):
+        """
+        This method returns the joint distribution of the spin of each site
+        and of the spins of its nearest neighbors in the Ising model with
+        coupling jj and field h on the lattice, calculated by the transfer
+        matrix.
+
+        Returns
+        -------
+        list[np.array]
+            one array per site, with one axis of size 2 (index 0 for spin
+            -1, 1 for spin +1) for the site, followed by one for each of
+            its nearest neighbors, in an arbitrary order
+
+        """
+        # the transfer matrix runs along the longer side. Internally,
+        # columns have `width` rows
+        transposed = self.num_rows > self.num_cols
+        width = self.width
+        length = self.num_dnodes // width
+        bj, bh = self.beta * self.jj, self.beta * self.h
+        spins = np.array([-1.0, 1.0])
+        kk = np.exp(bj * np.outer(spins, spins))
+
+        # diagonal of the transfer matrix: vertical bonds and field of a
+        # column
+        log_diag = np.zeros((2,) * width)
+        for r in range(width):
+            s_r = spins.reshape((1,) * r + (2,) + (1,) * (width - r - 1))
+            log_diag = log_diag + bh * s_r
+            if r + 1 < width:
+                log_diag = log_diag + bj * s_r * np.moveaxis(s_r, r, r + 1)
+        diag = np.exp(log_diag - log_diag.max())
+
+        # weight of column c and of all the columns on its left (right),
+        # summed over the latter, normalized to avoid overflows
+        def sweep(cols):
+            col_to_vec = {}
+            vec = diag
+            for c in cols:
+                vec = col_to_vec[c] = vec / vec.max()
+                for axis in range(width):
+                    vec = apply_kron_factor(vec, kk, axis)
+                vec = diag * vec
+            return col_to_vec
+
+        left_vecs = sweep(range(length))
+        right_vecs = sweep(range(length - 1, -1, -1))
+
+        axes = list(range(width))
+        ones = np.ones((1, 2))
+        cluster_probs = [None] * self.num_dnodes
+        for c in range(length):
+            # the columns on the left (right), with the spin of row r of
+            # column c-1 (c+1) not summed over, for each r
+            if c > 0:
+                left = apply_kron_all_but_one(left_vecs[c - 1], kk, axes)
+            if c < length - 1:
+                right = apply_kron_all_but_one(right_vecs[c + 1], kk, axes)
+            for r in range(width):
+                # einsum labels: axis k of the column is k, the spins on
+                # the left and on the right are width and width + 1
+                left_labels = [k if k != r else width for k in axes]
+                right_labels = [k if k != r else width + 1 for k in axes]
+                operands = [diag, axes]
+                if c > 0:
+                    operands += [left[r], left_labels, kk, [width, r]]
+                if c < length - 1:
+                    operands += [right[r], right_labels, kk, [r, width + 1]]
+                out = [r] + [k for k in [r - 1, r + 1] if 0 <= k < width]
+                out += [width] * (c > 0) + [width + 1] * (c < length - 1)
+                probs = np.einsum(*operands, out)
+                # row r of internal column c is a column of the lattice
+                # if it was transposed
+                if transposed:
+                    dnode = c * self.num_cols + r
+                else:
+                    dnode = r * self.num_cols + c
+                cluster_probs[dnode] = probs / probs.sum()
+        return cluster_probs
+
+    def calc_y_node_params(self):
+        """
+        This method calculates the attributes y_prob_m, y_entropy,
+        y_cond_info, y_mutual_info and y_efficiency from
+        get_cluster_probs(), with the same rules as Net.calc_y_node_params()
+
+        Returns
+        -------
+        None
+
+        """
+        self.y_prob_m = np.empty(self.num_dnodes)
+        self.y_cond_info = np.empty(self.num_dnodes)
+        for i, probs in enumerate(self.get_cluster_probs()):
+            self.y_prob_m[i] = probs[0].sum()
+            # P(S_a^X, ..., S_d^X), and u_i for each of their states
+            nei_probs = probs.sum(axis=0)
+            nei_sum = sum(np.ix_(*[[-1.0, 1.0]] * nei_probs.ndim))
+            u = self.jj * nei_sum + self.h
+            log_cond_prob_m = -np.logaddexp(0, 2 * self.beta * u)
+            log_cond_prob_p = -np.logaddexp(0, -2 * self.beta * u)
+            self.y_cond_info[i] = -np.sum(nei_probs * (
+                np.exp(log_cond_prob_m) * log_cond_prob_m +
+                np.exp(log_cond_prob_p) * log_cond_prob_p))
+        prob_m = self.y_prob_m
+        self.y_entropy = np.where(
+            (prob_m < 1e-10) | (prob_m > 1 - 1e-10), 0.0,
+            -plogp(prob_m) - plogp(1 - prob_m))
+        self.y_mutual_info = self.y_entropy - self.y_cond_info
+        undef = (self.y_entropy < 1e-9) & (self.y_cond_info < 1e-9)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.y_efficiency = np.where(
+                undef, np.nan, self.y_mutual_info / self.y_entropy)
+        self.stats = Lattice_Stats.from_arrays(
+            self.y_prob_m, self.y_entropy, self.y_cond_info,
+            self.y_efficiency)
+
+    def get_mag(self):
+        """
+        This method returns the magnetization (1/num_dnodes)\\sum_i S_i^Y
+
+        Returns
+        -------
+        float
+
+        """
+        return self.stats.get_mag()
+
+    def get_av_entropy_and_cond_info(self):
+        """
+        This method returns a pair
+
+        (average entropy, average conditional info)
+
+        See Net.get_av_entropy_and_cond_info()
+
+        Returns
+        -------
+        tuple[float]
+
+        """
+        return self.stats.get_av_entropy_and_cond_info()
+
+    def get_av_eff2(self):
+        """
+        This method returns a tuple
+
+        (av_eff, no_undef_eff)
+
+        See Net.get_av_eff2()
+
+        Returns
+        -------
+        (float, bool)
+
+        """
+        return self.stats.get_av_eff2()
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from Multispin_MC import Multispin_MC
+    from Net import Net
+
+
+    def main1():
+        # exact stationary state versus the fixed point of Net and a long
+        # Monte Carlo run, on an 8x32 strip
+        num_rows, num_cols = 8, 32
+        for beta_hat in [.5, 1.0]:
+            kwargs = dict(beta=beta_hat * BETA_JJ_CURIE, jj=1, h=.05,
+                          num_rows=num_rows, num_cols=num_cols,
+                          verbose=False)
+            exact = Exact_Strip(**kwargs)
+            net = Net(**kwargs, num_iter=1000, p0=.5, tol=1e-10,
+                      backend="numpy", make_nodes=False)
+            mc = Multispin_MC(**kwargs, num_iter=200, p0=.5,
+                              num_replicas=64 * 16, seed=1)
+            print(f"beta_hat={beta_hat}")
+            for name, x in [("exact", exact), ("Net", net), ("MC", mc)]:
+                print(f"    {name:5s} mag={x.get_mag():.5f}, "
+                      f"av_cond_info="
+                      f"{x.get_av_entropy_and_cond_info()[1]:.5f}, "
+                      f"av_eff={x.get_av_eff2()[0]:.5f}")
+
+
+    def main2():
+        for num_rows, num_cols in [(12, 64), (16, 32)]:
+            t0 = perf_counter()
+            Exact_Strip(BETA_JJ_CURIE, 1, num_rows=num_rows,
+                        num_cols=num_cols)
+            print(f"{perf_counter() - t0:.2f} s")
+
+
+    main1()
+    main2()
@@ -0,0 +1,291 @@
+import numpy as np
+
+from utils import *
+
+'''
+
+This module holds the reduction of the per-node metrics of a sweep (of a
+Net, Stream_Net, Multispin_MC or Exact_Strip) to the scalars that are
+printed and stored after each iteration. All of them are accumulated in
+a single pass over the nodes, block by block, as the blocks are updated,
+so a sweep never goes back over the lattice to calculate them.
+
+'''
+
+
+def calc_entropy_and_efficiency(y_prob_m, cond_info):
+    """
+    This method returns H(S_i^Y) and epsilon(S_i^Y|S_i^X) for a block of
+    nodes, with the same rules as coin_toss_entropy() and
+    Node.set_efficiency().
+
+    Parameters
+    ----------
+    y_prob_m: np.array
+        shape (num,), P(S_i^Y=-1)
+    cond_info: np.array
+        shape (num,), H(S_i^Y|S_i^X)
+
+    Returns
+    -------
+    entropy, efficiency: tuple[np.array]
+        shapes (num,) and (num,), the efficiency is np.nan when undefined
+
+    """
+    entropy = np.where((y_prob_m < 1e-10) | (y_prob_m > 1 - 1e-10), 0.0,
+                       -plogp(y_prob_m) - plogp(1 - y_prob_m))
+    undef = (entropy < 1e-9) & (cond_info < 1e-9)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efficiency = np.where(undef, np.nan, (entropy - cond_info) / entropy)
+    return entropy, efficiency
+
+
+class Lattice_Stats:
+    """
+    This class holds running aggregates of the Y nodes updated so far,
+    from which the magnetization, the variance of the spins, the average
+    entropy and conditional info, and the mean, variance, minimum and
+    maximum of the efficiency are returned in O(1). Aggregates of disjoint
+    sets of nodes are combined with merge(). The variance of the
+    efficiency is accumulated with the pairwise update of Chan et al.,
+    which, unlike sum(eff^2) - sum(eff)^2/num, does not lose precision
+    when the variance is small compared to the mean.
+
+    Attributes
+    ----------
+    eff_m2: float
+        sum of (eff - eff_mean)^2 over the nodes with a defined efficiency
+    eff_max: float
+    eff_mean: float
+        mean efficiency over the nodes with a defined efficiency
+    eff_min: float
+    num: int
+        number of nodes
+    num_eff: int
+        number of nodes with a defined efficiency
+    prob_m_max: float
+        max_i P(S_i^Y=-1)
+    prob_m_min: float
+        min_i P(S_i^Y=-1)
+    sum_cond_info: float
+        \\sum_i H(S_i^Y|S_i^X)
+    sum_entropy: float
+        \\sum_i H(S_i^Y)
+    sum_spin: float
+        \\sum_i <S_i^Y>
+    sum_spin2: float
+        \\sum_i <S_i^Y>^2
+
+    """
+
+    def __init__(self):
+        """
+        constructor. The aggregates of an empty set of nodes.
+        """
+        self.num = 0
+        self.sum_spin = 0.0
+        self.sum_spin2 = 0.0
+        self.sum_entropy = 0.0
+        self.sum_cond_info = 0.0
+        self.prob_m_min = np.inf
+        self.prob_m_max = -np.inf
+        self.num_eff = 0
+        self.eff_mean = 0.0
+        self.eff_m2 = 0.0
+        self.eff_min = np.inf
+        self.eff_max = -np.inf
+
+    @staticmethod
+    def from_arrays(y_prob_m, entropy, cond_info, efficiency, weights=None):
+        """
+        This method returns the Lattice_Stats of a block of nodes.
+
+        Parameters
+        ----------
+        y_prob_m: np.array
+            shape (num,), P(S_i^Y=-1)
+        entropy: np.array
+            shape (num,), H(S_i^Y)
+        cond_info: np.array
+            shape (num,), H(S_i^Y|S_i^X)
+        efficiency: np.array
+            shape (num,), np.nan when undefined
+        weights: np.array|None
+            shape (num,), number of nodes of the lattice that each node
+            stands for, e.g., the size of its orbit when a Net only
+            calculates one site per orbit (see Net.find_orbits()). 1 for
+            all the nodes if None
+
+        Returns
+        -------
+        Lattice_Stats
+
+        """
+        stats = Lattice_Stats()
+        if weights is None:
+            weights = np.ones(len(y_prob_m))
+        stats.num = int(np.sum(weights))
+        if not stats.num:
+            return stats
+        spin = 1 - 2 * y_prob_m
+        stats.sum_spin = float(np.dot(weights, spin))
+        stats.sum_spin2 = float(np.dot(weights, spin * spin))
+        stats.sum_entropy = float(np.dot(weights, entropy))
+        stats.sum_cond_info = float(np.dot(weights, cond_info))
+        stats.prob_m_min = float(np.min(y_prob_m))
+        stats.prob_m_max = float(np.max(y_prob_m))
+        defined = ~np.isnan(efficiency)
+        eff = efficiency[defined]
+        eff_weights = weights[defined]
+        stats.num_eff = int(np.sum(eff_weights))
+        if stats.num_eff:
+            stats.eff_mean = float(np.dot(eff_weights, eff)) / stats.num_eff
+            dev = eff - stats.eff_mean
+            stats.eff_m2 = float(np.dot(eff_weights, dev * dev))
+            stats.eff_min = float(np.min(eff))
+            stats.eff_max = float(np.max(eff))
+        return stats
+
+    def update(self, y_prob_m, entropy, cond_info, efficiency, weights=None):
+        """
+        This method adds a block of nodes to the aggregates. See
+        from_arrays() for the parameters.
+
+        Returns
+        -------
+        None
+
+        """
+        self.merge(Lattice_Stats.from_arrays(y_prob_m, entropy, cond_info,
+                                             efficiency, weights))
+
+    def merge(self, other):
+        """
+        This method adds the aggregates of other, for a disjoint set of
+        nodes, to those of self.
+
+        Parameters
+        ----------
+        other: Lattice_Stats
+
+        Returns
+        -------
+        None
+
+        """
+        self.num += other.num
+        self.sum_spin += other.sum_spin
+        self.sum_spin2 += other.sum_spin2
+        self.sum_entropy += other.sum_entropy
+        self.sum_cond_info += other.sum_cond_info
+        self.prob_m_min = min(self.prob_m_min, other.prob_m_min)
+        self.prob_m_max = max(self.prob_m_max, other.prob_m_max)
+        num_eff = self.num_eff + other.num_eff
+        if other.num_eff:
+            delta = other.eff_mean - self.eff_mean
+            self.eff_mean += delta * other.num_eff / num_eff
+            self.eff_m2 += other.eff_m2 + \
+                delta ** 2 * self.num_eff * other.num_eff / num_eff
+            self.eff_min = min(self.eff_min, other.eff_min)
+            self.eff_max = max(self.eff_max, other.eff_max)
+        self.num_eff = num_eff
+
+    def get_mag(self):
+        """
+        This method returns the magnetization (1/num)\\sum_i S_i^Y
+
+        Returns
+        -------
+        float
+
+        """
+        return self.sum_spin / self.num
+
+    def get_product_variance(self):
+        """
+        This method returns the average variance of a single spin
+
+        (1/num) \\sum_i (1 - <S_i^Y>^2)
+
+        under the marginals P(S_i^Y), i.e., (1/num) Var(\\sum_i S_i^Y) under
+        the product of the marginals, as in class Net. It ignores the
+        correlations between nodes, so it is not a susceptibility, and
+        does not diverge at the critical point. The susceptibility of the
+        mean field approximation is d mag/d h (see Net.get_mag_tangents()).
+
+        Returns
+        -------
+        float
+
+        """
+        return 1 - self.sum_spin2 / self.num
+
+    def get_av_entropy_and_cond_info(self):
+        """
+        This method returns a pair
+
+        (average entropy, average conditional info)
+
+        See Net.get_av_entropy_and_cond_info()
+
+        Returns
+        -------
+        tuple[float]
+
+        """
+        return self.sum_entropy / self.num, self.sum_cond_info / self.num
+
+    def get_av_eff2(self):
+        """
+        This method returns a tuple
+
+        (av_eff, no_undef_eff)
+
+        See Net.get_av_eff2()
+
+        Returns
+        -------
+        (float, bool)
+
+        """
+        no_undef_eff = self.num_eff == self.num
+        av_eff = self.eff_mean if self.num_eff else None
+        return av_eff, no_undef_eff
+
+    def get_eff_var(self):
+        """
+        This method returns the variance of the efficiency over the nodes
+        with a defined efficiency, or None if there are none
+
+        Returns
+        -------
+        float|None
+
+        """
+        if not self.num_eff:
+            return None
+        return self.eff_m2 / self.num_eff
+
+
+if __name__ == "__main__":
+    def main():
+        rng = np.random.default_rng(0)
+        num = 10000
+        y_prob_m = rng.uniform(0, 1, num)
+        entropy = -plogp(y_prob_m) - plogp(1 - y_prob_m)
+        cond_info = entropy * rng.uniform(0, 1, num)
+        efficiency = (entropy - cond_info) / entropy
+        efficiency[rng.uniform(0, 1, num) < .1] = np.nan
+        stats = Lattice_Stats()
+        for k in range(0, num, 999):
+            sl = slice(k, k + 999)
+            stats.update(y_prob_m[sl], entropy[sl], cond_info[sl],
+                         efficiency[sl])
+        eff = efficiency[~np.isnan(efficiency)]
+        print("blocks:  ", stats.get_av_eff2()[0], stats.get_eff_var(),
+              stats.eff_min, stats.eff_max)
+        print("one pass:", np.mean(eff), np.var(eff), np.min(eff),
+              np.max(eff))
+
+
+    main()
@@ -0,0 +1,463 @@
+import numpy as np
+
+from Lattice_Stats import *
+from globals import *
+from utils import *
+
+ALL_ONES = np.uint64(2**64 - 1)
+
+
+def popcount(words):
+    """
+    This method returns the number of bits equal to 1 in each word
+
+    Parameters
+    ----------
+    words: np.array
+        dtype uint64
+
+    Returns
+    -------
+    np.array
+        same shape as words
+
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    # numpy < 2.0
+    bits = np.unpackbits(words[..., np.newaxis].view(np.uint8), axis=-1)
+    return bits.sum(axis=-1)
+
+
+def get_bernoulli_words(rand_words, prob):
+    """
+    This method returns words whose bits are 1 independently with
+    probability prob, rounded to a multiple of 2^(-num_prob_bits), where
+    num_prob_bits = len(rand_words). Bit r of the result is 1 iff the
+    num_prob_bits bit number U_r, whose kth binary digit (most significant
+    first) is the complement of bit r of rand_words[k] (which is just as
+    random, and saves a bitwise not), is less than prob. The comparison is
+    done one binary digit at a time, from the least significant one, for
+    all the 64 bits of a word at once.
+
+    Parameters
+    ----------
+    rand_words: np.array
+        shape (num_prob_bits, ...), uniformly random uint64 words
+    prob: float|np.array
+        a float, or an array of shape rand_words.shape[1:-1], i.e., one
+        probability per site
+
+    Returns
+    -------
+    np.array
+        shape rand_words.shape[1:]
+
+    """
+    num_prob_bits = len(rand_words)
+    assert num_prob_bits <= 62
+    threshold = np.minimum(np.round(np.asarray(prob) * 2**num_prob_bits),
+                           2**num_prob_bits).astype(np.int64)
+    less = np.zeros(rand_words.shape[1:], dtype=np.uint64)
+    first_k = num_prob_bits - 1
+    if threshold.ndim == 0 and threshold:
+        # less stays 0 over the trailing 0 digits of the threshold
+        first_k -= (int(threshold) & -int(threshold)).bit_length() - 1
+    for k in range(first_k, -1, -1):
+        # U < prob iff, at the first digit where they differ, U has a 0,
+        # i.e., rand_words has a 1
+        digit = (threshold >> (num_prob_bits - 1 - k)) & 1
+        if threshold.ndim == 0:
+            # in place, to avoid allocating temporary arrays
+            if digit:
+                np.bitwise_or(rand_words[k], less, out=less)
+            else:
+                np.bitwise_and(rand_words[k], less, out=less)
+        else:
+            digit = np.where(digit, ALL_ONES, np.uint64(0))[..., np.newaxis]
+            less = (digit & (rand_words[k] | less)) | \
+                (~digit & rand_words[k] & less)
+    # prob rounded to 1
+    less |= np.where(threshold == 2**num_prob_bits, ALL_ONES,
+                     np.uint64(0))[..., np.newaxis]
+    return less
+
+
+class Multispin_MC:
+    """
+    This class is a Monte Carlo simulation of the same X -> Y dynamics as
+    class Net, with the same parameters as class Cond_Prob. Instead of
+    replacing P(S^X) by the product of the marginals P(S_i^Y) after each
+    iteration, as Net does, it samples num_replicas independent copies of
+    the lattice of spins, S^Y from P(S^Y|S^X) and then S^X = S^Y, so it
+    keeps the correlations between the spins. Its metrics, compared to
+    those of a Net, measure the error of the factorized approximation. On
+    the first iteration, both start from the same product distribution, so
+    they agree up to the Monte Carlo noise.
+
+    The spins are stored with multispin coding: bit r of word w of site i
+    is 1 iff S_i = -1 in replica 64*w + r. Bitwise operations on a word
+    thus update a site in 64 replicas at once. For each site, the number
+    of nearest neighbors with S^X = -1 is counted by bit-sliced adders,
+    and the Bernoulli draw of S^Y is a bitwise comparison of random words
+    with the binary digits of P(S_i^Y=-1 | S_a^X, ..., S_d^X, S_i^X)
+    (see get_bernoulli_words()).
+
+    The metrics are calculated as in Net, except that the average over the
+    states of the nearest neighbors is taken over the replicas instead of
+    over the product of the marginals. This uses the exact conditional
+    probabilities (Rao-Blackwellization), which has less noise than
+    counting the sampled spins S^Y.
+
+    Only uniform coupling constants jj, h, lam are supported.
+
+    Attributes
+    ----------
+    av_eff: float
+    av_eff_flag: bool
+    beta: float
+    h: float
+    jj: float
+    lam: float
+    mag: float
+    nei_ids: np.array
+        shape (num_dnodes, 4), as in Net
+    num_cols: int
+    num_dnodes: int
+    num_iter: int
+    num_iter_done: int
+    num_prob_bits: int
+        the conditional probabilities are rounded to multiples of
+        2^(-num_prob_bits)
+    num_replicas: int
+        a multiple of 64
+    num_rows: int
+    num_words: int
+        num_replicas/64
+    p0: float|None
+    rng: np.random.Generator
+    stats: Lattice_Stats
+        aggregates of the Y nodes, see Net
+    x_words: np.array
+        shape (num_dnodes, num_words), uint64, spins S^X
+    y_cond_info: np.array
+        shape (num_dnodes,), H(S_i^Y|S_i^X)
+    y_efficiency: np.array
+        shape (num_dnodes,), np.nan when undefined
+    y_entropy: np.array
+        shape (num_dnodes,), H(S_i^Y)
+    y_prob_m: np.array
+        shape (num_dnodes,), P(S_i^Y=-1)
+    y_words: np.array
+        shape (num_dnodes, num_words), uint64, spins S^Y
+
+    """
+
+    def __init__(self, beta, jj, h=0, lam=0, num_iter=1, p0=.2,
+                 num_rows=DGRAPH_NUM_ROWS, num_cols=DGRAPH_NUM_COLS,
+                 num_replicas=64, num_prob_bits=24, seed=None,
+                 verbose=True):
+        """
+        constructor
+
+        Parameters
+        ----------
+        beta: float
+        jj: float
+        h: float
+        lam: float
+        num_iter: int
+        p0: float|None
+            P(S_i^X=-1) in every replica on the first iteration. If None,
+            a random P(S_i^X=-1) for each site, as in Net
+        num_rows: int
+        num_cols: int
+        num_replicas: int
+            rounded up to a multiple of 64
+        num_prob_bits: int
+        seed: int|np.random.SeedSequence|np.random.Generator|None
+            seed of self.rng. See Net
+        verbose: bool
+            True iff mag and av_eff are printed after each iteration
+        """
+        for x in [jj, h, lam]:
+            assert np.ndim(x) == 0, "only uniform couplings are supported"
+        self.beta = beta
+        self.jj = jj
+        self.h = h
+        self.lam = lam
+        self.num_iter = num_iter
+        self.p0 = p0
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_dnodes = num_rows * num_cols
+        self.num_words = -(-num_replicas // 64)
+        self.num_replicas = 64 * self.num_words
+        self.num_prob_bits = num_prob_bits
+        self.rng = np.random.default_rng(seed)
+        self.nei_ids = get_nei_ids(num_rows, num_cols)
+        num_nei = np.sum(self.nei_ids >= 0, axis=1)
+        # sites grouped by number of nearest neighbors (4 inside, 3 on the
+        # edges, 2 at the corners), since the first num_nei columns of
+        # nei_ids are then the valid ones
+        self._num_nei_to_ids = {int(n): np.nonzero(num_nei == n)[0] for n
+                                in np.unique(num_nei)}
+        self.init_x_words(p0)
+
+        self.num_iter_done = 0
+        for i in range(num_iter):
+            self.sweep()
+            self.mag = self.get_mag()
+            self.av_eff, self.av_eff_flag = self.get_av_eff2()
+            self.num_iter_done = i + 1
+            if self.av_eff_flag:
+                av_eff_str = f"{self.av_eff:.5f}"
+            else:
+                av_eff_str = "undef"
+            if verbose:
+                print(f"{i + 1}, mag={self.mag:.5f}, av_eff={av_eff_str}")
+            if av_eff_str == "undef":
+                break
+
+            self.load_x_spins()
+
+    def get_cond_prob_m(self, num_nei, num_m, x_spin):
+        """
+        This method returns P(S_i^Y=-1 | S_a^X, ..., S_d^X, S_i^X) for a
+        site with num_nei nearest neighbors, num_m of which are in state
+        -1. Same as Cond_Prob.calc_cond_probs_y_if_abcd_x().
+
+        Parameters
+        ----------
+        num_nei: int
+        num_m: int
+        x_spin: int
+
+        Returns
+        -------
+        float
+
+        """
+        u = self.jj * (num_nei - 2 * num_m) + self.h + self.lam * x_spin
+        return float(np.exp(-np.logaddexp(0, 2 * self.beta * u)))
+
+    def get_rand_words(self, num_sites):
+        """
+        This method returns uniformly random words.
+
+        Parameters
+        ----------
+        num_sites: int
+
+        Returns
+        -------
+        np.array
+            shape (num_prob_bits, num_sites, num_words), uint64
+
+        """
+        size = self.num_prob_bits * num_sites * self.num_words
+        return self.rng.bit_generator.random_raw(size).reshape(
+            self.num_prob_bits, num_sites, self.num_words)
+
+    def init_x_words(self, p0):
+        """
+        This method sets self.x_words to independent spins with
+        P(S_i^X=-1) = p0 (or random, if p0 is None, as in Net).
+
+        Parameters
+        ----------
+        p0: float|None
+
+        Returns
+        -------
+        None
+
+        """
+        if p0 is None:
+            prob_m = self.rng.uniform(0, 1, self.num_dnodes)
+        else:
+            prob_m = np.full(self.num_dnodes, float(p0))
+        self.x_words = get_bernoulli_words(
+            self.get_rand_words(self.num_dnodes), prob_m)
+
+    def sweep(self):
+        """
+        This method samples self.y_words from self.x_words, and calculates
+        the metrics of the Y nodes, and their aggregates self.stats, one
+        group of sites at a time.
+
+        Returns
+        -------
+        None
+
+        """
+        # a missing neighbor reads the extra row of 0s (state +1), and is
+        # not counted since only the first num_nei neighbors are
+        x_words = np.concatenate(
+            [self.x_words, np.zeros((1, self.num_words), dtype=np.uint64)])
+        self.y_words = np.zeros_like(self.x_words)
+        self.y_prob_m = np.zeros(self.num_dnodes)
+        self.y_cond_info = np.zeros(self.num_dnodes)
+        self.y_entropy = np.zeros(self.num_dnodes)
+        self.y_efficiency = np.zeros(self.num_dnodes)
+        self.stats = Lattice_Stats()
+        for num_nei, ids in self._num_nei_to_ids.items():
+            # number of neighbors in state -1, as 3 bit slices
+            count = [np.zeros((len(ids), self.num_words), dtype=np.uint64)
+                     for _ in range(3)]
+            for k in range(num_nei):
+                carry = x_words[self.nei_ids[ids, k]]
+                for b in range(3):
+                    count[b], carry = count[b] ^ carry, count[b] & carry
+            x_m = self.x_words[ids]
+            rand_words = self.get_rand_words(len(ids))
+            y_words = np.zeros_like(x_m)
+            for num_m in range(num_nei + 1):
+                mask_m = np.full(x_m.shape, ALL_ONES)
+                for b in range(3):
+                    mask_m &= count[b] if (num_m >> b) & 1 else ~count[b]
+                for x_spin, x_mask in [(-1, x_m), (1, ~x_m)]:
+                    mask = mask_m & x_mask
+                    prob_m = self.get_cond_prob_m(num_nei, num_m, x_spin)
+                    y_words |= mask & get_bernoulli_words(rand_words,
+                                                          prob_m)
+                    # Rao-Blackwellized metrics
+                    frac = popcount(mask).sum(axis=1) / self.num_replicas
+                    self.y_prob_m[ids] += frac * prob_m
+                    self.y_cond_info[ids] -= frac * (
+                        plogp(prob_m) + plogp(1 - prob_m))
+            self.y_words[ids] = y_words
+            self.y_entropy[ids], self.y_efficiency[ids] = \
+                calc_entropy_and_efficiency(self.y_prob_m[ids],
+                                            self.y_cond_info[ids])
+            self.stats.update(self.y_prob_m[ids], self.y_entropy[ids],
+                              self.y_cond_info[ids], self.y_efficiency[ids])
+
+    def get_mag(self):
+        """
+        This method returns the magnetization (1/num_dnodes)\\sum_i S_i^Y,
+        averaged over the replicas
+
+        Returns
+        -------
+        float
+
+        """
+        return self.stats.get_mag()
+
+    def get_sampled_mag(self):
+        """
+        This method returns the magnetization of the sampled spins S^Y of
+        each replica
+
+        Returns
+        -------
+        np.array
+            shape (num_replicas,)
+
+        """
+        bits = np.unpackbits(self.y_words.view(np.uint8), axis=1,
+                             bitorder="little")
+        return 1 - 2 * bits.mean(axis=0)
+
+    def get_spins(self):
+        """
+        This method returns the sampled spins S^Y of each replica, as
+        lattice snapshots, e.g., for spatial.py
+
+        Returns
+        -------
+        np.array
+            shape (num_replicas, num_rows, num_cols), dtype int8, entries
+            -1 or +1
+
+        """
+        bits = np.unpackbits(self.y_words.view(np.uint8), axis=1,
+                             bitorder="little")
+        spins = 1 - 2 * bits.T.astype(np.int8)
+        return spins.reshape(self.num_replicas, self.num_rows,
+                             self.num_cols)
+
+    def get_av_entropy_and_cond_info(self):
+        """
+        This method returns a pair
+
+        (average entropy, average conditional info)
+
+        See Net.get_av_entropy_and_cond_info()
+
+        Returns
+        -------
+        tuple[float]
+
+        """
+        return self.stats.get_av_entropy_and_cond_info()
+
+    def get_av_eff2(self):
+        """
+        This method returns a tuple
+
+        (av_eff, no_undef_eff)
+
+        See Net.get_av_eff2()
+
+        Returns
+        -------
+        (float, bool)
+
+        """
+        return self.stats.get_av_eff2()
+
+    def load_x_spins(self):
+        """
+        This method advances the simulation one time slice, S^X = S^Y.
+        Unlike Net.load_x_node_probs(), this keeps the correlations.
+
+        Returns
+        -------
+        None
+
+        """
+        self.x_words = self.y_words
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from Net import Net
+
+
+    def main1():
+        # factorized Net versus Monte Carlo on the default 5x5 lattice
+        kwargs = dict(beta=BETA_JJ_CURIE * 1.2, jj=1, h=.05, lam=.1,
+                      num_iter=8, p0=.4)
+        net = Net(**kwargs, backend="numpy", verbose=False,
+                  make_nodes=False, keep_history=True)
+        mc = Multispin_MC(**kwargs, num_replicas=64 * 256, seed=1,
+                          verbose=False)
+        print("first iteration, Net:", net.history["mag"][0],
+              net.history["av_eff"][0])
+        mc1 = Multispin_MC(**dict(kwargs, num_iter=1),
+                           num_replicas=64 * 256, seed=1, verbose=False)
+        print("first iteration, MC: ", mc1.get_mag(), mc1.get_av_eff2()[0])
+        print(f"iteration {kwargs['num_iter']}, Net:", net.get_mag(),
+              net.get_av_eff2()[0])
+        print(f"iteration {kwargs['num_iter']}, MC: ", mc.get_mag(),
+              mc.get_av_eff2()[0])
+
+
+    def main2():
+        num_rows = num_cols = 256
+        num_iter = 10
+        t0 = perf_counter()
+        mc = Multispin_MC(BETA_JJ_CURIE * 1.2, 1, num_iter=num_iter, p0=.4,
+                          num_rows=num_rows, num_cols=num_cols,
+                          num_replicas=64, seed=1, verbose=False)
+        time = perf_counter() - t0
+        num_updates = num_iter * mc.num_dnodes * mc.num_replicas
+        print(f"{num_rows}x{num_cols}, {mc.num_replicas} replicas, "
+              f"mag={mc.get_mag():.5f}, "
+              f"{time / num_updates * 1e9:.1f} ns per spin update")
+
+
+    main1()
+    main2()
@@ -1,44 +1,141 @@
-import itertools
 from plotting import *
-from math import prod
 
 from Cond_Prob import *
+from Lattice_Stats import *
 from Node import *
+from Sweep_Backend import *
 from globals import *
+from symmetry import *
 from utils import *
 
 
 class Net:
     """
+    The probabilities and information metrics of the nodes are stored in
+    numpy arrays (x_probs, y_probs, y_entropy, ...) that are updated by a
+    Sweep_Backend at each iteration. The Node objects in x_nodes and y_nodes
+    (if make_nodes=True) are refreshed from those arrays by update_nodes(),
+    which is called at the end of the constructor.
+
     Attributes
     ----------
     av_eff: float
-        average efficiency (1/NUM_DNODES) \\sum_i epsilon(S_i^Y|S_i^X)
+        average efficiency (1/num_dnodes) \\sum_i epsilon(S_i^Y|S_i^X)
+    backend: Sweep_Backend
+        object that performs the sweeps of the lattice
     beta: float
         1/T, inverse temperature
+    bond_jj: np.array
+        shape (num_dnodes, 4), coupling constant of the bond between node i
+        and its kth nearest neighbor. Zero for missing neighbors
     cpt: Cond_Prob
         object of class Cond_Prob
-    h: float
+    do_gauss_seidel: bool
+        True iff P(S_i^X) is replaced by P(S_i^Y) as soon as node i is
+        updated, instead of at the end of the sweep
+    do_tangents: bool
+        True iff the derivatives of P(S_i^Y=-1) with respect to beta and h
+        (see x_tangents) are calculated alongside the sweeps
+    h: float|np.array
         magnetic field, coupling constant, energy contribution is $-h* S_i^Y$,
-        h=0 in this study
-    jj: float
+        h=0 in this study. An array of shape (num_dnodes,) gives a different
+        h at each site (random field models)
+    history: dict[str, np.array]|None
+        if keep_history=True, the state after each iteration: "y_prob_m"
+        and "y_efficiency", of shape (num_iter_done, num_dnodes), with
+        P(S_i^Y=-1) and epsilon(S_i^Y|S_i^X) (np.nan when undefined), and
+        "mag" and "av_eff", of shape (num_iter_done,). None otherwise
+    jj: float|np.array|tuple[np.array]
         coupling constant, energy contribution is
-        $-jj* S_i^Y(S_a^X + S_b^X + S_c^X + S_d^X)$
-    lam: float
+        $-jj* S_i^Y(S_a^X + S_b^X + S_c^X + S_d^X)$. Heterogeneous bonds
+        (random bond models) are given either as an array of shape
+        (num_dnodes, 4) with the same layout as bond_jj, or as a tuple
+        (jj_right, jj_down) of arrays of shape (num_rows, num_cols). See
+        utils.get_bond_jj()
+    lam: float|np.array
         coupling constant, energy contribution is $-lam* S_i^X S_i^Y$. lam=0
-        in this study
+        in this study. An array of shape (num_dnodes,) gives a different
+        lam at each site
     mag: float
-        magnetization (1/NUM_DNODES)\\sum_i S_i^Y
+        magnetization (1/num_dnodes)\\sum_i S_i^Y
+    max_delta: float|None
+        max_i |P(S_i^Y) - P(S_i^X)| in the last iteration
+    max_tangent_delta: float|None
+        same as max_delta, for y_tangents and x_tangents
+    nei_ids: np.array
+        shape (num_dnodes, 4), 0 based id_num of the nearest neighbors of
+        each node, padded with -1
+    num_cols: int
+        number of columns of the lattice, DGRAPH_NUM_COLS by default
+    num_dnodes: int
+        number of dnodes, num_rows*num_cols
     num_iter: int
         number of  iterations
+    num_iter_done: int
+        number of iterations actually performed. Less than num_iter if the
+        iterations stopped because av_eff became undefined, or because
+        they converged (see tol)
+    num_rows: int
+        number of rows of the lattice, DGRAPH_NUM_ROWS by default
+    orbit_rep_of: np.array|None
+        shape (num_dnodes,), the representative site of the orbit of each
+        site under the symmetries of the Net (see symmetry.py). None if the
+        symmetries are not used
+    orbit_reps: np.array|None
+        shape (num_orbits,), the representative sites, the only ones
+        calculated by the sweeps. None if the symmetries are not used
+    orbit_sizes: np.array|None
+        shape (num_dnodes,), the size of the orbit of each representative
+        site, 0 for the other sites. None if the symmetries are not used
+    rng: np.random.Generator
+        source of all the randomness of the Net (random p0, Node.sample())
+    site_h: np.array
+        shape (num_dnodes,), h at each site
+    site_lam: np.array
+        shape (num_dnodes,), lam at each site
+    stats: Lattice_Stats
+        aggregates of the Y nodes of the last iteration (magnetization,
+        average efficiency, etc.), accumulated by self.backend during the
+        sweep, from which get_mag(), get_av_eff2(), get_product_variance(),
+        etc. are returned
+    tol: float|None
+        tolerance used to stop the iterations when they have converged
     x_nodes: list[Node]
-        list of X nodes S_i^X, i=1,2, ..., NUM_DNODES
+        list of X nodes S_i^X, i=1,2, ..., num_dnodes
+    x_probs: np.array
+        shape (num_dnodes, 2), x_probs[i-1] = [P(S_i^X=-1), P(S_i^X=+1)]
+    x_tangents: np.array|None
+        shape (num_dnodes, 2), x_tangents[i-1] = [d P(S_i^X=-1)/d beta,
+        d P(S_i^X=-1)/d h], the order of Sweep_Backend.TANGENT_PARAMS. The
+        derivative with respect to h is for a uniform shift of h. None if
+        do_tangents=False
+    y_cond_info: np.array
+        shape (num_dnodes,), H(S_i^Y|S_i^X)
+    y_cond_info_tangents: np.array|None
+        shape (num_dnodes, 2), derivatives of H(S_i^Y|S_i^X), same layout
+        as x_tangents
+    y_efficiency: np.array
+        shape (num_dnodes,), epsilon(S_i^Y|S_i^X), np.nan when undefined
+    y_entropy: np.array
+        shape (num_dnodes,), H(S_i^Y)
+    y_mutual_info: np.array
+        shape (num_dnodes,), H(S_i^Y:S_i^X)
     y_nodes: list[Node]
-        list of Y nodes S_i^Y, i=1,2, ..., NUM_DNODES
+        list of Y nodes S_i^Y, i=1,2, ..., num_dnodes
+    y_probs: np.array
+        shape (num_dnodes, 2), y_probs[i-1] = [P(S_i^Y=-1), P(S_i^Y=+1)]
+    y_tangents: np.array|None
+        shape (num_dnodes, 2), derivatives of P(S_i^Y=-1), same layout as
+        x_tangents
     """
 
     def __init__(self, beta, jj, h=0, lam=0,
-                 num_iter=1, p0=.2, do_reversing=False):
+                 num_iter=1, p0=.2, do_reversing=False,
+                 backend="python", do_gauss_seidel=False, verbose=True,
+                 num_rows=DGRAPH_NUM_ROWS, num_cols=DGRAPH_NUM_COLS,
+                 init_x_probs=None, tol=None, make_nodes=True, seed=None,
+                 use_symmetry=True, do_tangents=False, keep_history=False,
+                 callback=None):
         """
 
         Parameters
@@ -54,6 +151,57 @@ class Net:
         do_reversing: bool
             False iff update S_i^X nodes in order of increasing i. True iff
             update the nodes in order of decreasing (reversed) i.
+        backend: str|Sweep_Backend
+            "python", "numpy" or "numba", or a Sweep_Backend object. See
+            get_sweep_backend()
+        do_gauss_seidel: bool
+            The order of the updates only matters when this is True
+        verbose: bool
+            True iff mag and av_eff are printed after each iteration
+        num_rows: int
+        num_cols: int
+        init_x_probs: np.array|None
+            shape (num_dnodes,) or (num_dnodes, 2). If not None,
+            P(S_i^X=-1) (or [P(S_i^X=-1), P(S_i^X=+1)]) on the first
+            iteration, instead of the value given by p0. Used to warm
+            start the iterations, e.g., in multigrid.py
+        tol: float|None
+            If not None, the iterations stop as soon as P(S_i^Y) changes by
+            less than tol for every node i
+        make_nodes: bool
+            False iff the lists of Node objects x_nodes and y_nodes are not
+            created. Creating them is slow for large lattices, and they are
+            only needed to plot the lattice or to inspect the nodes.
+        seed: int|np.random.SeedSequence|np.random.Generator|None
+            seed of self.rng. Two Nets with the same seed give the same
+            results. Parallel runs should use independent seeds spawned
+            from one np.random.SeedSequence (see utils.spawn_seeds()). If
+            None, self.rng is seeded from the OS
+        use_symmetry: bool
+            True iff the sweeps calculate only one site per orbit of the
+            symmetries of the lattice that leave the initial P(S_i^X) and
+            the couplings invariant (up to 8 times fewer sites for a
+            uniform p0 on a square lattice), and copy the results to the
+            other sites. It falls back to calculating all the sites when
+            there are no such symmetries (e.g., random p0 or disorder), or
+            when do_gauss_seidel=True, since the order of the updates then
+            breaks the symmetries
+        do_tangents: bool
+            True iff the derivatives of P(S_i^Y=-1) and H(S_i^Y|S_i^X) with
+            respect to beta and h are propagated alongside the sweeps
+            (forward mode differentiation), starting from a P(S_i^X) that
+            does not depend on them. When the iterations converge, they
+            converge to the derivatives of the fixed point. See
+            get_mag_tangents(), get_av_eff_tangents() and
+            critical_point.py. Not available with do_gauss_seidel=True
+        keep_history: bool
+            True iff the marginals and efficiencies of every iteration are
+            kept in self.history, e.g., to animate the run with
+            animate.py
+        callback: Callable[[Net], None]|None
+            If not None, called with this Net after each iteration, once
+            self.mag, self.av_eff, etc. are up to date, e.g., to stream the
+            metrics of a run (see Net_Service.py)
         """
         self.beta = beta
         self.jj = jj
@@ -62,9 +210,31 @@ class Net:
         self.num_iter = num_iter
         self.p0 = p0
         self.cpt = Cond_Prob(beta, jj, h, lam)
+        self.backend = get_sweep_backend(backend)
+        self.do_gauss_seidel = do_gauss_seidel
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_dnodes = num_rows * num_cols
+        self.tol = tol
+        self.max_delta = None
+        self.do_tangents = do_tangents
+        self.max_tangent_delta = None
+        assert not (do_tangents and do_gauss_seidel), \
+            "do_tangents requires do_gauss_seidel=False"
+        self.rng = np.random.default_rng(seed)
+        self.create_arrays(p0, init_x_probs)
+        self.orbit_reps = None
+        self.orbit_rep_of = None
+        self.orbit_sizes = None
+        if use_symmetry and not do_gauss_seidel:
+            self.find_orbits()
         self.x_nodes = []
         self.y_nodes = []
-        self.create_nodes(p0)
+        if make_nodes:
+            self.create_nodes()
+        self.num_iter_done = 0
+        history = {"y_prob_m": [], "y_efficiency": [], "mag": [],
+                   "av_eff": []}
         for i in range(num_iter):
             if do_reversing:
                 reversed_sweep = bool(i % 2)
@@ -73,15 +243,37 @@ class Net:
             self.calc_y_node_params(reversed_sweep)
             self.mag = self.get_mag()
             self.av_eff, self.av_eff_flag = self.get_av_eff2()
+            self.num_iter_done = i + 1
+            if keep_history:
+                history["y_prob_m"].append(self.y_probs[:, 0].copy())
+                history["y_efficiency"].append(self.y_efficiency.copy())
+                history["mag"].append(self.mag)
+                history["av_eff"].append(np.nan if self.av_eff is None
+                                         else self.av_eff)
             if self.av_eff_flag:
                 av_eff_str = f"{self.av_eff:.5f}"
             else:
                 av_eff_str = "undef"
-            print(f"{i + 1}, mag={self.mag:.5f}, av_eff={av_eff_str}")
+            if verbose:
+                print(f"{i + 1}, mag={self.mag:.5f}, av_eff={av_eff_str}")
+            if callback is not None:
+                callback(self)
             if av_eff_str == "undef":
                 break
 
             self.load_x_node_probs()
+            if tol is not None and self.max_delta < tol and \
+                    (not do_tangents or self.max_tangent_delta < tol):
+                break
+        self.history = None
+        if keep_history:
+            shape = (self.num_iter_done, self.num_dnodes)
+            self.history = {
+                "y_prob_m": np.reshape(history["y_prob_m"], shape),
+                "y_efficiency": np.reshape(history["y_efficiency"], shape),
+                "mag": np.array(history["mag"], dtype=float),
+                "av_eff": np.array(history["av_eff"], dtype=float)}
+        self.update_nodes()
 
     def get_nd_from_id(self, id_num, type):
         """
@@ -98,37 +290,119 @@ class Net:
         Node
 
         """
-        assert id_num - 1 in range(NUM_DNODES)
+        assert self.y_nodes, "Net was created with make_nodes=False"
+        assert id_num - 1 in range(self.num_dnodes)
         if type == "X":
             return self.x_nodes[id_num - 1]
         elif type == "Y":
             return self.y_nodes[id_num - 1]
         assert None, "this node type does not exist"
 
-    def create_nodes(self, p0):
+    def create_arrays(self, p0, init_x_probs=None):
         """
-        This method creates separate lists self.x_nodes and self.y_nodes
-        of Node objects.
+        This method creates the arrays that are updated by the sweeps:
+        self.x_probs, self.y_probs, etc., and the arrays that describe the
+        lattice: self.nei_ids, self.bond_jj, etc.
 
         Parameters
         ----------
         p0: float|None
+        init_x_probs: np.array|None
 
         Returns
         -------
         None
 
         """
-        for nd_id in range(1, NUM_DNODES + 1):
-            x_node = Node(nd_id, "X", p0)
-            y_node = Node(nd_id, "Y", p0)
+        num = self.num_dnodes
+        if init_x_probs is not None:
+            init_x_probs = np.asarray(init_x_probs, dtype=float)
+            if init_x_probs.ndim == 1:
+                init_x_probs = np.stack([init_x_probs, 1 - init_x_probs],
+                                        axis=1)
+            assert init_x_probs.shape == (num, 2)
+            self.x_probs = init_x_probs.copy()
+        elif p0 is None:
+            # same distribution as the random p0 of class Node
+            prob_m = self.rng.uniform(0, 1, num)
+            self.x_probs = np.stack([prob_m, 1 - prob_m], axis=1)
+        else:
+            self.x_probs = np.tile([p0, 1 - p0], (num, 1))
+        self.y_probs = self.x_probs.copy()
+        self.nei_ids = get_nei_ids(self.num_rows, self.num_cols)
+        valid = self.nei_ids >= 0
+        if isinstance(self.jj, tuple):
+            self.bond_jj = get_bond_jj(self.nei_ids, *self.jj)
+        else:
+            self.bond_jj = np.broadcast_to(
+                np.asarray(self.jj, dtype=float), valid.shape) * valid
+        self.site_h = np.broadcast_to(
+            np.asarray(self.h, dtype=float), (num,)).copy()
+        self.site_lam = np.broadcast_to(
+            np.asarray(self.lam, dtype=float), (num,)).copy()
+        self.y_entropy = np.zeros(num)
+        self.y_cond_info = np.zeros(num)
+        self.y_mutual_info = np.zeros(num)
+        self.y_efficiency = np.full(num, np.nan)
+        self.stats = Lattice_Stats.from_arrays(
+            self.y_probs[:, 0], self.y_entropy, self.y_cond_info,
+            self.y_efficiency)
+        self.x_tangents = None
+        self.y_tangents = None
+        self.y_cond_info_tangents = None
+        if self.do_tangents:
+            # P(S_i^X) of the first iteration is independent of beta and h
+            self.x_tangents = np.zeros((num, len(TANGENT_PARAMS)))
+            self.y_tangents = np.zeros((num, len(TANGENT_PARAMS)))
+            self.y_cond_info_tangents = np.zeros((num, len(TANGENT_PARAMS)))
+
+    def create_nodes(self):
+        """
+        This method creates separate lists self.x_nodes and self.y_nodes
+        of Node objects. Their probs are taken from self.x_probs and
+        self.y_probs.
+
+        Returns
+        -------
+        None
+
+        """
+        for nd_id in range(1, self.num_dnodes + 1):
+            p0 = self.x_probs[nd_id - 1, 0]
+            x_node = Node(nd_id, "X", p0, self.num_rows, self.num_cols,
+                          rng=self.rng)
+            y_node = Node(nd_id, "Y", p0, self.num_rows, self.num_cols,
+                          rng=self.rng)
             self.x_nodes.append(x_node)
             self.y_nodes.append(y_node)
+        self.update_nodes()
+
+    def find_orbits(self):
+        """
+        This method sets self.orbit_reps, self.orbit_rep_of and
+        self.orbit_sizes if the Net has symmetries other than the identity.
+        See symmetry.py
+
+        Returns
+        -------
+        None
+
+        """
+        perms = get_invariant_perms(self.num_rows, self.num_cols,
+                                    self.x_probs, self.nei_ids,
+                                    self.bond_jj, self.site_h,
+                                    self.site_lam)
+        if len(perms) > 1:
+            self.orbit_reps, self.orbit_rep_of = get_orbits(perms)
+            self.orbit_sizes = np.bincount(self.orbit_rep_of,
+                                           minlength=self.num_dnodes)
 
     def calc_y_node_params(self, reversed_sweep=False):
         """
         For each node, this method calculates and stores values of various
-        attributes
+        attributes. The calculation of P(S_i^Y) and H(S_i^Y|S_i^X), and of
+        their aggregates self.stats, is delegated to self.backend. The Node
+        objects are not refreshed by this method (see update_nodes()).
 
         Parameters
         ----------
@@ -139,70 +413,97 @@ class Net:
         None
 
         """
-        if not reversed_sweep:
-            id_range = range(1, NUM_DNODES + 1)
+        if self.orbit_reps is not None:
+            # only one site per orbit, the order is irrelevant
+            id_order = self.orbit_reps
         else:
-            id_range = reversed(range(1, NUM_DNODES + 1))
-        for nd_id in id_range:
-            # print("lmjk", nd_id)
-            y_nd = self.get_nd_from_id(nd_id, "Y")
-            x_nd = self.get_nd_from_id(nd_id, "X")
-            cond_info = 0
-            prob_m = 0
-            prob_p = 0
-            num_nearest_nei = len(y_nd.nearest_nei)
-            nearest_nei_x_nds = [self.get_nd_from_id(nd_id, "X") for
-                                 nd_id in y_nd.nearest_nei]
-            for nearest_nei_states in itertools.product(
-                    [-1, 1], repeat=num_nearest_nei):
-                prob_nearest_nei = prod(
-                    [nearest_nei_x_nds[i].probs[
-                         (nearest_nei_states[i] + 1) // 2] for i in \
-                     range(num_nearest_nei)])
-                for x_spin in [-1, 1]:
-                    x_nd_prob = x_nd.probs[(x_spin + 1) // 2]
-                    cond_prob_m, cond_prob_p, zz = \
-                        self.cpt.calc_cond_probs_y_if_abcd_x(
-                            nearest_nei_states, x_spin)
-                    joint_prob_m = (cond_prob_m * prob_nearest_nei *
-                                    x_nd_prob)
-                    joint_prob_p = (cond_prob_p * prob_nearest_nei *
-                                    x_nd_prob)
-                    prob_m += joint_prob_m
-                    prob_p += joint_prob_p
-                    # if nd_id == 12:
-                    #     print("----------")
-                    #     print("nearest, xspin", nearest_nei_states, x_spin)
-                    #     print("mjrt-minus", cond_prob_m, prob_nearest_nei,
-                    #           joint_prob_m, prob_m)
-                    #     print("mjrt-plus", cond_prob_p, prob_nearest_nei,
-                    #           joint_prob_p, prob_p)
-
-                    cond_info -= joint_prob_m * np.log(cond_prob_m)
-                    cond_info -= joint_prob_p * np.log(cond_prob_p)
-            y_nd.probs = [prob_m, prob_p]
-            y_nd.entropy = coin_toss_entropy(prob_m)
-            y_nd.cond_info = cond_info
-            y_nd.mutual_info = y_nd.entropy - cond_info
-            y_nd.set_efficiency()
-            # print("mgbyt-mutual, entropy, eff", y_nd.mutual_info,
-            #       y_nd.entropy, y_nd.efficiency)
+            id_order = np.arange(self.num_dnodes)
+            if reversed_sweep:
+                id_order = id_order[::-1]
+        old_x_probs = self.x_probs.copy()
+        self.stats = Lattice_Stats()
+        self.y_probs, self.y_cond_info = self.backend.sweep(
+            self, id_order, self.do_gauss_seidel, self.stats)
+        if self.do_tangents:
+            self.calc_y_tangents(id_order)
+        if self.orbit_rep_of is not None:
+            self.y_probs = self.y_probs[self.orbit_rep_of]
+            self.y_cond_info = self.y_cond_info[self.orbit_rep_of]
+        self.max_delta = float(np.max(np.abs(self.y_probs - old_x_probs)))
+        self.y_entropy, self.y_efficiency = calc_entropy_and_efficiency(
+            self.y_probs[:, 0], self.y_cond_info)
+        self.y_mutual_info = self.y_entropy - self.y_cond_info
+
+    def calc_y_tangents(self, ids, block_size=2**14):
+        """
+        This method calculates self.y_tangents and
+        self.y_cond_info_tangents for the nodes in ids, from self.x_probs
+        and self.x_tangents, and copies them to the other sites of the
+        orbits of the nodes, if the symmetries are used. It is always done
+        with the numpy kernel calc_y_tangents_block(), whatever the
+        backend.
+
+        Parameters
+        ----------
+        ids: np.array
+            0 based ids of the nodes
+        block_size: int
+            number of nodes per call to calc_y_tangents_block()
+
+        Returns
+        -------
+        None
+
+        """
+        for k in range(0, len(ids), block_size):
+            block = ids[k: k + block_size]
+            self.y_tangents[block], self.y_cond_info_tangents[block] = \
+                calc_y_tangents_block(self.x_probs, self.x_tangents,
+                                      self.nei_ids, self.bond_jj,
+                                      self.site_h, self.site_lam, self.beta,
+                                      block)
+        if self.orbit_rep_of is not None:
+            self.y_tangents = self.y_tangents[self.orbit_rep_of]
+            self.y_cond_info_tangents = \
+                self.y_cond_info_tangents[self.orbit_rep_of]
+        self.max_tangent_delta = float(np.max(np.abs(self.y_tangents -
+                                                     self.x_tangents)))
+
+    def update_nodes(self):
+        """
+        This method copies the values stored in the arrays self.x_probs,
+        self.y_probs, self.y_entropy, etc., into the attributes of the Node
+        objects in self.x_nodes and self.y_nodes, if they were created
+
+        Returns
+        -------
+        None
+
+        """
+        for i in range(len(self.y_nodes)):
+            x_nd = self.x_nodes[i]
+            y_nd = self.y_nodes[i]
+            x_nd.probs = self.x_probs[i].tolist()
+            y_nd.probs = self.y_probs[i].tolist()
+            y_nd.entropy = float(self.y_entropy[i])
+            y_nd.cond_info = float(self.y_cond_info[i])
+            y_nd.mutual_info = float(self.y_mutual_info[i])
+            if np.isnan(self.y_efficiency[i]):
+                y_nd.efficiency = None
+            else:
+                y_nd.efficiency = float(self.y_efficiency[i])
 
     def get_mag(self):
         """
         This method returns the magnetization of the lattice
-        (1/NUM_DNODES)\\sum_i S_i^Y
+        (1/num_dnodes)\\sum_i S_i^Y
 
         Returns
         -------
         float
 
         """
-        mag = 0
-        for y_nd in self.y_nodes:
-            mag += -y_nd.probs[0] + y_nd.probs[1]
-            # print("mnk", y_nd.probs[0], y_nd.probs[1], mag)
-        return mag / NUM_DNODES
+        return self.stats.get_mag()
 
     def get_av_entropy_and_cond_info(self):
         """
@@ -217,12 +518,7 @@ class Net:
         -------
         tuple[float]
         """
-        sum_cond_info = 0
-        sum_ent = 0
-        for y_nd in self.y_nodes:
-            sum_cond_info += y_nd.cond_info
-            sum_ent += y_nd.entropy
-        return sum_ent / NUM_DNODES, sum_cond_info / NUM_DNODES
+        return self.stats.get_av_entropy_and_cond_info()
 
     def get_av_eff2(self):
         """
@@ -241,20 +537,120 @@ class Net:
         (float, bool)
 
         """
-        sum_eff = 0
-        num = 0
-        no_undef_eff = True
-        for y_nd in self.y_nodes:
-            if y_nd.efficiency is not None:
-                sum_eff += y_nd.efficiency
-                num += 1
-            else:
-                no_undef_eff = False
-        if num:
-            av_eff = sum_eff / num
-        else:
-            av_eff = None
-        return av_eff, no_undef_eff
+        return self.stats.get_av_eff2()
+
+    def get_product_variance(self):
+        """
+        This method returns the average variance of a single spin S_i^Y,
+        under its marginal P(S_i^Y). It is not a susceptibility, since it
+        ignores the correlations between nodes (see
+        Lattice_Stats.get_product_variance()). For the susceptibility,
+        see get_mag_tangents().
+
+        Returns
+        -------
+        float
+
+        """
+        return self.stats.get_product_variance()
+
+    def get_eff_var(self):
+        """
+        This method returns the variance of the efficiency over the nodes
+        whose efficiency is well defined, or None if there are none
+
+        Returns
+        -------
+        float|None
+
+        """
+        return self.stats.get_eff_var()
+
+    def get_eff_min_max(self):
+        """
+        This method returns a pair
+
+        (min efficiency, max efficiency)
+
+        over the nodes whose efficiency is well defined, or None if there
+        are none
+
+        Returns
+        -------
+        tuple[float]|None
+
+        """
+        if not self.stats.num_eff:
+            return None
+        return self.stats.eff_min, self.stats.eff_max
+
+    def get_mag_tangents(self):
+        """
+        This method returns the derivatives of the magnetization
+        (1/num_dnodes)\\sum_i S_i^Y with respect to beta and h. d mag/d h
+        is the magnetic susceptibility. Requires do_tangents=True.
+
+        Returns
+        -------
+        np.array
+            shape (2,), [d mag/d beta, d mag/d h]
+
+        """
+        assert self.do_tangents, "Net was created with do_tangents=False"
+        # mag = (1/num_dnodes) sum_i (1 - 2 P(S_i^Y=-1))
+        return -2 * np.sum(self.y_tangents, axis=0) / self.num_dnodes
+
+    def get_av_eff_tangents(self):
+        """
+        This method returns the derivatives of av_eff (see get_av_eff2())
+        with respect to beta and h, averaged over the same nodes (those
+        with a defined efficiency). Requires do_tangents=True.
+
+        Returns
+        -------
+        np.array|None
+            shape (2,), [d av_eff/d beta, d av_eff/d h]. None if no node
+            has a defined efficiency
+
+        """
+        assert self.do_tangents, "Net was created with do_tangents=False"
+        defined = ~np.isnan(self.y_efficiency)
+        if not np.any(defined):
+            return None
+        prob_m = self.y_probs[defined, 0, np.newaxis]
+        entropy = self.y_entropy[defined, np.newaxis]
+        cond_info = self.y_cond_info[defined, np.newaxis]
+        # dH/dp = log((1-p)/p), zero where H is set to zero
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dentropy = np.where(
+                entropy > 0, self.y_tangents[defined] *
+                np.log((1 - prob_m) / prob_m), 0.0)
+            # eff = 1 - cond_info/H
+            deff = -(self.y_cond_info_tangents[defined] * entropy -
+                     cond_info * dentropy) / entropy ** 2
+        return np.mean(deff, axis=0)
+
+    def sample_spins(self, num_samples=None):
+        """
+        This method returns spins S_i^Y drawn independently from the
+        marginals P(S_i^Y), using self.rng. It is the vectorized version of
+        calling Node.sample() for every Y node.
+
+        Parameters
+        ----------
+        num_samples: int|None
+            number of lattice configurations. If None, a single one
+
+        Returns
+        -------
+        np.array
+            shape (num_dnodes,) if num_samples is None, (num_samples,
+            num_dnodes) otherwise. Entries are -1 or +1
+
+        """
+        size = self.num_dnodes if num_samples is None else \
+            (num_samples, self.num_dnodes)
+        return np.where(self.rng.random(size) < self.y_probs[:, 0], -1, 1)
 
     def load_x_node_probs(self):
         """
@@ -275,12 +671,9 @@ class Net:
         None
 
         """
-        # print("mnk-----------------")
-        for nd_id in range(1, NUM_DNODES + 1):
-            y_nd = self.get_nd_from_id(nd_id, "Y")
-            x_nd = self.get_nd_from_id(nd_id, "X")
-            # print("llkxcvm" , x_nd.probs, y_nd.probs)
-            x_nd.probs = y_nd.probs
+        self.x_probs = self.y_probs.copy()
+        if self.do_tangents:
+            self.x_tangents = self.y_tangents.copy()
 
     def write_dot_file(self, fname):
         """
@@ -296,9 +689,10 @@ class Net:
         None
 
         """
+        assert self.y_nodes, "Net was created with make_nodes=False"
         with open(fname, "w") as f:
             str0 = "digraph G {\n"
-            for nd_id in range(1, NUM_DNODES + 1):
+            for nd_id in range(1, self.num_dnodes + 1):
                 y_nd = self.y_nodes[nd_id - 1]
                 for nn in y_nd.nearest_nei:
                     if y_nd.efficiency:
@@ -340,8 +734,17 @@ class Net:
             av_eff_str = f"{self.av_eff:.3f}"
         else:
             av_eff_str = "undefined"
-        caption = f"beta={self.beta:.3f}, jj={self.jj:.3f}, h={self.h:.3f}, " \
-                  f"lam={self.lam:.3f}, num_iter={self.num_iter}, " \
+        # heterogeneous couplings are shown by their average
+        if np.ndim(self.jj) == 0:
+            jj_str = f"{self.jj:.3f}"
+        else:
+            jj_str = f"{np.mean(self.bond_jj[self.nei_ids >= 0]):.3f}(av)"
+        h_str = f"{np.mean(self.site_h):.3f}" + \
+            ("" if np.ndim(self.h) == 0 else "(av)")
+        lam_str = f"{np.mean(self.site_lam):.3f}" + \
+            ("" if np.ndim(self.lam) == 0 else "(av)")
+        caption = f"beta={self.beta:.3f}, jj={jj_str}, h={h_str}, " \
+                  f"lam={lam_str}, num_iter={self.num_iter}, " \
                   f"p0={p0_str}, mag={self.mag:.3f}, av_eff={av_eff_str}"
         plot_dot_with_colorbar(dot_file, caption)
 
@@ -373,5 +776,26 @@ if __name__ == "__main__":
         net.plot_lattice("test.txt")
 
 
+    def main3():
+        # random bond, random field model, averaged over disorder
+        from time import time
+        rng = np.random.default_rng(1234)
+        num_samples = 200
+        beta = BETA_JJ_CURIE * 2
+        t0 = time()
+        mags = []
+        for sample in range(num_samples):
+            shape = (DGRAPH_NUM_ROWS, DGRAPH_NUM_COLS)
+            jj = (rng.normal(1, .3, shape), rng.normal(1, .3, shape))
+            h = rng.normal(0, .1, NUM_DNODES)
+            net = Net(beta=beta, jj=jj, h=h, num_iter=20, p0=.3,
+                      backend="numpy", verbose=False)
+            mags.append(net.get_mag())
+        print(f"disorder averaged mag={np.mean(mags):.5f}"
+              f" +- {np.std(mags) / np.sqrt(num_samples):.5f}, "
+              f"time={time() - t0:.2f} s")
+
+
     # main1()
     main2()
+    # main3()
@@ -0,0 +1,253 @@
+import json
+import socket
+
+from globals import *
+
+
+class Net_Client:
+    """
+    This class is a blocking client of the service of Net_Service.py.
+    Its methods take the same arguments as the constructor of class Net,
+    and return the result dicts of run_batch.run_net(). It does not need
+    an event loop, so it can be used from a Jupyter notebook.
+
+    Attributes
+    ----------
+    port: int|None
+    socket_path: str|None
+
+    """
+
+    def __init__(self, socket_path="/tmp/net_service.sock", port=None):
+        """
+        constructor
+
+        Parameters
+        ----------
+        socket_path: str|None
+            path of the Unix socket of the service
+        port: int|None
+            if not None, connect to this localhost TCP port instead
+        """
+        self.socket_path = None if port is not None else socket_path
+        self.port = port
+        self._sock = None
+        self._file = None
+
+    def connect(self):
+        """
+        This method opens the connection to the service, if it is not
+        already open.
+
+        Returns
+        -------
+        None
+
+        """
+        if self._sock is not None:
+            return
+        if self.port is not None:
+            self._sock = socket.create_connection(("127.0.0.1", self.port))
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.socket_path)
+        self._file = self._sock.makefile("rwb")
+
+    def close(self):
+        """
+        This method closes the connection to the service.
+
+        Returns
+        -------
+        None
+
+        """
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, op, params, save_marginals=False, on_iter=None):
+        """
+        This method sends a request to the service, and waits for the
+        results of all its runs. Errors of runs are raised as
+        RuntimeError.
+
+        Parameters
+        ----------
+        op: str
+            "run" or "sweep"
+        params: dict
+        save_marginals: bool
+            True iff P(S_i^Y) is included in the results, under the key
+            "y_probs"
+        on_iter: Callable[[dict], None]|None
+            If not None, called with each "iter" message (see
+            Net_Service.py) as it arrives
+
+        Returns
+        -------
+        list[dict]
+            the result of each run, in the order of the runs
+
+        """
+        self.connect()
+        self._file.write((json.dumps({"op": op, "params": params,
+                                      "save_marginals": save_marginals}) +
+                          "\n").encode())
+        self._file.flush()
+        results = {}
+        errors = []
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("the service closed the connection")
+            message = json.loads(line)
+            if message["type"] == "iter":
+                if on_iter is not None:
+                    on_iter(message)
+            elif message["type"] == "result":
+                results[message["index"]] = message["result"]
+            elif message["type"] == "error":
+                errors.append(message)
+                if "index" not in message:
+                    # the request was rejected
+                    break
+            elif message["type"] == "done":
+                break
+        if errors:
+            raise RuntimeError("\n".join(
+                f"run {error.get('index')}: {error['message']}" for error in
+                errors))
+        return [results[i] for i in sorted(results)]
+
+    def run(self, beta, jj, h=0, lam=0, num_iter=1, p0=.2,
+            do_reversing=False, backend=BATCH_BACKEND,
+            do_gauss_seidel=False, num_rows=DGRAPH_NUM_ROWS,
+            num_cols=DGRAPH_NUM_COLS, tol=None, seed=None,
+            use_symmetry=True, save_marginals=False, on_iter=None):
+        """
+        This method runs a Net in the service and returns its result. The
+        arguments are those of Net, except for the last two, and the
+        backend defaults to BATCH_BACKEND.
+
+        Parameters
+        ----------
+        beta: float
+        jj: float
+        h: float
+        lam: float
+        num_iter: int
+        p0: float|None
+        do_reversing: bool
+        backend: str
+        do_gauss_seidel: bool
+        num_rows: int
+        num_cols: int
+        tol: float|None
+        seed: int|None
+            root seed. The Net gets np.random.SeedSequence(seed,
+            spawn_key=(0,)), as the first run of run_batch.py
+        use_symmetry: bool
+        save_marginals: bool
+        on_iter: Callable[[dict], None]|None
+            see request()
+
+        Returns
+        -------
+        dict
+
+        """
+        params = dict(beta=beta, jj=jj, h=h, lam=lam, num_iter=num_iter,
+                      p0=p0, do_reversing=do_reversing, backend=backend,
+                      do_gauss_seidel=do_gauss_seidel, num_rows=num_rows,
+                      num_cols=num_cols, tol=tol, seed=seed,
+                      use_symmetry=use_symmetry)
+        return self.request("run", params, save_marginals, on_iter)[0]
+
+    def sweep(self, save_marginals=False, on_iter=None, **params):
+        """
+        This method runs a Net for every combination of the values of the
+        params given as lists, and returns their results, in the order of
+        itertools.product() over the list params, in the order they are
+        given.
+
+        Parameters
+        ----------
+        save_marginals: bool
+        on_iter: Callable[[dict], None]|None
+            see request()
+        params: dict
+            keyword arguments of Net (e.g., beta=[.3, .4], jj=1), or
+            beta_hat instead of beta, and seed, the root seed of the runs.
+            The backend defaults to BATCH_BACKEND
+
+        Returns
+        -------
+        list[dict]
+
+        """
+        params = {key: list(value) if isinstance(value, (tuple, range))
+                  else value for key, value in params.items()}
+        params.setdefault("backend", BATCH_BACKEND)
+        return self.request("sweep", params, save_marginals, on_iter)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import threading
+    from time import perf_counter
+    import asyncio
+
+    from Net_Service import Net_Service
+
+
+    def main():
+        socket_path = os.path.join(tempfile.mkdtemp(), "net_service.sock")
+        service = Net_Service(socket_path, num_workers=2)
+        started = threading.Event()
+        thread = threading.Thread(
+            target=lambda: asyncio.run(service.serve(started)), daemon=True)
+        thread.start()
+        started.wait()
+
+        kwargs = dict(beta_hat=[.5, 1.0, 1.5], jj=1, num_iter=30, p0=.2,
+                      num_rows=64, num_cols=64)
+        t0 = perf_counter()
+        results = [None, None]
+
+        def client(k):
+            with Net_Client(socket_path) as net_client:
+                results[k] = net_client.sweep(**kwargs)
+
+        # two clients asking for the same sweep at the same time share
+        # the runs
+        threads = [threading.Thread(target=client, args=(k,)) for k in
+                   range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"2 identical sweeps, {perf_counter() - t0:.2f} s")
+        for result in results[0]:
+            print(f"beta_hat={result['beta_hat']}, mag={result['mag']:.5f},"
+                  f" av_eff={result['av_eff']:.5f}")
+        assert results[0] == results[1]
+
+        with Net_Client(socket_path) as net_client:
+            result = net_client.run(
+                BETA_JJ_CURIE, 1, num_iter=5, on_iter=lambda m: print(
+                    f"iter {m['iter']}, mag={m['mag']:.5f}"))
+        print(result["mag"])
+
+
+    main()
@@ -0,0 +1,789 @@
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from Net import Net
+from globals import *
+from run_batch import run_net
+
+'''
+
+This module is a local asyncio service that runs Nets for several
+clients (notebooks, scripts, users of the same analysis box), so that
+identical runs requested at the same time are computed only once. Start
+it with
+
+python Net_Service.py --socket /tmp/net_service.sock --workers 4
+
+and talk to it with class Net_Client (Net_Client.py).
+
+The protocol is JSON lines over a Unix socket (or a localhost TCP port,
+with --port). A client sends one request per line:
+
+{"op": "run", "params": {...}, "save_marginals": false}
+{"op": "sweep", "params": {...}, "save_marginals": false}
+
+The params are keyword arguments of Net (JSON values only), plus
+optionally beta_hat instead of beta, as in run_batch.py. For a sweep,
+every param whose value is a list is swept, and a Net is run for every
+combination of the values (the cartesian product). The service answers
+with a stream of lines, tagged with the index of the run in the request:
+
+{"type": "iter", "index": i, "iter": n, "mag": ..., "av_eff": ...,
+ "max_delta": ...}, after each iteration of run i
+{"type": "result", "index": i, "result": {...}}, the dict returned by
+run_batch.run_net(), when run i is done
+{"type": "error", "index": i, "message": "..."}, if run i failed
+{"type": "done"}, after the results of all the runs of the request
+
+or with a single {"type": "error", "message": "..."} if the request is
+rejected.
+
+Two runs are identical if they have the same params once the defaults of
+Net are filled in (see get_job_key()). A run that is requested while an
+identical one is in flight (queued or running) is attached to it: its
+client receives the iterations done so far, and then the rest of them as
+they come. A run whose clients have all disconnected is cancelled, be it
+queued or running. Runs with a random p0 and no seed are never
+identical, since each request expects its own sample. Seeds are
+used as in run_batch.py: run i of a request with root seed `seed` uses
+np.random.SeedSequence(seed, spawn_key=(i,)), so its result can be
+repeated with run_batch.py or Net.
+
+The runs are executed by a pool of num_workers processes. The number of
+runs in flight is bounded by max_pending; requests beyond that are
+rejected rather than queued without limit. Each worker sends the metrics
+of each iteration through a multiprocessing queue, which a thread of the
+service reads and dispatches to the clients.
+
+'''
+
+
+# keyword arguments of Net that the params of a run may set, with their
+# defaults. The backend defaults to BATCH_BACKEND, and the Node objects,
+# which run_net() does not use, are not made, as in run_batch.py
+NET_DEFAULTS = {name: param.default for name, param in
+                inspect.signature(Net.__init__).parameters.items() if
+                param.default is not inspect.Parameter.empty and
+                name not in ["verbose", "seed", "callback"]}
+NET_DEFAULTS["backend"] = BATCH_BACKEND
+NET_DEFAULTS["make_nodes"] = False
+# params of Net that do not change the result of a run, so they are not
+# part of its key
+KEY_IGNORED_PARAMS = ["beta_hat", "make_nodes", "use_symmetry"]
+
+# the queue of the worker process, and the ids of the cancelled jobs, set
+# by init_worker()
+_worker_queue = None
+_cancelled_ids = None
+
+
+class Job_Cancelled(Exception):
+    """
+    Raised in a worker to stop a run whose job was cancelled
+    """
+
+
+def init_worker(queue, cancelled_ids):
+    """
+    This method is the initializer of the worker processes. It stores the
+    queue through which the worker sends its messages to the service, and
+    the shared dictionary whose keys are the ids of the cancelled jobs.
+
+    Parameters
+    ----------
+    queue: multiprocessing.Queue
+    cancelled_ids: dict[int, bool]
+        a proxy of a multiprocessing manager
+
+    Returns
+    -------
+    None
+
+    """
+    global _worker_queue, _cancelled_ids
+    _worker_queue = queue
+    _cancelled_ids = cancelled_ids
+
+
+def run_service_job(job_id, params, save_marginals):
+    """
+    This method runs one Net in a worker process. It sends a message
+    ("iter", job_id, metrics) after each iteration, and then ("result",
+    job_id, result) or ("error", job_id, message) through the queue of the
+    worker. Since they go through the same queue, the result always comes
+    after the iterations. If the job is cancelled, the run stops after the
+    current iteration, and ("cancelled", job_id, None) is sent.
+
+    Parameters
+    ----------
+    job_id: int
+        see Service_Job
+    params: dict
+        see run_batch.run_net()
+    save_marginals: bool
+
+    Returns
+    -------
+    None
+
+    """
+    def callback(net):
+        if job_id in _cancelled_ids:
+            raise Job_Cancelled()
+        _worker_queue.put(("iter", job_id, {
+            "iter": net.num_iter_done, "mag": net.mag,
+            "av_eff": net.av_eff, "max_delta": net.max_delta}))
+
+    try:
+        result = run_net(params, save_marginals, callback)
+        _worker_queue.put(("result", job_id, result))
+    except Job_Cancelled:
+        _worker_queue.put(("cancelled", job_id, None))
+    except Exception:
+        _worker_queue.put(("error", job_id, traceback.format_exc(limit=3)))
+
+
+def normalize_params(params):
+    """
+    This method returns a copy of the params of a run with the defaults
+    of Net (NET_DEFAULTS) filled in, jj=1 if it is not given, as in
+    run_batch.py, and with both beta and beta_hat, computed from the one
+    that is given, as in run_batch.get_grid().
+
+    Parameters
+    ----------
+    params: dict
+
+    Returns
+    -------
+    dict
+
+    """
+    params = dict(NET_DEFAULTS, **params)
+    jj = params.setdefault("jj", 1.0)
+    if "beta_hat" in params:
+        assert "beta" not in params, "give beta or beta_hat, not both"
+        params["beta"] = params["beta_hat"] * BETA_JJ_CURIE / jj
+    else:
+        assert "beta" in params, "beta or beta_hat is required"
+        params["beta_hat"] = params["beta"] * jj / BETA_JJ_CURIE
+    return params
+
+
+def expand_sweep(params):
+    """
+    This method returns the list of the params of the runs of a sweep,
+    one for each combination of the values of the params that are lists.
+
+    Parameters
+    ----------
+    params: dict
+
+    Returns
+    -------
+    list[dict]
+
+    """
+    names = [name for name, value in params.items() if
+             isinstance(value, list)]
+    value_lists = [params[name] for name in names]
+    return [dict(params, **dict(zip(names, values))) for values in
+            itertools.product(*value_lists)]
+
+
+def get_job_key(params):
+    """
+    This method returns the key that identifies identical runs, the
+    canonical JSON of their params, as returned by normalize_params(). So
+    that the same run always gets the same key, however the client gave
+    it:
+
+    - the params whose value is None are dropped, since the defaults of
+      Net are already filled in (a random p0, p0=None, has no p0 in its
+      key, unlike the default p0)
+    - beta is rounded to 12 significant digits, and beta_hat, which is
+      computed from it, is dropped, so that beta and beta_hat given by
+      two clients for the same run give the same key
+    - make_nodes and use_symmetry, which do not change the result, are
+      dropped. The result sent to all the clients of a run is the one of
+      the first client, so it records that client's values of these
+    - the numbers are converted to floats, so that, e.g., jj=1 and jj=1.0
+      give the same key
+
+    Parameters
+    ----------
+    params: dict
+
+    Returns
+    -------
+    str
+
+    """
+    def canonical(value):
+        if isinstance(value, list):
+            return [canonical(x) for x in value]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    key_params = {name: canonical(value) for name, value in params.items()
+                  if value is not None and
+                  name not in KEY_IGNORED_PARAMS}
+    key_params["beta"] = float(f"{params['beta']:.12g}")
+    return json.dumps(key_params, sort_keys=True)
+
+
+class Service_Job:
+    """
+    This class is a run of a Net that is in flight in the service, with
+    the clients that wait for it.
+
+    Attributes
+    ----------
+    future: concurrent.futures.Future|None
+        the future of the run in the pool
+    job_id: int
+        unique id of the job. Unlike the key, it is never reused, so that
+        the messages of a cancelled run cannot reach a later identical job
+    key: str
+    messages: list[dict]
+        the "iter" messages received so far, replayed to late subscribers
+    subscribers: list[tuple[asyncio.Queue, int]]
+        queue of each waiting client request, and index of the run in that
+        request
+
+    """
+
+    def __init__(self, job_id, key):
+        """
+        constructor
+
+        Parameters
+        ----------
+        job_id: int
+        key: str
+        """
+        self.job_id = job_id
+        self.key = key
+        self.future = None
+        self.messages = []
+        self.subscribers = []
+
+    def subscribe(self, queue, index):
+        """
+        This method adds a subscriber, and sends it the iterations done so
+        far.
+
+        Parameters
+        ----------
+        queue: asyncio.Queue
+        index: int
+
+        Returns
+        -------
+        None
+
+        """
+        for message in self.messages:
+            queue.put_nowait(dict(message, index=index))
+        self.subscribers.append((queue, index))
+
+    def publish(self, message):
+        """
+        This method sends a message to all the subscribers
+
+        Parameters
+        ----------
+        message: dict
+
+        Returns
+        -------
+        None
+
+        """
+        for queue, index in self.subscribers:
+            queue.put_nowait(dict(message, index=index))
+
+
+class Net_Service:
+    """
+    This class is the service described in the docstring of this module.
+
+    Attributes
+    ----------
+    jobs: dict[str, Service_Job]
+        the jobs in flight that clients wait for, by key
+    max_pending: int
+    num_workers: int
+    port: int|None
+    socket_path: str|None
+
+    """
+
+    def __init__(self, socket_path=None, port=None, num_workers=None,
+                 max_pending=1000):
+        """
+        constructor
+
+        Parameters
+        ----------
+        socket_path: str|None
+            path of the Unix socket
+        port: int|None
+            if socket_path is None, the service listens on this localhost
+            TCP port instead
+        num_workers: int|None
+            number of worker processes. If None, the number of CPUs
+        max_pending: int
+            maximum number of runs in flight
+        """
+        assert (socket_path is None) != (port is None), \
+            "give socket_path or port"
+        self.socket_path = socket_path
+        self.port = port
+        self.num_workers = num_workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.jobs = {}
+        # spawn, so that the workers do not inherit the event loop and its
+        # threads
+        self._mp_context = multiprocessing.get_context("spawn")
+        self._queue = None
+        self._pool = None
+        self._loop = None
+        # all the jobs whose run has not ended yet, including the
+        # cancelled ones, by id
+        self._id_to_job = {}
+        self._next_job_id = 0
+        self._manager = None
+        self._cancelled_ids = None
+
+    def make_pool(self):
+        """
+        This method returns a new pool of worker processes.
+
+        Returns
+        -------
+        ProcessPoolExecutor
+
+        """
+        return ProcessPoolExecutor(self.num_workers,
+                                   mp_context=self._mp_context,
+                                   initializer=init_worker,
+                                   initargs=(self._queue,
+                                             self._cancelled_ids))
+
+    async def serve(self, started=None):
+        """
+        This method runs the service until it is cancelled.
+
+        Parameters
+        ----------
+        started: threading.Event|None
+            set once the service accepts connections
+
+        Returns
+        -------
+        None
+
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = self._mp_context.Queue()
+        self._manager = self._mp_context.Manager()
+        self._cancelled_ids = self._manager.dict()
+        self._pool = self.make_pool()
+        reader = threading.Thread(target=self.read_worker_queue,
+                                  daemon=True)
+        reader.start()
+        if self.socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client,
+                                                     self.socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_client,
+                                                "127.0.0.1", self.port)
+        if started is not None:
+            started.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._queue.put(None)
+            self._pool.shutdown(cancel_futures=True)
+            self._manager.shutdown()
+            if self.socket_path is not None and \
+                    os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def read_worker_queue(self):
+        """
+        This method runs in a thread. It reads the messages of the workers
+        and hands them to dispatch() in the event loop, until it reads None.
+
+        Returns
+        -------
+        None
+
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._loop.call_soon_threadsafe(self.dispatch, *item)
+
+    def dispatch(self, kind, job_id, payload):
+        """
+        This method sends a message of a worker to the subscribers of its
+        job, and forgets the job when it is done.
+
+        Parameters
+        ----------
+        kind: str
+            "iter", "result", "error" or "cancelled"
+        job_id: int
+        payload: dict|str|None
+
+        Returns
+        -------
+        None
+
+        """
+        job = self._id_to_job.get(job_id)
+        if job is None:
+            return
+        if kind == "iter":
+            message = dict(payload, type="iter")
+            job.messages.append(message)
+            job.publish(message)
+            return
+        if kind == "result":
+            job.publish({"type": "result", "result": payload})
+        elif kind == "error":
+            job.publish({"type": "error", "message": payload})
+        self.forget(job)
+
+    def forget(self, job):
+        """
+        This method removes a job whose run has ended, or will never start.
+
+        Parameters
+        ----------
+        job: Service_Job
+
+        Returns
+        -------
+        None
+
+        """
+        del self._id_to_job[job.job_id]
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        self._cancelled_ids.pop(job.job_id, None)
+
+    def cancel(self, job):
+        """
+        This method cancels a job that has no subscribers left. A queued
+        run is removed from the pool. A running run stops at the end of its
+        current iteration (see run_service_job()).
+
+        Parameters
+        ----------
+        job: Service_Job
+
+        Returns
+        -------
+        None
+
+        """
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        if job.future is not None and job.future.cancel():
+            self.forget(job)
+        else:
+            self._cancelled_ids[job.job_id] = True
+
+    def submit(self, params, save_marginals, queue, index):
+        """
+        This method subscribes queue to the job of params, after starting
+        that job if no identical one is in flight.
+
+        Parameters
+        ----------
+        params: dict
+            see run_batch.run_net()
+        save_marginals: bool
+        queue: asyncio.Queue
+        index: int
+
+        Returns
+        -------
+        None
+
+        """
+        key = get_job_key(dict(params, save_marginals=save_marginals))
+        job = self.jobs.get(key)
+        if job is not None:
+            job.subscribe(queue, index)
+            return
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        job = self.jobs[key] = self._id_to_job[job_id] = \
+            Service_Job(job_id, key)
+        job.subscribe(queue, index)
+        pool = self._pool
+        try:
+            job.future = pool.submit(run_service_job, job_id, params,
+                                     save_marginals)
+        except BrokenProcessPool as e:
+            self.dispatch("error", job_id, repr(e))
+            self.replace_pool(pool)
+            return
+        job.future.add_done_callback(
+            lambda f: self.on_worker_done(job_id, f, pool))
+
+    def replace_pool(self, pool):
+        """
+        This method replaces the pool `pool`, which is broken because a
+        worker process died, by a new one, unless that was already done.
+
+        Parameters
+        ----------
+        pool: ProcessPoolExecutor
+
+        Returns
+        -------
+        None
+
+        """
+        if self._pool is pool:
+            self._pool = self.make_pool()
+            pool.shutdown(wait=False)
+
+    def on_worker_done(self, job_id, future, pool):
+        """
+        This method is called in a thread of the pool when a job is done.
+        run_service_job() catches the errors of the run, so an exception
+        here means that the worker process died, without sending the
+        result of the job, so its subscribers are sent an error.
+
+        Parameters
+        ----------
+        job_id: int
+        future: concurrent.futures.Future
+        pool: ProcessPoolExecutor
+            the pool that ran the job
+
+        Returns
+        -------
+        None
+
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        self._loop.call_soon_threadsafe(
+            self.dispatch, "error", job_id, repr(future.exception()))
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._loop.call_soon_threadsafe(self.replace_pool, pool)
+
+    def get_runs(self, request):
+        """
+        This method returns the params of the runs of a request, with the
+        seeds set as in run_batch.run_grid()
+
+        Parameters
+        ----------
+        request: dict
+
+        Returns
+        -------
+        list[dict]
+
+        """
+        op = request.get("op")
+        assert op in ["run", "sweep"], f"unknown op {op}"
+        params = request.get("params", {})
+        if op == "run":
+            runs = [params]
+        else:
+            runs = expand_sweep(params)
+        runs = [normalize_params(run) for run in runs]
+        root_seed = params.get("seed")
+        assert root_seed is None or isinstance(root_seed, int), \
+            "seed must be an int"
+        # the seed only matters for a random p0 (see Net)
+        random_p0 = [run["p0"] is None and run["init_x_probs"] is None
+                     for run in runs]
+        if root_seed is None and any(random_p0):
+            # drawn once per request, so these runs are never identical
+            # to those of another request
+            root_seed = np.random.SeedSequence().entropy
+        for i, run in enumerate(runs):
+            if params.get("seed") is not None or random_p0[i]:
+                run.update(seed=root_seed, seed_index=i)
+        return runs
+
+    async def handle_client(self, reader, writer):
+        """
+        This method serves one client connection, one request at a time.
+
+        Parameters
+        ----------
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+
+        Returns
+        -------
+        None
+
+        """
+        queue = None
+        # the pending read of the next line of the client. It is kept
+        # across requests, so that it also notices, while a request is
+        # served, that the client has disconnected
+        read_task = None
+        try:
+            while True:
+                if read_task is None:
+                    read_task = asyncio.ensure_future(reader.readline())
+                line = await read_task
+                read_task = None
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    runs = self.get_runs(request)
+                    assert len(self.jobs) + len(runs) <= self.max_pending, \
+                        "too many runs in flight, try again later"
+                except Exception as e:
+                    await self.write(writer, {"type": "error",
+                                              "message": repr(e)})
+                    continue
+                queue = asyncio.Queue()
+                save_marginals = bool(request.get("save_marginals"))
+                for index, run in enumerate(runs):
+                    self.submit(run, save_marginals, queue, index)
+                read_task = asyncio.ensure_future(reader.readline())
+                num_left = len(runs)
+                while num_left:
+                    message = await self.get_message(queue, read_task)
+                    if message is None:
+                        # the client has disconnected
+                        return
+                    if message["type"] != "iter":
+                        num_left -= 1
+                    await self.write(writer, message)
+                await self.write(writer, {"type": "done"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if read_task is not None and not read_task.done():
+                read_task.cancel()
+            # the jobs of this client keep running for the other clients,
+            # and are cancelled if there are none
+            for job in list(self.jobs.values()):
+                job.subscribers = [subscriber for subscriber in
+                                   job.subscribers if
+                                   subscriber[0] is not queue]
+                if not job.subscribers:
+                    self.cancel(job)
+            writer.close()
+
+    @staticmethod
+    async def get_message(queue, read_task):
+        """
+        This method waits for the next message of queue, and returns it,
+        or returns None as soon as read_task finds that the client has
+        disconnected (end of file). A line that read_task reads before the
+        end of the request is the next request of the client, which is
+        served afterwards.
+
+        Parameters
+        ----------
+        queue: asyncio.Queue
+        read_task: asyncio.Future
+            the pending read of the next line of the client
+
+        Returns
+        -------
+        dict|None
+
+        """
+        get_task = asyncio.ensure_future(queue.get())
+        wait_for = [get_task]
+        if not read_task.done():
+            wait_for.append(read_task)
+        await asyncio.wait(wait_for, return_when=asyncio.FIRST_COMPLETED)
+        if get_task.done():
+            return get_task.result()
+        get_task.cancel()
+        if read_task.exception() is not None or not read_task.result():
+            return None
+        return await queue.get()
+
+    @staticmethod
+    async def write(writer, message):
+        """
+        This method writes a message to a client, as one line of JSON
+
+        Parameters
+        ----------
+        writer: asyncio.StreamWriter
+        message: dict
+
+        Returns
+        -------
+        None
+
+        """
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+
+
+def main(argv=None):
+    """
+    This method starts the service described by the command line argv.
+
+    Parameters
+    ----------
+    argv: list[str]|None
+
+    Returns
+    -------
+    None
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Local service that runs Ising dbnets (class Net) for "
+                    "several clients.")
+    parser.add_argument("--socket", type=str, default=None,
+                        help="path of the Unix socket")
+    parser.add_argument("--port", type=int, default=None,
+                        help="localhost TCP port, instead of --socket")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number "
+                             "of CPUs)")
+    parser.add_argument("--max_pending", type=int, default=1000,
+                        help="maximum number of runs in flight")
+    args = parser.parse_args(argv)
+    if args.socket is None and args.port is None:
+        args.socket = "/tmp/net_service.sock"
+    service = Net_Service(args.socket, args.port, args.workers,
+                          args.max_pending)
+    print(f"serving on {args.socket or args.port}")
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
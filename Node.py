@@ -1,4 +1,5 @@
-from random import choices, uniform
+import numpy as np
+
 from globals import *
 
 
@@ -28,14 +29,23 @@ class Node:
         the mutual information H(S_i^Y:S_i^X) when this is node S_i^Y
     nearest_nei: list[int]
         list of id_num for the nearest neighbors when this is node S_i^Y
+    num_cols: int
+        number of columns of the lattice
+    num_rows: int
+        number of rows of the lattice
     probs: list[float]
         [P(S_i^Y=-1), P(S_i^Y=+1)] when this is node S_i^Y
+    rng: np.random.Generator
+        random number generator used by sample(), and by the constructor
+        when p0 is None
     type: str
         either "X" or "Y", respectively, when this is node S_i^X or S_i^Y
 
 
     """
-    def __init__(self, id_num, type, p0=None):
+    def __init__(self, id_num, type, p0=None,
+                 num_rows=DGRAPH_NUM_ROWS, num_cols=DGRAPH_NUM_COLS,
+                 rng=None):
         """
         constructor
 
@@ -46,13 +56,22 @@ class Node:
         p0: float|None
             P(S_i^X=-1)=p0, self.probs=[p0, 1-p0] on first iteration only.
             self.probs refreshed with each iteration
+        num_rows: int
+        num_cols: int
+        rng: np.random.Generator|int|None
+            a Generator (class Net passes its own, so that all the nodes
+            share one stream), or a seed for a new one. If None, a new
+            Generator is seeded from the OS
         """
         self.id_num = id_num
         self.type = type
+        self.num_rows = num_rows
+        self.num_cols = num_cols
         assert type in ["X", "Y"]
         self.nearest_nei = self.get_nearest_nei()
-        if not p0:
-            p0 = uniform(0,1)
+        self.rng = np.random.default_rng(rng)
+        if p0 is None:
+            p0 = self.rng.uniform(0, 1)
         self.probs = [p0, 1-p0]
         self.entropy = 0
         self.cond_info = 0
@@ -80,28 +99,30 @@ class Node:
     def get_nearest_nei(self):
         """
         This method returns a list of the nearest neighbor (nn) id_num for
-        self, for a rectangular lattice with DGRAPH_NUM_COLS columns and
-        DGRAPH_NUM_ROWS rows. Internal nodes have 4 nn, corner nodes have 2
-        nn, and boundary nodes that are not corners have 2 nn. Nodes S_i^X
-        and S_i^Y are at the same site id_num of the lattice
+        self, for a rectangular lattice with self.num_cols columns and
+        self.num_rows rows. Internal nodes have 4 nn, corner nodes have 2
+        nn, and boundary nodes that are not corners have 3 nn. Nodes S_i^X
+        and S_i^Y are at the same site id_num of the lattice. See also
+        utils.get_nei_ids()
 
         Returns
         -------
         nearest_nei: list[int]
 
         """
+        num_cols = self.num_cols
         nearest_nei = [self.id_num + 1, self.id_num - 1,
-                       self.id_num + DGRAPH_NUM_COLS,
-                       self.id_num - DGRAPH_NUM_COLS]
-        row = (self.id_num - 1) // DGRAPH_NUM_COLS + 1
-        col = self.id_num - (row - 1) * DGRAPH_NUM_ROWS
+                       self.id_num + num_cols,
+                       self.id_num - num_cols]
+        row = (self.id_num - 1) // num_cols + 1
+        col = self.id_num - (row - 1) * num_cols
         if row == 1:
-            nearest_nei.remove(self.id_num - DGRAPH_NUM_COLS)
-        if row == DGRAPH_NUM_ROWS:
-            nearest_nei.remove(self.id_num + DGRAPH_NUM_COLS)
+            nearest_nei.remove(self.id_num - num_cols)
+        if row == self.num_rows:
+            nearest_nei.remove(self.id_num + num_cols)
         if col == 1:
             nearest_nei.remove(self.id_num - 1)
-        if col == DGRAPH_NUM_COLS:
+        if col == num_cols:
             nearest_nei.remove(self.id_num + 1)
         return nearest_nei
 
@@ -127,6 +148,7 @@ class Node:
     def sample(self):
         """
         This method returns either -1 or +1, at random, using self.probs
+        and self.rng
 
         Returns
         -------
@@ -134,14 +156,15 @@ class Node:
             either -1 or +1
 
         """
-        return choices([-1, 1], self.probs)[0]
+        return -1 if self.rng.random() < self.probs[0] else 1
 
 
 if __name__ == "__main__":
     def main():
-        print('sample=', Node(1, "Y").sample())
+        print('sample=', Node(1, "Y", rng=1234).sample())
+        rng = np.random.default_rng(1234)
         for i in range(1, NUM_DNODES + 1):
-            nd = Node(i, "Y")
+            nd = Node(i, "Y", rng=rng)
             print("_____________________")
             nd.describe_self()
 
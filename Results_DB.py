@@ -0,0 +1,382 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from globals import *
+from run_batch import SCALAR_FIELDS
+
+'''
+
+This module stores the results of runs of Net (the dicts returned by
+run_batch.run_net()) in a persistent local database, so that phase
+diagrams and other plots can be rebuilt from past runs instead of rerun.
+
+The scalar fields of each run (SCALAR_FIELDS of run_batch.py, which
+include the shape of the lattice) are rows of a table of a SQLite file,
+with an index on (num_rows, num_cols, p0, beta_hat), so that range
+queries such as "all runs with p0=.3 and .5 < beta_hat < 3 on a 64x64
+lattice" only read the matching rows. The marginals P(S_i^Y), if saved,
+are stored as one .npy file per run, in a folder next to the SQLite file,
+and only loaded on demand. Queries return one numpy array per field
+(columns) rather than one dict per run, which is what the plotting
+helpers need, and is much faster for hundreds of thousands of runs.
+
+run_batch.py writes its results to such a database when the output file
+ends in .db.
+
+'''
+
+# SQLite type of each column. Everything else is REAL
+INT_FIELDS = ["num_iter", "num_iter_done", "num_rows", "num_cols",
+              "seed_index", "do_reversing", "do_gauss_seidel", "av_eff_flag"]
+TEXT_FIELDS = ["backend", "seed"]
+DB_FIELDS = SCALAR_FIELDS
+# fields that every result must have
+REQUIRED_FIELDS = ["num_rows", "num_cols"]
+
+
+class Results_DB:
+    """
+    This class is a database of the results of runs of Net. See the
+    docstring of this module.
+
+    Attributes
+    ----------
+    blob_dir: str
+        folder of the .npy files of the marginals
+    conn: sqlite3.Connection
+    path: str
+        path of the SQLite file
+
+    """
+
+    def __init__(self, path):
+        """
+        constructor. The database is created if it does not exist. The
+        fields of DB_FIELDS that a database created by an older version
+        of this class lacks (e.g., tol) are added as columns, which are
+        NULL for its runs.
+
+        Parameters
+        ----------
+        path: str
+            path of the SQLite file, e.g., "results.db"
+        """
+        self.path = path
+        self.blob_dir = os.path.splitext(path)[0] + "_marginals"
+        self.conn = sqlite3.connect(path)
+        field_to_type = {field: "INTEGER" if field in INT_FIELDS else
+                         "TEXT" if field in TEXT_FIELDS else "REAL" for
+                         field in DB_FIELDS}
+        columns = ", ".join(f"{field} {field_type}" for field, field_type
+                            in field_to_type.items())
+        with self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY "
+                f"AUTOINCREMENT, {columns}, has_marginals INTEGER)")
+            # CREATE TABLE IF NOT EXISTS keeps the columns of an existing
+            # table
+            old_fields = [row[1] for row in self.conn.execute(
+                "PRAGMA table_info(runs)")]
+            for field, field_type in field_to_type.items():
+                if field not in old_fields:
+                    self.conn.execute(
+                        f"ALTER TABLE runs ADD COLUMN {field} {field_type}")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS runs_lattice_p0_beta_hat ON "
+                "runs (num_rows, num_cols, p0, beta_hat)")
+
+    def close(self):
+        """
+        This method closes the database.
+
+        Returns
+        -------
+        None
+
+        """
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def insert_results(self, results):
+        """
+        This method adds results to the database, in one transaction, and
+        writes their marginals, if present (see run_batch.run_net()). The
+        ids are assigned by SQLite, so several processes may insert into
+        the same database at the same time.
+
+        Parameters
+        ----------
+        results: list[dict]
+            as returned by run_batch.run_net(). They must have the fields
+            REQUIRED_FIELDS (the shape of the lattice). Missing fields
+            among the others are NULL
+
+        Returns
+        -------
+        list[int]
+            the ids of the new runs
+
+        """
+        rows = []
+        for result in results:
+            for field in REQUIRED_FIELDS:
+                assert result.get(field) is not None, \
+                    f"result has no {field}"
+            row = [result.get(field) for field in DB_FIELDS]
+            # the root seed may not fit in an int64
+            k = DB_FIELDS.index("seed")
+            row[k] = None if row[k] is None else str(row[k])
+            rows.append(row + [int("y_probs" in result)])
+        placeholders = ", ".join(["?"] * (len(DB_FIELDS) + 1))
+        sql = f"INSERT INTO runs ({', '.join(DB_FIELDS)}, has_marginals) " \
+              f"VALUES ({placeholders})"
+        ids = []
+        with self.conn:
+            cursor = self.conn.cursor()
+            for row in rows:
+                cursor.execute(sql, row)
+                ids.append(cursor.lastrowid)
+        for run_id, result in zip(ids, results):
+            if "y_probs" in result:
+                os.makedirs(self.blob_dir, exist_ok=True)
+                np.save(self.get_blob_path(run_id),
+                        np.asarray(result["y_probs"], dtype=float))
+        return ids
+
+    def get_blob_path(self, run_id):
+        """
+        This method returns the path of the .npy file of the marginals of
+        run run_id
+
+        Parameters
+        ----------
+        run_id: int
+
+        Returns
+        -------
+        str
+
+        """
+        return os.path.join(self.blob_dir, f"{run_id}.npy")
+
+    def query(self, fields=None, order_by="beta_hat", **conditions):
+        """
+        This method returns the runs that satisfy all the conditions, as
+        one array per field.
+
+        Parameters
+        ----------
+        fields: list[str]|None
+            fields to return, among "id", DB_FIELDS and "has_marginals".
+            All if None
+        order_by: str|None
+            field by which the runs are sorted
+        conditions: dict
+            field=value for equality (field=None for NULL, e.g., a random
+            p0), or field=(lo, hi) for lo < field < hi, where lo or hi may
+            be None for no bound. E.g., query(p0=.3, beta_hat=(.5, 3),
+            num_rows=64, num_cols=64)
+
+        Returns
+        -------
+        dict[str, np.array]
+            NULL is np.nan in float fields and None in the others
+
+        """
+        all_fields = ["id"] + DB_FIELDS + ["has_marginals"]
+        if fields is None:
+            fields = all_fields
+        for field in list(fields) + list(conditions) + \
+                ([order_by] if order_by else []):
+            assert field in all_fields, f"unknown field {field}"
+        clauses = []
+        values = []
+        for field, value in conditions.items():
+            if isinstance(value, tuple):
+                lo, hi = value
+                if lo is not None:
+                    clauses.append(f"{field} > ?")
+                    values.append(lo)
+                if hi is not None:
+                    clauses.append(f"{field} < ?")
+                    values.append(hi)
+            elif value is None:
+                clauses.append(f"{field} IS NULL")
+            else:
+                clauses.append(f"{field} = ?")
+                values.append(value)
+        sql = f"SELECT {', '.join(fields)} FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        rows = self.conn.execute(sql, values).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * len(fields)
+        out = {}
+        for field, column in zip(fields, columns):
+            if field in TEXT_FIELDS or field == "id":
+                out[field] = np.array(column, dtype=object if
+                                      field in TEXT_FIELDS else np.int64)
+            elif field in INT_FIELDS or field == "has_marginals":
+                # None is kept when there are NULLs
+                out[field] = np.array(column) if None in column else \
+                    np.array(column, dtype=np.int64)
+            else:
+                out[field] = np.array(column, dtype=float)
+        return out
+
+    def count(self, **conditions):
+        """
+        This method returns the number of runs that satisfy the
+        conditions (see query())
+
+        Returns
+        -------
+        int
+
+        """
+        return len(self.query(["id"], order_by=None, **conditions)["id"])
+
+    def load_marginals(self, run_id):
+        """
+        This method returns the marginals P(S_i^Y) of run run_id
+
+        Parameters
+        ----------
+        run_id: int
+
+        Returns
+        -------
+        np.array
+            shape (num_rows*num_cols, 2)
+
+        """
+        path = self.get_blob_path(run_id)
+        assert os.path.exists(path), f"run {run_id} has no marginals"
+        return np.load(path)
+
+    def get_x_to_y(self, x="beta_hat", y="mag", **conditions):
+        """
+        This method returns the dictionary x -> y of the runs that satisfy
+        the conditions (see query()), as used by plotting.plot_x_to_y().
+        The values of y of the runs with the same x are averaged.
+
+        Parameters
+        ----------
+        x: str
+        y: str
+        conditions: dict
+
+        Returns
+        -------
+        dict[float, float]
+
+        """
+        columns = self.query([x, y], order_by=None, **conditions)
+        x_vals, inverse = np.unique(columns[x], return_inverse=True)
+        y_vals = np.bincount(inverse, weights=columns[y]) / \
+            np.bincount(inverse)
+        return dict(zip(x_vals.tolist(), y_vals.tolist()))
+
+    def get_param_to_x_y(self, param="p0", x="av_ent", y="av_cond_info",
+                         **conditions):
+        """
+        This method returns the dictionary param -> (x, y) of the runs that
+        satisfy the conditions (see query()), as used by
+        plotting.plot_parametric_curve(). The values of x and y of the runs
+        with the same param are averaged.
+
+        Parameters
+        ----------
+        param: str
+        x: str
+        y: str
+        conditions: dict
+
+        Returns
+        -------
+        dict[float, tuple[float, float]]
+
+        """
+        param_to_x = self.get_x_to_y(param, x, **conditions)
+        param_to_y = self.get_x_to_y(param, y, **conditions)
+        return {key: (param_to_x[key], param_to_y[key]) for key in
+                param_to_x}
+
+    def plot_x_to_y(self, x="beta_hat", y="mag", **conditions):
+        """
+        This method plots y versus x for the runs that satisfy the
+        conditions, with plotting.plot_x_to_y()
+
+        Returns
+        -------
+        None
+
+        """
+        from plotting import plot_x_to_y
+        plot_x_to_y(self.get_x_to_y(x, y, **conditions), x, y)
+
+    def plot_parametric_curve(self, param="p0", x="av_ent",
+                              y="av_cond_info", **conditions):
+        """
+        This method plots (x, y) as a function of param for the runs that
+        satisfy the conditions, with plotting.plot_parametric_curve()
+
+        Returns
+        -------
+        None
+
+        """
+        from plotting import plot_parametric_curve
+        plot_parametric_curve(self.get_param_to_x_y(param, x, y,
+                                                    **conditions))
+
+
+if __name__ == "__main__":
+    import tempfile
+    from time import perf_counter
+
+
+    def main():
+        rng = np.random.default_rng(0)
+        num_runs = 300000
+        beta_hat = rng.uniform(0, 5, num_runs)
+        p0 = rng.choice([.1, .3, .5], num_runs)
+        num_rows = rng.choice([16, 32, 64], num_runs)
+        # fake results, with the fields of run_batch.run_net()
+        results = [{"beta": b * BETA_JJ_CURIE, "beta_hat": b, "jj": 1.0,
+                    "h": 0.0, "lam": 0.0, "num_iter": 20, "p0": p,
+                    "do_reversing": False, "do_gauss_seidel": False,
+                    "backend": "numpy", "tol": None, "num_iter_done": 20,
+                    "mag": float(np.tanh(b - 1) * (b > 1)),
+                    "av_eff": .5, "av_eff_flag": True, "av_ent": .5,
+                    "av_cond_info": .2, "seed": 2**100, "seed_index": i,
+                    "time": .01, "num_rows": int(n), "num_cols": int(n)}
+                   for i, (b, p, n) in enumerate(zip(beta_hat, p0,
+                                                     num_rows))]
+        with tempfile.TemporaryDirectory() as tmp:
+            with Results_DB(os.path.join(tmp, "results.db")) as db:
+                t0 = perf_counter()
+                db.insert_results(results)
+                print(f"insert {num_runs} runs: "
+                      f"{perf_counter() - t0:.2f} s")
+                t0 = perf_counter()
+                columns = db.query(["beta_hat", "mag"], p0=.3,
+                                   beta_hat=(.5, 3), num_rows=64,
+                                   num_cols=64)
+                print(f"query: {len(columns['mag'])} runs, "
+                      f"{perf_counter() - t0:.3f} s")
+                t0 = perf_counter()
+                x_to_y = db.get_x_to_y("beta_hat", "mag", p0=.3)
+                print(f"x_to_y: {len(x_to_y)} points, "
+                      f"{perf_counter() - t0:.3f} s")
+
+
+    main()
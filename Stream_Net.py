@@ -0,0 +1,316 @@
+import os
+import tempfile
+
+import numpy as np
+
+from Lattice_Stats import Lattice_Stats, calc_entropy_and_efficiency
+from Sweep_Backend import calc_y_probs_block
+from globals import *
+from utils import *
+
+
+class Stream_Net:
+    """
+    This class performs the same iterations as class Net (with the numpy
+    backend and do_gauss_seidel=False), for lattices that are too large to
+    fit in memory. The marginals P(S_i^X=-1) and P(S_i^Y=-1) are stored in
+    two memory-mapped files of shape (num_rows, num_cols). Each sweep
+    streams through the lattice in blocks of block_rows rows. A block is
+    read with one halo row above and one below, so that every node of the
+    block sees its nearest neighbors. The metrics returned by get_mag(),
+    get_av_eff2() and get_av_entropy_and_cond_info() are accumulated in a
+    Lattice_Stats during the sweep, so the entropy, conditional info, etc.
+    of the nodes are never stored. Peak memory depends on block_rows and
+    num_cols, but not on num_rows.
+
+    Only uniform coupling constants jj, h, lam are supported.
+
+    Attributes
+    ----------
+    beta: float
+    block_rows: int
+        number of rows per block
+    h: float
+    jj: float
+    lam: float
+    max_delta: float|None
+        max_i |P(S_i^Y) - P(S_i^X)| in the last iteration
+    num_cols: int
+    num_dnodes: int
+    num_iter: int
+    num_iter_done: int
+    num_rows: int
+    p0: float|None
+    rng: np.random.Generator
+        used for the random p0
+    stats: Lattice_Stats
+        aggregates of the Y nodes of the last sweep
+    tol: float|None
+    work_dir: str
+        folder holding the memory-mapped files
+    x_probs_m: np.memmap
+        shape (num_rows, num_cols), P(S_i^X=-1)
+    y_probs_m: np.memmap
+        shape (num_rows, num_cols), P(S_i^Y=-1)
+
+    """
+
+    def __init__(self, beta, jj, h=0, lam=0, num_iter=1, p0=.2,
+                 num_rows=DGRAPH_NUM_ROWS, num_cols=DGRAPH_NUM_COLS,
+                 block_rows=64, work_dir=None, dtype=np.float64, tol=None,
+                 verbose=True, seed=None):
+        """
+        constructor
+
+        Parameters
+        ----------
+        beta: float
+        jj: float
+        h: float
+        lam: float
+        num_iter: int
+        p0: float|None
+        num_rows: int
+        num_cols: int
+        block_rows: int
+        work_dir: str|None
+            folder for the memory-mapped files. If None, a temporary folder
+            is used, and deleted with this object
+        dtype: type
+            np.float64 or np.float32 (halves the size of the files)
+        tol: float|None
+            If not None, the iterations stop as soon as P(S_i^Y) changes by
+            less than tol for every node i
+        verbose: bool
+            True iff mag and av_eff are printed after each iteration
+        seed: int|np.random.SeedSequence|np.random.Generator|None
+            seed of self.rng. See Net
+        """
+        for x in [jj, h, lam]:
+            assert np.ndim(x) == 0, "only uniform couplings are supported"
+        self.beta = beta
+        self.jj = jj
+        self.h = h
+        self.lam = lam
+        self.num_iter = num_iter
+        self.p0 = p0
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_dnodes = num_rows * num_cols
+        self.block_rows = block_rows
+        self.tol = tol
+        self.max_delta = None
+        self.stats = None
+        self.rng = np.random.default_rng(seed)
+        if work_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory()
+            work_dir = self._tmp_dir.name
+        self.work_dir = work_dir
+        self.x_probs_m = self.open_memmap("x_probs_m.dat", dtype)
+        self.y_probs_m = self.open_memmap("y_probs_m.dat", dtype)
+        self.init_x_probs(p0)
+        # lattice of a block plus its halo rows, by number of rows
+        self._rows_to_nei_ids = {}
+
+        self.num_iter_done = 0
+        for i in range(num_iter):
+            self.sweep()
+            self.mag = self.get_mag()
+            self.av_eff, self.av_eff_flag = self.get_av_eff2()
+            self.num_iter_done = i + 1
+            if self.av_eff_flag:
+                av_eff_str = f"{self.av_eff:.5f}"
+            else:
+                av_eff_str = "undef"
+            if verbose:
+                print(f"{i + 1}, mag={self.mag:.5f}, av_eff={av_eff_str}")
+            if av_eff_str == "undef":
+                break
+
+            self.load_x_node_probs()
+            if tol is not None and self.max_delta < tol:
+                break
+
+    def open_memmap(self, fname, dtype):
+        """
+        This method creates a memory-mapped file of shape (num_rows,
+        num_cols) in self.work_dir
+
+        Parameters
+        ----------
+        fname: str
+        dtype: type
+
+        Returns
+        -------
+        np.memmap
+
+        """
+        return np.memmap(os.path.join(self.work_dir, fname), dtype=dtype,
+                         mode="w+", shape=(self.num_rows, self.num_cols))
+
+    def get_blocks(self):
+        """
+        This method returns the list of (first row, last row + 1) of the
+        blocks of rows
+
+        Returns
+        -------
+        list[tuple[int, int]]
+
+        """
+        return [(r0, min(r0 + self.block_rows, self.num_rows)) for r0 in
+                range(0, self.num_rows, self.block_rows)]
+
+    def init_x_probs(self, p0):
+        """
+        This method fills self.x_probs_m with p0, or with uniformly
+        distributed random numbers drawn from self.rng if p0 is None, one
+        block at a time.
+
+        Parameters
+        ----------
+        p0: float|None
+
+        Returns
+        -------
+        None
+
+        """
+        for r0, r1 in self.get_blocks():
+            if p0 is None:
+                self.x_probs_m[r0:r1] = self.rng.uniform(
+                    0, 1, (r1 - r0, self.num_cols))
+            else:
+                self.x_probs_m[r0:r1] = p0
+        self.x_probs_m.flush()
+
+    def sweep(self):
+        """
+        This method performs one sweep of the lattice, block by block. It
+        writes P(S_i^Y=-1) into self.y_probs_m, and stores the aggregates
+        of the metrics in self.stats, and max_i |P(S_i^Y) - P(S_i^X)| in
+        self.max_delta.
+
+        Returns
+        -------
+        None
+
+        """
+        stats = Lattice_Stats()
+        max_delta = 0.0
+        for r0, r1 in self.get_blocks():
+            # block plus halo rows
+            h0 = max(r0 - 1, 0)
+            h1 = min(r1 + 1, self.num_rows)
+            prob_m = np.asarray(self.x_probs_m[h0:h1], dtype=float).ravel()
+            x_probs = np.stack([prob_m, 1 - prob_m], axis=1)
+            num_local_rows = h1 - h0
+            if num_local_rows not in self._rows_to_nei_ids:
+                self._rows_to_nei_ids[num_local_rows] = \
+                    get_nei_ids(num_local_rows, self.num_cols)
+            nei_ids = self._rows_to_nei_ids[num_local_rows]
+            num_local = len(x_probs)
+            ids = np.arange((r0 - h0) * self.num_cols,
+                            (r1 - h0) * self.num_cols)
+            y_probs, cond_info = calc_y_probs_block(
+                x_probs, nei_ids, self.jj * (nei_ids >= 0),
+                np.full(num_local, float(self.h)),
+                np.full(num_local, float(self.lam)), self.beta, ids)
+            self.y_probs_m[r0:r1] = y_probs[:, 0].reshape(r1 - r0, -1)
+
+            # running reductions, same definitions as in class Net
+            y_prob_m = y_probs[:, 0]
+            entropy, efficiency = calc_entropy_and_efficiency(y_prob_m,
+                                                              cond_info)
+            stats.update(y_prob_m, entropy, cond_info, efficiency)
+            max_delta = max(max_delta, float(np.max(
+                np.abs(y_prob_m - prob_m[ids]))))
+        self.y_probs_m.flush()
+        self.stats = stats
+        self.max_delta = max_delta
+
+    def get_mag(self):
+        """
+        This method returns the magnetization of the lattice, from the
+        aggregates of the last sweep
+
+        Returns
+        -------
+        float
+
+        """
+        return self.stats.get_mag()
+
+    def get_av_entropy_and_cond_info(self):
+        """
+        This method returns a pair
+
+        (average entropy, average conditional info)
+
+        from the aggregates of the last sweep
+
+        Returns
+        -------
+        tuple[float]
+
+        """
+        return self.stats.get_av_entropy_and_cond_info()
+
+    def get_av_eff2(self):
+        """
+        This method returns a tuple
+
+        (av_eff, no_undef_eff)
+
+        from the aggregates of the last sweep. See Net.get_av_eff2()
+
+        Returns
+        -------
+        (float, bool)
+
+        """
+        return self.stats.get_av_eff2()
+
+    def load_x_node_probs(self):
+        """
+        This method transfers P(S_i^Y) to P(S_i^X) for each dnode i, by
+        swapping the two memory-mapped files, without copying them.
+
+        Returns
+        -------
+        None
+
+        """
+        self.x_probs_m, self.y_probs_m = self.y_probs_m, self.x_probs_m
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    from Net import Net
+
+
+    def main1():
+        # check against Net on a small lattice
+        kwargs = dict(beta=BETA_JJ_CURIE * 1.2, jj=1, h=.05, lam=.1,
+                      num_iter=10, p0=.4, num_rows=23, num_cols=17)
+        net = Net(**kwargs, backend="numpy", verbose=False,
+                  make_nodes=False)
+        snet = Stream_Net(**kwargs, block_rows=5, verbose=False)
+        print("Net:       ", net.get_mag(), net.get_av_eff2(),
+              net.get_av_entropy_and_cond_info())
+        print("Stream_Net:", snet.get_mag(), snet.get_av_eff2(),
+              snet.get_av_entropy_and_cond_info())
+
+
+    def main2():
+        num_rows = num_cols = 1024
+        t0 = perf_counter()
+        Stream_Net(beta=BETA_JJ_CURIE * 1.2, jj=1, num_iter=3, p0=.4,
+                   num_rows=num_rows, num_cols=num_cols, block_rows=32,
+                   dtype=np.float32)
+        print(f"{num_rows}x{num_cols}, time={perf_counter() - t0:.1f} s")
+
+
+    main1()
+    main2()
@@ -0,0 +1,573 @@
+import itertools
+import importlib.util
+import warnings
+from math import prod
+
+import numpy as np
+
+from Cond_Prob import *
+from Lattice_Stats import *
+from utils import *
+
+# numba is only imported when Numba_Backend is first used, because
+# importing it is slow
+HAS_NUMBA = importlib.util.find_spec("numba") is not None
+
+# all 2^4 states of the (at most 4) nearest neighbors S_a^X, ..., S_d^X
+NEI_STATES = np.array(list(itertools.product([-1, 1], repeat=4)))
+# index into probs=[P(S=-1), P(S=+1)] for each entry of NEI_STATES
+NEI_STATE_IDS = (NEI_STATES + 1) // 2
+X_SPINS = np.array([-1, 1])
+# parameters of the derivatives calculated by calc_y_tangents_block()
+TANGENT_PARAMS = ["beta", "h"]
+
+
+def calc_y_probs_block(x_probs, nei_ids, bond_jj, site_h, site_lam, beta,
+                       ids):
+    """
+    This method is the vectorized (numpy) kernel of the sweep. For each
+    node id in `ids`, it calculates P(S_i^Y) and the conditional info
+    H(S_i^Y|S_i^X) by summing over all the states of the nearest neighbors
+    S_a^X, ... , S_d^X and of S_i^X. This is the same calculation as the
+    one performed node by node by Python_Backend, except that missing
+    neighbors (on the boundary of the lattice) are padded and given zero
+    coupling.
+
+    Parameters
+    ----------
+    x_probs: np.array
+        shape (NUM_DNODES, 2), x_probs[i] = [P(S_i^X=-1), P(S_i^X=+1)]
+    nei_ids: np.array
+        shape (NUM_DNODES, 4), 0 based id of each nearest neighbor, -1 if
+        missing
+    bond_jj: np.array
+        shape (NUM_DNODES, 4), coupling constant jj of each bond. Zero for
+        missing neighbors
+    site_h: np.array
+        shape (NUM_DNODES,), magnetic field h of each site
+    site_lam: np.array
+        shape (NUM_DNODES,), coupling constant lam of each site
+    beta: float
+    ids: np.array
+        0 based ids of the nodes to calculate
+
+    Returns
+    -------
+    y_probs, cond_info: tuple[np.array]
+        shapes (len(ids), 2) and (len(ids),)
+
+    """
+    nei = nei_ids[ids]
+    valid = nei >= 0
+    nei_probs = x_probs[np.where(valid, nei, 0)]
+    # a missing neighbor is always in state -1, with zero coupling
+    nei_probs[~valid] = [1.0, 0.0]
+    # prob_nei[n, s] = prod_k P(S_k^X = NEI_STATES[s, k])
+    prob_nei = nei_probs[:, np.arange(4)[np.newaxis, :], NEI_STATE_IDS]. \
+        prod(axis=2)
+    field = bond_jj[ids] @ NEI_STATES.T
+    # u[n, s, x] is such that energy_minus - energy_plus = 2*u
+    u = field[:, :, np.newaxis] + site_h[ids, np.newaxis, np.newaxis] + \
+        site_lam[ids, np.newaxis, np.newaxis] * X_SPINS
+    log_cond_prob_m = -np.logaddexp(0, 2 * beta * u)
+    log_cond_prob_p = -np.logaddexp(0, -2 * beta * u)
+    cond_prob_m = np.exp(log_cond_prob_m)
+    cond_prob_p = np.exp(log_cond_prob_p)
+    joint = prob_nei[:, :, np.newaxis] * x_probs[ids, np.newaxis, :]
+    y_probs = np.stack([(joint * cond_prob_m).sum(axis=(1, 2)),
+                        (joint * cond_prob_p).sum(axis=(1, 2))], axis=1)
+    # renormalize, else rounding errors grow exponentially with the number
+    # of iterations (very fast when do_gauss_seidel=True)
+    y_probs /= y_probs.sum(axis=1, keepdims=True)
+    cond_info = -(joint * (cond_prob_m * log_cond_prob_m +
+                           cond_prob_p * log_cond_prob_p)).sum(axis=(1, 2))
+    return y_probs, cond_info
+
+
+def calc_y_tangents_block(x_probs, x_tangents, nei_ids, bond_jj, site_h,
+                          site_lam, beta, ids):
+    """
+    This method is the forward mode (tangent) derivative of
+    calc_y_probs_block(). Given P(S_i^X=-1) and its derivatives with
+    respect to the parameters TANGENT_PARAMS = (beta, h), it returns the
+    derivatives of P(S_i^Y=-1) and of H(S_i^Y|S_i^X) with respect to the
+    same parameters, for each node id in `ids`. The derivative with
+    respect to h is the one for a uniform shift of site_h. Iterating this
+    alongside the sweeps gives the derivatives of the fixed point
+    marginals.
+
+    Parameters
+    ----------
+    x_probs: np.array
+        shape (NUM_DNODES, 2)
+    x_tangents: np.array
+        shape (NUM_DNODES, 2), x_tangents[i, p] = d P(S_i^X=-1)/d param p
+    nei_ids: np.array
+    bond_jj: np.array
+    site_h: np.array
+    site_lam: np.array
+    beta: float
+    ids: np.array
+        See calc_y_probs_block()
+
+    Returns
+    -------
+    y_tangents, cond_info_tangents: tuple[np.array]
+        shapes (len(ids), 2) and (len(ids), 2), derivatives of P(S_i^Y=-1)
+        and H(S_i^Y|S_i^X)
+
+    """
+    nei = nei_ids[ids]
+    valid = nei >= 0
+    safe_nei = np.where(valid, nei, 0)
+    nei_probs = x_probs[safe_nei]
+    nei_probs[~valid] = [1.0, 0.0]
+    # d P(S=-1) = dp, d P(S=+1) = -dp
+    nei_dprobs = np.where(valid[:, :, np.newaxis], x_tangents[safe_nei],
+                          0.0)[:, :, np.newaxis, :] * \
+        np.array([1.0, -1.0])[:, np.newaxis]
+    k_ids = np.arange(4)[np.newaxis, :]
+    # factors of prob_nei, shape (n, 16, 4) and their derivatives, shape
+    # (n, 16, 4, num_params)
+    factors = nei_probs[:, k_ids, NEI_STATE_IDS]
+    dfactors = nei_dprobs[:, k_ids, NEI_STATE_IDS]
+    prob_nei = factors.prod(axis=2)
+    # product rule, without dividing by factors that may be zero
+    dprob_nei = sum(dfactors[:, :, k, :] * np.prod(
+        factors[:, :, [j for j in range(4) if j != k]],
+        axis=2)[:, :, np.newaxis] for k in range(4))
+    x_nd_probs = x_probs[ids]
+    dx_nd_probs = x_tangents[ids][:, np.newaxis, :] * \
+        np.array([1.0, -1.0])[:, np.newaxis]
+    joint = prob_nei[:, :, np.newaxis] * x_nd_probs[:, np.newaxis, :]
+    djoint = dprob_nei[:, :, np.newaxis, :] * \
+        x_nd_probs[:, np.newaxis, :, np.newaxis] + \
+        prob_nei[:, :, np.newaxis, np.newaxis] * \
+        dx_nd_probs[:, np.newaxis, :, :]
+
+    field = bond_jj[ids] @ NEI_STATES.T
+    u = field[:, :, np.newaxis] + site_h[ids, np.newaxis, np.newaxis] + \
+        site_lam[ids, np.newaxis, np.newaxis] * X_SPINS
+    a = 2 * beta * u
+    log_cond_prob_m = -np.logaddexp(0, a)
+    log_cond_prob_p = -np.logaddexp(0, -a)
+    cond_prob_m = np.exp(log_cond_prob_m)
+    cond_prob_p = np.exp(log_cond_prob_p)
+    # da/dbeta = 2u, da/dh = 2beta
+    da = np.stack([2 * u, np.full(u.shape, 2.0 * beta)], axis=-1)
+    dcond_prob_m = -(cond_prob_m * cond_prob_p)[..., np.newaxis] * da
+
+    # P(S_i^Y=-1) = ym/zz, as renormalized in calc_y_probs_block()
+    ym = (joint * cond_prob_m).sum(axis=(1, 2))
+    zz = joint.sum(axis=(1, 2))
+    dym = (djoint * cond_prob_m[..., np.newaxis] +
+           joint[..., np.newaxis] * dcond_prob_m).sum(axis=(1, 2))
+    dzz = djoint.sum(axis=(1, 2))
+    y_tangents = (dym * zz[:, np.newaxis] - ym[:, np.newaxis] * dzz) / \
+        (zz ** 2)[:, np.newaxis]
+
+    # cond_info = -sum joint*g, g = cm*log(cm) + cp*log(cp), dg/da = a*cm*cp
+    g = cond_prob_m * log_cond_prob_m + cond_prob_p * log_cond_prob_p
+    dg = (a * cond_prob_m * cond_prob_p)[..., np.newaxis] * da
+    cond_info_tangents = -(djoint * g[..., np.newaxis] +
+                           joint[..., np.newaxis] * dg).sum(axis=(1, 2))
+    return y_tangents, cond_info_tangents
+
+
+class Sweep_Backend:
+    """
+    This is the base class of the backends that Net uses to perform one
+    sweep of the lattice, i.e., to calculate P(S_i^Y) and H(S_i^Y|S_i^X)
+    for every node i, given P(S_i^X) for every node i. A backend reads the
+    arrays stored in an object of class Net and returns new arrays. It does
+    not modify the Net object, except that, when do_gauss_seidel=True,
+    P(S_i^X) is replaced by P(S_i^Y) as soon as node i has been updated,
+    so that nodes updated later in the sweep already see it.
+
+    The metrics of the sweep (see Lattice_Stats.py) are accumulated block
+    by block, as soon as each block of nodes has been updated, so that
+    no further pass over the lattice is needed to calculate them.
+
+    Attributes
+    ----------
+    block_size: int
+        number of nodes per block. It limits the size of the temporary
+        arrays, and sets how often the Lattice_Stats of the sweep are
+        updated
+    name: str
+        name used to select the backend in get_sweep_backend()
+
+    """
+    name = None
+
+    def __init__(self, block_size=2**16):
+        """
+        constructor
+
+        Parameters
+        ----------
+        block_size: int
+        """
+        self.block_size = block_size
+
+    def get_blocks(self, id_order):
+        """
+        This method splits id_order into blocks of self.block_size nodes.
+
+        Parameters
+        ----------
+        id_order: np.array
+
+        Returns
+        -------
+        list[np.array]
+
+        """
+        return [id_order[k: k + self.block_size] for k in
+                range(0, len(id_order), self.block_size)]
+
+    @staticmethod
+    def update_stats(stats, net, y_probs, cond_info, ids):
+        """
+        This method adds the metrics of the nodes ids, which have just been
+        updated, to stats. Each node is weighted by the size of its orbit
+        when net only calculates one site per orbit.
+
+        Parameters
+        ----------
+        stats: Lattice_Stats|None
+            nothing is done if None
+        net: Net
+        y_probs: np.array
+            shape (NUM_DNODES, 2)
+        cond_info: np.array
+            shape (NUM_DNODES,)
+        ids: np.array
+
+        Returns
+        -------
+        None
+
+        """
+        if stats is None:
+            return
+        y_prob_m = y_probs[ids, 0]
+        entropy, efficiency = calc_entropy_and_efficiency(y_prob_m,
+                                                          cond_info[ids])
+        weights = None if net.orbit_sizes is None else net.orbit_sizes[ids]
+        stats.update(y_prob_m, entropy, cond_info[ids], efficiency, weights)
+
+    def sweep(self, net, id_order, do_gauss_seidel=False, stats=None):
+        """
+        This method performs one sweep of the lattice of `net`.
+
+        Parameters
+        ----------
+        net: Net
+        id_order: np.array
+            0 based node ids, in the order in which they are updated. It
+            may hold only some of the nodes, e.g., one per orbit of the
+            symmetries of the lattice. The other nodes keep the
+            P(S_i^Y) of net.y_probs, and a zero H(S_i^Y|S_i^X)
+        do_gauss_seidel: bool
+            False iff all Y nodes are calculated from the X nodes of the
+            previous time slice (the order of id_order is irrelevant
+            then). True iff net.x_probs[i] is overwritten by the new
+            P(S_i^Y) right after node i is updated.
+        stats: Lattice_Stats|None
+            If not None, the metrics of the nodes of id_order are added to
+            it, block by block, with update_stats()
+
+        Returns
+        -------
+        y_probs, cond_info: tuple[np.array]
+            shapes (NUM_DNODES, 2) and (NUM_DNODES,)
+
+        """
+        raise NotImplementedError
+
+
+class Python_Backend(Sweep_Backend):
+    """
+    This backend is the original, pure Python, node by node calculation,
+    using an object of class Cond_Prob. It is slow, and is kept as the
+    reference implementation.
+
+    """
+    name = "python"
+
+    def sweep(self, net, id_order, do_gauss_seidel=False, stats=None):
+        """
+        See Sweep_Backend.sweep()
+
+        Parameters
+        ----------
+        net: Net
+        id_order: np.array
+        do_gauss_seidel: bool
+        stats: Lattice_Stats|None
+
+        Returns
+        -------
+        y_probs, cond_info: tuple[np.array]
+
+        """
+        y_probs = net.y_probs.copy()
+        cond_infos = np.zeros(len(net.x_probs))
+        for ids in self.get_blocks(id_order):
+            self.sweep_block(net, ids, do_gauss_seidel, y_probs, cond_infos)
+            self.update_stats(stats, net, y_probs, cond_infos, ids)
+        return y_probs, cond_infos
+
+    @staticmethod
+    def sweep_block(net, ids, do_gauss_seidel, y_probs, cond_infos):
+        """
+        This method updates the nodes ids, one at a time, and writes their
+        results into y_probs and cond_infos.
+
+        Parameters
+        ----------
+        net: Net
+        ids: np.array
+        do_gauss_seidel: bool
+        y_probs: np.array
+        cond_infos: np.array
+
+        Returns
+        -------
+        None
+
+        """
+        for nd in ids:
+            x_nd_probs = net.x_probs[nd]
+            nearest_nei = [int(nei) for nei in net.nei_ids[nd] if nei >= 0]
+            num_nearest_nei = len(nearest_nei)
+            cond_info = 0
+            prob_m = 0
+            prob_p = 0
+            for nearest_nei_states in itertools.product(
+                    [-1, 1], repeat=num_nearest_nei):
+                prob_nearest_nei = prod(
+                    [net.x_probs[nearest_nei[i],
+                                 (nearest_nei_states[i] + 1) // 2] for i in
+                     range(num_nearest_nei)])
+                for x_spin in [-1, 1]:
+                    x_nd_prob = x_nd_probs[(x_spin + 1) // 2]
+                    cond_prob_m, cond_prob_p, zz = \
+                        net.cpt.calc_cond_probs_y_if_abcd_x(
+                            nearest_nei_states, x_spin,
+                            abcd_jj=net.bond_jj[nd, :num_nearest_nei],
+                            h=net.site_h[nd], lam=net.site_lam[nd])
+                    joint_prob_m = (cond_prob_m * prob_nearest_nei *
+                                    x_nd_prob)
+                    joint_prob_p = (cond_prob_p * prob_nearest_nei *
+                                    x_nd_prob)
+                    prob_m += joint_prob_m
+                    prob_p += joint_prob_p
+                    cond_info -= joint_prob_m * np.log(cond_prob_m)
+                    cond_info -= joint_prob_p * np.log(cond_prob_p)
+            # see calc_y_probs_block() about renormalizing
+            zz = prob_m + prob_p
+            prob_m /= zz
+            prob_p /= zz
+            y_probs[nd] = [prob_m, prob_p]
+            cond_infos[nd] = cond_info
+            if do_gauss_seidel:
+                net.x_probs[nd] = y_probs[nd]
+
+
+class Numpy_Backend(Sweep_Backend):
+    """
+    This backend calculates all the nodes at once, in blocks of
+    `block_size` nodes, with the vectorized kernel calc_y_probs_block().
+    When do_gauss_seidel=True, the nodes must be updated one at a time,
+    so this backend is then much slower than Numba_Backend.
+
+    """
+    name = "numpy"
+
+    def sweep(self, net, id_order, do_gauss_seidel=False, stats=None):
+        """
+        See Sweep_Backend.sweep()
+
+        Parameters
+        ----------
+        net: Net
+        id_order: np.array
+        do_gauss_seidel: bool
+        stats: Lattice_Stats|None
+
+        Returns
+        -------
+        y_probs, cond_info: tuple[np.array]
+
+        """
+        y_probs = net.y_probs.copy()
+        cond_info = np.zeros(len(net.x_probs))
+        for ids in self.get_blocks(id_order):
+            sub_blocks = [[nd] for nd in ids] if do_gauss_seidel else [ids]
+            for sub_ids in sub_blocks:
+                y_probs[sub_ids], cond_info[sub_ids] = calc_y_probs_block(
+                    net.x_probs, net.nei_ids, net.bond_jj, net.site_h,
+                    net.site_lam, net.beta, sub_ids)
+                if do_gauss_seidel:
+                    net.x_probs[sub_ids] = y_probs[sub_ids]
+            self.update_stats(stats, net, y_probs, cond_info, ids)
+        return y_probs, cond_info
+
+
+def _log1p_exp(a):
+    """
+    log(1 + exp(a)), without overflow. Compiled by get_numba_sweep()
+    """
+    if a > 0:
+        return a + np.log1p(np.exp(-a))
+    return np.log1p(np.exp(a))
+
+
+def _numba_sweep(x_probs, nei_ids, bond_jj, site_h, site_lam, beta,
+                 id_order, do_gauss_seidel, y_probs, cond_info):
+    """
+    Node by node version of calc_y_probs_block(), compiled by
+    get_numba_sweep(). It writes its results into y_probs and cond_info.
+    """
+    for nd in id_order:
+        prob_m = 0.0
+        prob_p = 0.0
+        c_info = 0.0
+        for config in range(16):
+            prob_nei = 1.0
+            field = 0.0
+            for k in range(4):
+                bit = (config >> k) & 1
+                nei = nei_ids[nd, k]
+                if nei < 0:
+                    # missing neighbor, always in state -1
+                    if bit == 1:
+                        prob_nei = 0.0
+                    continue
+                prob_nei *= x_probs[nei, bit]
+                field += bond_jj[nd, k] * (2 * bit - 1)
+            if prob_nei == 0.0:
+                continue
+            for x_bit in range(2):
+                joint = prob_nei * x_probs[nd, x_bit]
+                u = field + site_h[nd] + site_lam[nd] * (2 * x_bit - 1)
+                log_cond_prob_m = -_log1p_exp(2 * beta * u)
+                log_cond_prob_p = -_log1p_exp(-2 * beta * u)
+                cond_prob_m = np.exp(log_cond_prob_m)
+                cond_prob_p = np.exp(log_cond_prob_p)
+                prob_m += joint * cond_prob_m
+                prob_p += joint * cond_prob_p
+                c_info -= joint * (cond_prob_m * log_cond_prob_m +
+                                   cond_prob_p * log_cond_prob_p)
+        zz = prob_m + prob_p
+        prob_m /= zz
+        prob_p /= zz
+        y_probs[nd, 0] = prob_m
+        y_probs[nd, 1] = prob_p
+        cond_info[nd] = c_info
+        if do_gauss_seidel:
+            x_probs[nd, 0] = prob_m
+            x_probs[nd, 1] = prob_p
+
+
+_numba_sweep_jit = None
+
+
+def get_numba_sweep():
+    """
+    This method imports numba and JIT compiles _numba_sweep(), the first
+    time it is called. It returns the compiled function.
+
+    Returns
+    -------
+    function
+
+    """
+    global _log1p_exp, _numba_sweep_jit
+    if _numba_sweep_jit is None:
+        import numba
+        # _numba_sweep() calls the global _log1p_exp, which must be
+        # compiled first
+        _log1p_exp = numba.njit(cache=True)(_log1p_exp)
+        _numba_sweep_jit = numba.njit(cache=True)(_numba_sweep)
+    return _numba_sweep_jit
+
+
+class Numba_Backend(Sweep_Backend):
+    """
+    This backend calculates the nodes one at a time, in the order
+    id_order, with a kernel that is JIT compiled by numba. It is the
+    fastest backend when do_gauss_seidel=True. It requires numba.
+
+    """
+    name = "numba"
+
+    def __init__(self, block_size=2**16):
+        """
+        constructor
+
+        Parameters
+        ----------
+        block_size: int
+        """
+        assert HAS_NUMBA, "numba is not installed"
+        super().__init__(block_size)
+
+    def sweep(self, net, id_order, do_gauss_seidel=False, stats=None):
+        """
+        See Sweep_Backend.sweep()
+
+        Parameters
+        ----------
+        net: Net
+        id_order: np.array
+        do_gauss_seidel: bool
+        stats: Lattice_Stats|None
+
+        Returns
+        -------
+        y_probs, cond_info: tuple[np.array]
+
+        """
+        y_probs = net.y_probs.copy()
+        cond_info = np.zeros(len(net.x_probs))
+        numba_sweep = get_numba_sweep()
+        for ids in self.get_blocks(np.asarray(id_order, dtype=np.int64)):
+            numba_sweep(net.x_probs, net.nei_ids, net.bond_jj, net.site_h,
+                        net.site_lam, float(net.beta), ids, do_gauss_seidel,
+                        y_probs, cond_info)
+            self.update_stats(stats, net, y_probs, cond_info, ids)
+        return y_probs, cond_info
+
+
+BACKEND_CLASSES = [Python_Backend, Numpy_Backend, Numba_Backend]
+
+
+def get_sweep_backend(backend):
+    """
+    This method returns an object of a subclass of Sweep_Backend. If
+    `backend` is already such an object, it is returned unchanged. If
+    numba is requested but is not installed, the numpy backend is returned
+    instead, with a warning.
+
+    Parameters
+    ----------
+    backend: str|Sweep_Backend
+        either "python", "numpy", "numba" or a Sweep_Backend object
+
+    Returns
+    -------
+    Sweep_Backend
+
+    """
+    if isinstance(backend, Sweep_Backend):
+        return backend
+    name_to_class = {cls.name: cls for cls in BACKEND_CLASSES}
+    assert backend in name_to_class, \
+        f"backend must be one of {list(name_to_class)}"
+    if backend == "numba" and not HAS_NUMBA:
+        warnings.warn("numba is not installed, using the numpy backend")
+        backend = "numpy"
+    return name_to_class[backend]()
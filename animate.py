@@ -0,0 +1,305 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+'''
+
+This module renders the time evolution of a Net run, i.e., the marginals
+P(S_i^Y=-1) and efficiencies epsilon(S_i^Y|S_i^X) of every iteration
+(Net(..., keep_history=True).history), into an animated GIF, an MP4 movie
+or a sequence of PNG files, without a display.
+
+Unlike plot_dot_with_colorbar() in plotting.py, which runs graphviz and
+creates a new figure for every plot, the frames are drawn as two images
+of the lattice, in a single figure that is reused for every frame and
+every run. The static parts of the figure (axes, colorbars, labels) are
+drawn once and saved. Each frame then only restores that background and
+redraws the artists that change (the two images and the caption), which
+is called blitting. The frames are taken from the Agg canvas as RGB
+arrays, one at a time. They are streamed to ffmpeg or to PNG files. A
+GIF cannot be streamed with Pillow, which keeps every (quantized) frame
+until it writes the file, so use .png for very long runs.
+
+MP4 output requires the ffmpeg executable. The piping of the frames to
+ffmpeg is tested with a stand-in for ffmpeg (test_animate.py), but the
+encoding options have not been checked against a real ffmpeg. GIF and
+PNG output only require matplotlib (and Pillow, a dependency of
+matplotlib).
+
+As in plotting.py, matplotlib is imported inside the functions.
+
+'''
+
+
+class Lattice_Animator:
+    """
+    This class owns the reused figure and renders frames into it.
+
+    Attributes
+    ----------
+    background: object
+        the saved static parts of the figure
+    caption: matplotlib.text.Text
+    eff_image: matplotlib.image.AxesImage
+        image of epsilon(S_i^Y|S_i^X)
+    fig: matplotlib.figure.Figure
+    num_cols: int
+    num_rows: int
+    prob_image: matplotlib.image.AxesImage
+        image of P(S_i^Y=-1)
+
+    """
+
+    def __init__(self, num_rows, num_cols, cmap_name="viridis",
+                 figsize=(8, 4), dpi=100):
+        """
+        constructor
+
+        Parameters
+        ----------
+        num_rows: int
+        num_cols: int
+        cmap_name: str
+            colormap of the efficiency, as in plotting.efficiency_to_hex()
+        figsize: tuple[float]
+        dpi: int
+        """
+        import matplotlib
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        # a Figure that is not managed by pyplot, drawn on an Agg canvas,
+        # so no display is needed, whatever the matplotlib backend
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax_prob, ax_eff = self.fig.subplots(1, 2)
+        blank = np.zeros((num_rows, num_cols))
+        # black for S_i^Y=-1, as in Net.write_dot_file()
+        self.prob_image = ax_prob.imshow(blank, cmap="Greys", vmin=0,
+                                         vmax=1, animated=True)
+        ax_prob.set_title("P(S_i^Y=-1)")
+        cmap = matplotlib.colormaps[cmap_name].with_extremes(bad="lightgray")
+        self.eff_image = ax_eff.imshow(blank, cmap=cmap, vmin=0, vmax=1,
+                                       animated=True)
+        ax_eff.set_title("efficiency (gray if undefined)")
+        for ax, image in [(ax_prob, self.prob_image),
+                          (ax_eff, self.eff_image)]:
+            ax.set_xticks([])
+            ax.set_yticks([])
+            self.fig.colorbar(image, ax=ax, shrink=.8)
+        self.caption = self.fig.text(.5, .02, "", ha="center", va="bottom",
+                                     animated=True)
+        # draw the static parts once (animated artists are skipped)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self, prob_m, efficiency, caption=""):
+        """
+        This method draws one frame and returns it as an RGB array.
+
+        Parameters
+        ----------
+        prob_m: np.array
+            shape (num_rows*num_cols,), P(S_i^Y=-1)
+        efficiency: np.array
+            shape (num_rows*num_cols,), epsilon(S_i^Y|S_i^X), np.nan when
+            undefined
+        caption: str
+
+        Returns
+        -------
+        np.array
+            shape (height, width, 3), dtype uint8
+
+        """
+        shape = (self.num_rows, self.num_cols)
+        self.prob_image.set_data(np.reshape(prob_m, shape))
+        self.eff_image.set_data(np.ma.masked_invalid(
+            np.reshape(efficiency, shape)))
+        self.caption.set_text(caption)
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in [self.prob_image, self.eff_image, self.caption]:
+            self.fig.draw_artist(artist)
+        return np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+    def render_history(self, history, title=""):
+        """
+        This generator yields the frames of the history of a Net, one per
+        iteration.
+
+        Parameters
+        ----------
+        history: dict[str, np.array]
+            Net.history
+        title: str
+            prepended to the caption of each frame
+
+        Returns
+        -------
+        Iterator[np.array]
+
+        """
+        for i in range(len(history["mag"])):
+            caption = f"{title}iter={i + 1}, mag={history['mag'][i]:.5f}, " \
+                      f"av_eff={history['av_eff'][i]:.5f}"
+            yield self.render(history["y_prob_m"][i],
+                              history["y_efficiency"][i], caption)
+
+
+def write_frames(frames, out, fps=5):
+    """
+    This method writes the RGB frames to the file `out`. The format is
+    given by the extension of `out`:
+
+    .gif: an animated GIF, looping forever. The frames are quantized one
+    at a time, but Pillow keeps all of them (at 1 byte per pixel) until it
+    writes the file, so the memory used grows with the number of frames
+
+    .mp4: an H.264 movie, encoded by ffmpeg. The frames are piped to ffmpeg
+    one at a time. Raises an AssertionError if ffmpeg fails, or exits
+    before reading all the frames. See the docstring of this module for
+    what has been tested
+
+    .png: one PNG file per frame, named out with "_0000", "_0001", etc.
+    inserted before the extension
+
+    Parameters
+    ----------
+    frames: Iterable[np.array]
+        each of shape (height, width, 3), dtype uint8
+    out: str
+    fps: float
+        frames per second
+
+    Returns
+    -------
+    int
+        number of frames written
+
+    """
+    from PIL import Image
+
+    root, ext = os.path.splitext(out)
+    num_frames = 0
+    if ext == ".gif":
+        # the fast octree quantizer is about 3 times faster than the
+        # default one, and gives smaller files for these flat images
+        def get_images():
+            nonlocal num_frames
+            for frame in frames:
+                num_frames += 1
+                yield Image.fromarray(frame).quantize(
+                    256, method=Image.Quantize.FASTOCTREE)
+
+        images = get_images()
+        first = next(images, None)
+        assert first is not None, "no frames"
+        first.save(out, save_all=True, append_images=images,
+                   duration=int(1000 / fps), loop=0)
+    elif ext == ".png":
+        for frame in frames:
+            Image.fromarray(frame).save(f"{root}_{num_frames:04d}.png")
+            num_frames += 1
+    elif ext == ".mp4":
+        assert shutil.which("ffmpeg"), "writing .mp4 requires ffmpeg"
+        proc = None
+        # True iff ffmpeg exited before reading all the frames
+        broken_pipe = False
+        try:
+            for frame in frames:
+                if proc is None:
+                    height, width = frame.shape[:2]
+                    proc = subprocess.Popen(
+                        ["ffmpeg", "-y", "-loglevel", "error",
+                         "-f", "rawvideo", "-pix_fmt", "rgb24",
+                         "-s", f"{width}x{height}", "-r", str(fps),
+                         "-i", "-",
+                         # H.264 needs even dimensions
+                         "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                         "-vcodec", "libx264", "-pix_fmt", "yuv420p", out],
+                        stdin=subprocess.PIPE)
+                proc.stdin.write(frame.tobytes())
+                num_frames += 1
+        except BrokenPipeError:
+            broken_pipe = True
+        finally:
+            # also if frames raises, so that ffmpeg is not left waiting
+            if proc is not None:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    broken_pipe = True
+                returncode = proc.wait()
+        assert proc is not None, "no frames"
+        assert returncode == 0 and not broken_pipe, \
+            f"ffmpeg failed (exit code {returncode}) after {num_frames} " \
+            f"frames, see its messages above"
+    else:
+        assert False, f"unknown output format {ext}"
+    return num_frames
+
+
+def animate_net(net, out, fps=5, animator=None, title=""):
+    """
+    This method writes the animation of the history of net to the file
+    `out` (see write_frames() for the formats).
+
+    Parameters
+    ----------
+    net: Net
+        created with keep_history=True
+    out: str
+    fps: float
+    animator: Lattice_Animator|None
+        a Lattice_Animator for the shape of the lattice of net, to be
+        reused across runs. If None, a new one is created
+    title: str
+        prepended to the caption of each frame
+
+    Returns
+    -------
+    int
+        number of frames written
+
+    """
+    assert net.history is not None, "Net was created with keep_history=False"
+    if animator is None:
+        animator = Lattice_Animator(net.num_rows, net.num_cols)
+    assert (animator.num_rows, animator.num_cols) == \
+        (net.num_rows, net.num_cols), "animator is for another lattice shape"
+    return write_frames(animator.render_history(net.history, title), out,
+                        fps)
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+    import tempfile
+
+    from Net import Net
+    from globals import *
+
+
+    def main():
+        num_rows = num_cols = 32
+        animator = Lattice_Animator(num_rows, num_cols)
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = perf_counter()
+            num_frames = 0
+            for beta_hat in [.7, 1.0, 1.3]:
+                net = Net(beta_hat * BETA_JJ_CURIE, 1, num_iter=30, p0=None,
+                          backend="numpy", verbose=False, num_rows=num_rows,
+                          num_cols=num_cols, make_nodes=False, seed=1,
+                          keep_history=True)
+                num_frames += animate_net(
+                    net, os.path.join(tmp, f"beta_hat={beta_hat}.gif"),
+                    animator=animator, title=f"beta_hat={beta_hat}, ")
+            print(f"{num_frames} frames, "
+                  f"{(perf_counter() - t0) / num_frames * 1000:.1f} ms/frame")
+
+
+    main()
@@ -0,0 +1,156 @@
+from Net import Net
+from globals import *
+
+'''
+
+This module locates the critical point beta_c at which the magnetization
+turns on, using the derivatives calculated by Net(..., do_tangents=True)
+instead of a scan over many values of beta.
+
+Starting from an initial state with nonzero magnetization (p0 != .5), the
+iterations converge to mag = 0 for beta < beta_c, and to a magnetized
+fixed point for beta > beta_c. Just above beta_c, mag^2 is linear in beta,
+so Newton's method on mag^2, whose derivative 2*mag*(d mag/d beta) is
+given by the tangents, converges to beta_c in a few steps. The magnetic
+susceptibility d mag/d h diverges (peaks) at beta_c. Each step is
+safeguarded by a bracket [beta_lo, beta_hi] with mag = 0 at beta_lo and
+mag != 0 at beta_hi, which is bisected when the Newton step leaves it.
+
+Near beta_c the iterations converge slowly (critical slowing down). A Net
+that has not converged after max_iter iterations cannot tell on which side
+of beta_c it is, so the search stops at the first such Net, and returns
+the last Newton estimate. Its accuracy is then limited by max_iter.
+
+'''
+
+
+def run_tangent_net(beta, jj, h=0, lam=0, p0=.2, tol=1e-10, max_iter=10000,
+                    **net_kwargs):
+    """
+    This method runs a Net with do_tangents=True until convergence (or
+    max_iter iterations), and returns it.
+
+    Parameters
+    ----------
+    beta: float
+    jj: float
+    h: float
+    lam: float
+    p0: float
+    tol: float
+    max_iter: int
+    net_kwargs: dict
+        other keyword arguments of Net, e.g., num_rows, backend
+
+    Returns
+    -------
+    Net
+
+    """
+    kwargs = dict(backend="numpy", make_nodes=False)
+    kwargs.update(net_kwargs)
+    return Net(beta, jj, h=h, lam=lam, num_iter=max_iter, p0=p0, tol=tol,
+               verbose=False, do_tangents=True, **kwargs)
+
+
+def find_critical_beta(beta_lo, beta_hi, jj, h=0, lam=0, p0=.2,
+                       xtol=1e-6, mag_tol=1e-6, max_steps=30, verbose=True,
+                       **net_kwargs):
+    """
+    This method returns an estimate of the beta at which the magnetization
+    turns on, found by safeguarded Newton steps on mag^2 (see the docstring
+    of this module).
+
+    Parameters
+    ----------
+    beta_lo: float
+        a beta below beta_c. It is not evaluated
+    beta_hi: float
+        a beta above beta_c, where the magnetization is nonzero. The first
+        step is taken from there
+    jj: float
+    h: float
+        should be 0, otherwise there is no sharp transition
+    lam: float
+    p0: float
+        must differ from .5, to start from a magnetized state
+    xtol: float
+        the iterations stop when the Newton step, or the bracket, is
+        smaller than this
+    mag_tol: float
+        |mag| below this counts as zero magnetization
+    max_steps: int
+        maximum number of Nets run
+    verbose: bool
+        True iff a line is printed for each Net run
+    net_kwargs: dict
+        other keyword arguments of run_tangent_net()
+
+    Returns
+    -------
+    float, list[dict]
+        the estimate of beta_c, and the history of the Nets run, one dict
+        per step with keys "beta", "mag", "dmag_dbeta", "chi" (d mag/d h),
+        "num_iter_done" and "converged"
+
+    """
+    assert p0 != .5, "p0=.5 gives mag=0 at all beta"
+    history = []
+    beta = beta_hi
+    beta_c = None
+    for step in range(max_steps):
+        net = run_tangent_net(beta, jj, h, lam, p0, **net_kwargs)
+        mag = net.get_mag()
+        dmag_dbeta, chi = net.get_mag_tangents()
+        converged = net.num_iter_done < net.num_iter
+        history.append({"beta": beta, "mag": mag, "dmag_dbeta": dmag_dbeta,
+                        "chi": chi, "num_iter_done": net.num_iter_done,
+                        "converged": converged})
+        if verbose:
+            print(f"step {step}, beta={beta:.8f}, mag={mag:.6f}, "
+                  f"d mag/d beta={dmag_dbeta:.4f}, chi={chi:.4f}, "
+                  f"num_iter_done={net.num_iter_done}")
+        if not converged:
+            if verbose:
+                print("not converged, too close to beta_c for max_iter")
+            break
+        newton_beta = None
+        if abs(mag) > mag_tol:
+            beta_hi = beta
+            if mag * dmag_dbeta > 0:
+                # Newton step on mag^2: beta - mag^2/(2 mag d mag/d beta)
+                newton_beta = beta - mag / (2 * dmag_dbeta)
+                beta_c = newton_beta
+        else:
+            beta_lo = beta
+        if newton_beta is not None and beta_lo < newton_beta < beta_hi:
+            next_beta = newton_beta
+        else:
+            next_beta = (beta_lo + beta_hi) / 2
+        if abs(next_beta - beta) < xtol or beta_hi - beta_lo < xtol:
+            break
+        beta = next_beta
+    if beta_c is None or not beta_lo <= beta_c <= beta_hi:
+        beta_c = (beta_lo + beta_hi) / 2
+    return beta_c, history
+
+
+if __name__ == "__main__":
+    def main():
+        num_rows = num_cols = 16
+        print(f"{num_rows}x{num_cols} lattice, "
+              f"BETA_JJ_CURIE={BETA_JJ_CURIE:.6f}")
+        beta_c, history = find_critical_beta(
+            .5 * BETA_JJ_CURIE, 1.5 * BETA_JJ_CURIE, jj=1,
+            num_rows=num_rows, num_cols=num_cols)
+        print(f"beta_c={beta_c:.6f}, beta_c/BETA_JJ_CURIE="
+              f"{beta_c / BETA_JJ_CURIE:.6f}, {len(history)} Nets")
+        # the susceptibility peaks at beta_c
+        for x in [.95, .99, 1.01, 1.05]:
+            net = run_tangent_net(beta_c * x, 1, num_rows=num_rows,
+                                  num_cols=num_cols)
+            print(f"beta={beta_c * x:.6f}, mag={net.get_mag():.6f}, "
+                  f"chi={net.get_mag_tangents()[1]:.4f}")
+
+
+    main()
@@ -7,3 +7,6 @@ DGRAPH_NUM_ROWS = 5
 NUM_DNODES = DGRAPH_NUM_COLS * DGRAPH_NUM_ROWS
 # print("BETA_JJ_CURIE=", (0.5)*np.log(1 + np.sqrt(2)))
 BETA_JJ_CURIE = 0.44068679350977147
+# sweep backend of the runs of run_batch.py, Net_Service.py and
+# Net_Client.py when none is given (Net itself defaults to "python")
+BATCH_BACKEND = "numpy"
@@ -0,0 +1,268 @@
+from time import perf_counter
+
+import numpy as np
+
+from Net import Net
+from globals import *
+
+'''
+
+This module warm starts the iterations of a large lattice with a
+coarse-to-fine (multigrid style) sequence of lattices. The iterations are
+first run to convergence on a coarse lattice, where they are cheap and
+information propagates across the whole lattice in a few sweeps. The
+resulting marginals P(S_i^Y) are then interpolated up to the next, finer
+lattice, where they are used as the initial P(S_i^X), and so on up to the
+target lattice.
+
+Two interpolations are available. Bilinear interpolation is used for
+non-uniform states (random p0 or heterogeneous couplings). For a uniform
+p0 and uniform couplings, the marginals are uniform in the bulk of the
+lattice, and differ from the bulk value only in boundary layers whose
+width, in sites, does not depend on the size of the lattice. Stretching
+those layers by bilinear interpolation would create an O(1) error that
+takes as many sweeps to relax as a cold start. Instead, the "edge"
+interpolation copies the boundary layers site by site and fills the bulk
+with the value at the center of the coarse lattice. The finest level then
+typically converges in one or two sweeps.
+
+'''
+
+
+def get_level_shapes(num_rows, num_cols, min_size=16, num_levels=None):
+    """
+    This method returns the list of lattice shapes (num_rows, num_cols),
+    from the coarsest to the finest (the target shape). Each level halves
+    the shape of the next finer one (rounding up), until the smallest side
+    would go below min_size, or until there are num_levels levels.
+
+    Parameters
+    ----------
+    num_rows: int
+    num_cols: int
+    min_size: int
+    num_levels: int|None
+
+    Returns
+    -------
+    list[tuple[int, int]]
+
+    """
+    shapes = [(num_rows, num_cols)]
+    while num_levels is None or len(shapes) < num_levels:
+        rows, cols = shapes[-1]
+        if min(rows, cols) // 2 < min_size:
+            break
+        shapes.append(((rows + 1) // 2, (cols + 1) // 2))
+    return shapes[::-1]
+
+
+def interpolate_probs(prob_m, shape, new_shape):
+    """
+    This method interpolates P(S_i=-1), given on a lattice of shape `shape`,
+    to a lattice of shape `new_shape`, using bilinear interpolation between
+    the centers of the sites.
+
+    Parameters
+    ----------
+    prob_m: np.array
+        shape (shape[0]*shape[1],)
+    shape: tuple[int, int]
+    new_shape: tuple[int, int]
+
+    Returns
+    -------
+    np.array
+        shape (new_shape[0]*new_shape[1],)
+
+    """
+    grid = np.asarray(prob_m, dtype=float).reshape(shape)
+    for axis in [0, 1]:
+        old_len, new_len = shape[axis], new_shape[axis]
+        # centers of the new sites, in units of the old sites
+        pos = np.clip((np.arange(new_len) + .5) * old_len / new_len - .5,
+                      0, old_len - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, old_len - 1)
+        weight = pos - lo
+        if axis == 0:
+            grid = grid[lo, :] * (1 - weight[:, np.newaxis]) + \
+                grid[hi, :] * weight[:, np.newaxis]
+        else:
+            grid = grid[:, lo] * (1 - weight) + grid[:, hi] * weight
+    return grid.ravel()
+
+
+def extend_probs_from_edges(prob_m, shape, new_shape):
+    """
+    This method extends P(S_i=-1), given on a lattice of shape `shape`, to
+    a larger lattice of shape `new_shape`. Along each axis, the sites of
+    the first and second half of the old lattice are copied to the same
+    distance from the first and last edge, respectively, of the new
+    lattice, and the sites in between get the value of the central site of
+    the old lattice. This preserves boundary layers, and is exact for a
+    lattice which is uniform except near its edges.
+
+    Parameters
+    ----------
+    prob_m: np.array
+        shape (shape[0]*shape[1],)
+    shape: tuple[int, int]
+    new_shape: tuple[int, int]
+
+    Returns
+    -------
+    np.array
+        shape (new_shape[0]*new_shape[1],)
+
+    """
+    grid = np.asarray(prob_m, dtype=float).reshape(shape)
+    old_ids = []
+    for axis in [0, 1]:
+        old_len, new_len = shape[axis], new_shape[axis]
+        half = old_len // 2
+        new_ids = np.arange(new_len)
+        old_ids.append(np.where(
+            new_ids < half, new_ids,
+            np.where(new_ids >= new_len - (old_len - half),
+                     new_ids - (new_len - old_len), half)))
+    return grid[np.ix_(old_ids[0], old_ids[1])].ravel()
+
+
+def get_coarse_param(x):
+    """
+    This method returns the value of a coupling constant (jj, h or lam) used
+    on the coarse levels. Heterogeneous couplings are replaced by their
+    average, since they cannot be coarsened exactly.
+
+    Parameters
+    ----------
+    x: float|np.array|tuple[np.array]
+
+    Returns
+    -------
+    float
+
+    """
+    if isinstance(x, tuple):
+        return float(np.mean([np.mean(a) for a in x]))
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 2:
+        # (num_dnodes, 4) bond_jj layout, zero for missing neighbors
+        return float(np.mean(x[x != 0]))
+    return float(np.mean(x))
+
+
+def run_multigrid(beta, jj, h=0, lam=0, num_rows=DGRAPH_NUM_ROWS,
+                  num_cols=DGRAPH_NUM_COLS, p0=.2, tol=1e-6,
+                  max_iter=1000, min_size=16, num_levels=None,
+                  interpolation=None, backend="numpy", verbose=True,
+                  **net_kwargs):
+    """
+    This method runs the iterations on the sequence of lattices returned
+    by get_level_shapes(), each level being warm started by the
+    interpolated marginals of the previous one, and returns the Net of the
+    finest (target) level, whose mag and av_eff are the final results.
+
+    Parameters
+    ----------
+    beta: float
+    jj: float|np.array|tuple[np.array]
+        the heterogeneous couplings allowed by Net are used on the finest
+        level only. The coarse levels use their average
+    h: float|np.array
+    lam: float|np.array
+    num_rows: int
+    num_cols: int
+    p0: float|None
+        initial P(S_i^X=-1) on the coarsest level
+    tol: float
+        each level is iterated until P(S_i^Y) changes by less than tol
+    max_iter: int
+        maximum number of iterations per level
+    min_size: int
+    num_levels: int|None
+    interpolation: str|None
+        "bilinear" (see interpolate_probs()) or "edge" (see
+        extend_probs_from_edges()). If None, "edge" is used when p0 is not
+        None and jj, h and lam are uniform, and "bilinear" otherwise
+    backend: str
+    verbose: bool
+        True iff a line is printed for each level
+    net_kwargs: dict
+        other keyword arguments of Net, e.g., do_gauss_seidel
+
+    Returns
+    -------
+    Net, int
+        the Net of the finest level, and the total work, measured as the
+        number of site updates summed over all levels
+
+    """
+    shapes = get_level_shapes(num_rows, num_cols, min_size, num_levels)
+    if interpolation is None:
+        is_uniform = not isinstance(jj, tuple) and \
+            all(np.ndim(x) == 0 for x in [jj, h, lam])
+        interpolation = "edge" if p0 and is_uniform else "bilinear"
+    name_to_interpolate = {"bilinear": interpolate_probs,
+                           "edge": extend_probs_from_edges}
+    interpolate = name_to_interpolate[interpolation]
+    init_x_probs = None
+    work = 0
+    net = None
+    for level, shape in enumerate(shapes):
+        is_finest = level == len(shapes) - 1
+        if net is not None:
+            init_x_probs = interpolate(net.y_probs[:, 0],
+                                       (net.num_rows, net.num_cols), shape)
+        t0 = perf_counter()
+        net = Net(beta=beta,
+                  jj=jj if is_finest else get_coarse_param(jj),
+                  h=h if is_finest else get_coarse_param(h),
+                  lam=lam if is_finest else get_coarse_param(lam),
+                  num_iter=max_iter,
+                  p0=p0,
+                  backend=backend,
+                  verbose=False,
+                  num_rows=shape[0],
+                  num_cols=shape[1],
+                  init_x_probs=init_x_probs,
+                  tol=tol,
+                  make_nodes=False,
+                  **net_kwargs)
+        work += net.num_iter_done * net.num_dnodes
+        if verbose:
+            print(f"level {level}, shape={shape}, "
+                  f"num_iter_done={net.num_iter_done}, "
+                  f"mag={net.get_mag():.5f}, "
+                  f"time={perf_counter() - t0:.2f} s")
+    return net, work
+
+
+if __name__ == "__main__":
+    def main():
+        num_rows = num_cols = 256
+        beta = BETA_JJ_CURIE * 1.2
+        p0 = .45
+        tol = 1e-6
+
+        t0 = perf_counter()
+        net = Net(beta=beta, jj=1, num_iter=1000, p0=p0, backend="numpy",
+                  verbose=False, num_rows=num_rows, num_cols=num_cols,
+                  tol=tol, make_nodes=False)
+        print(f"full resolution: num_iter_done={net.num_iter_done}, "
+              f"mag={net.get_mag():.6f}, av_eff={net.get_av_eff2()[0]:.6f},"
+              f" work={net.num_iter_done * net.num_dnodes}, "
+              f"time={perf_counter() - t0:.2f} s")
+
+        for interpolation in ["bilinear", "edge"]:
+            t0 = perf_counter()
+            net, work = run_multigrid(beta=beta, jj=1, num_rows=num_rows,
+                                      num_cols=num_cols, p0=p0, tol=tol,
+                                      interpolation=interpolation)
+            print(f"multigrid, {interpolation}: mag={net.get_mag():.6f}, "
+                  f"av_eff={net.get_av_eff2()[0]:.6f}, work={work}, "
+                  f"time={perf_counter() - t0:.2f} s")
+
+
+    main()
@@ -2,11 +2,10 @@ import subprocess
 import tempfile
 import os
 
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-import matplotlib.image as mpimg
-from matplotlib.gridspec import GridSpec
+# matplotlib is imported inside each function of this module, not at the
+# top, so that importing this module (and therefore Net.py, which imports
+# it) is fast and does not require matplotlib. matplotlib is loaded the
+# first time a function of this module is called.
 
 
 def efficiency_to_hex(e, cmap_name="viridis"):
@@ -19,7 +18,9 @@ def efficiency_to_hex(e, cmap_name="viridis"):
     e: float
     cmap_name: str
     """
-    cmap = cm.get_cmap(cmap_name)
+    import matplotlib
+    import matplotlib.colors as mcolors
+    cmap = matplotlib.colormaps[cmap_name]
     rgba = cmap(e)  # (r, jj, b, a) in [0,1]
     return mcolors.to_hex(rgba)  # '#rrggbb'
 
@@ -54,6 +55,11 @@ def plot_dot_with_colorbar(
     -------
 
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    import matplotlib.colors as mcolors
+    import matplotlib.image as mpimg
+    from matplotlib.gridspec import GridSpec
     with tempfile.TemporaryDirectory() as tmp:
         png_file = os.path.join(tmp, "graph.png")
 
@@ -107,6 +113,7 @@ def plot_parametric_curve(param_to_x_y):
     None
 
     """
+    import matplotlib.pyplot as plt
     # Sort dictionary by parameter p0
     sorted_items = sorted(param_to_x_y.items())
 
@@ -163,6 +170,7 @@ def plot_x_to_y(x_to_y,
     xlabel: str
     ylabel: str
     """
+    import matplotlib.pyplot as plt
 
     # Sort by x so the curve is ordered
     x_vals = sorted(x_to_y.keys())
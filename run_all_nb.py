@@ -1,28 +1,284 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
 import nbformat
 from nbconvert.preprocessors import ExecutePreprocessor
-import os
 
 '''
 
-This script tries to run all jupyter notebooks in the jupyter_notebooks 
-folder. The notebooks are executed but not saved (i.e., overwritten). 
+This script tries to run all jupyter notebooks in the jupyter_notebooks
+folder. The notebooks are executed but not saved (i.e., overwritten).
+
+The notebooks are executed concurrently, in a pool of worker processes,
+each with a time limit. A notebook is skipped if neither its content nor
+the *.py sources of the repo (which the notebooks import) have changed
+since the last time it ran successfully (the hashes are kept in the file
+CACHE_FNAME of the notebook folder). A report with the status and
+run time of each notebook is printed at the end.
+
+python run_all_nb.py [--jobs 4] [--timeout 1200] [--force]
 
 '''
 
-dir_name = 'jupyter_notebooks'
-for fname in os.listdir(dir_name):
-    if fname[-6:] == '.ipynb':  # and fname[-12:] == 'native.ipynb':
-        print("------------", fname)
-        try:
-            # open() fails when reading markdown Chinese characters
-            # and also some types of quotation marks
-            nb = nbformat.read(dir_name + '/' + fname,
-                               as_version=4)
-            ep = ExecutePreprocessor()
-            ep.preprocess(nb, {'metadata': {'path': dir_name + "/"}})
-        except:
-            print('error in ', fname)
-        # #this raise will stop execution on first error
-        #     raise
-        # finally:
-        #     nbformat.write(nb, "ERROR_" + fname)S
\ No newline at end of file
+CACHE_FNAME = '.run_all_nb_cache.json'
+# folder of the modules imported by the notebooks
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_sources_hash(src_dir=SRC_DIR):
+    """
+    This method returns the sha256 hash of the names and contents of the
+    *.py files of src_dir.
+
+    Parameters
+    ----------
+    src_dir: str
+
+    Returns
+    -------
+    str
+
+    """
+    sha = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(src_dir, '*.py'))):
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            sha.update(hashlib.sha256(f.read()).digest())
+    return sha.hexdigest()
+
+
+def get_nb_hash(path, sources_hash):
+    """
+    This method returns the sha256 hash of the content of a notebook file
+    and of the sources it imports, so that editing either invalidates the
+    cache.
+
+    Parameters
+    ----------
+    path: str
+    sources_hash: str
+        see get_sources_hash()
+
+    Returns
+    -------
+    str
+
+    """
+    sha = hashlib.sha256(sources_hash.encode())
+    with open(path, 'rb') as f:
+        sha.update(f.read())
+    return sha.hexdigest()
+
+
+def read_cache(dir_name):
+    """
+    This method returns the dictionary fname -> hash of the notebooks that
+    ran successfully last time.
+
+    Parameters
+    ----------
+    dir_name: str
+
+    Returns
+    -------
+    dict[str, str]
+
+    """
+    path = os.path.join(dir_name, CACHE_FNAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_cache(dir_name, fname_to_hash):
+    """
+    This method writes the dictionary fname -> hash of the notebooks that
+    ran successfully.
+
+    Parameters
+    ----------
+    dir_name: str
+    fname_to_hash: dict[str, str]
+
+    Returns
+    -------
+    None
+
+    """
+    path = os.path.join(dir_name, CACHE_FNAME)
+    # written to a temporary file first, so that an interrupt cannot leave
+    # a truncated cache
+    with open(path + '.tmp', 'w') as f:
+        json.dump(fname_to_hash, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def on_alarm(signum, frame):
+    """
+    SIGALRM handler used by run_nb()
+    """
+    raise TimeoutError
+
+
+def run_nb(dir_name, fname, timeout):
+    """
+    This method executes one notebook, without saving it. It runs inside a
+    worker process. The whole notebook must finish within `timeout`
+    seconds. This is enforced with SIGALRM where it exists (not on
+    Windows). Each cell must also finish within `timeout` seconds.
+
+    Parameters
+    ----------
+    dir_name: str
+    fname: str
+    timeout: int
+
+    Returns
+    -------
+    (str, float, str)
+        status ("ok", "error" or "timeout"), run time in seconds, and error
+        message ("" if none)
+
+    """
+    t0 = perf_counter()
+    has_alarm = hasattr(signal, 'SIGALRM')
+    if has_alarm:
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.alarm(timeout)
+    try:
+        # open() fails when reading markdown Chinese characters
+        # and also some types of quotation marks
+        nb = nbformat.read(os.path.join(dir_name, fname), as_version=4)
+        ep = ExecutePreprocessor(timeout=timeout)
+        ep.preprocess(nb, {'metadata': {'path': dir_name + "/"}})
+        status, msg = 'ok', ''
+    except TimeoutError:
+        status, msg = 'timeout', f'more than {timeout} s'
+    except Exception as e:
+        # the notebook's own errors come back as CellExecutionError. Keep
+        # the last line of the traceback, without the terminal color codes
+        msg = re.sub(r'\x1b\[[0-9;]*m', '', str(e).strip().split('\n')[-1])
+        status = 'error'
+        if 'Timeout' in type(e).__name__:
+            status = 'timeout'
+    finally:
+        if has_alarm:
+            signal.alarm(0)
+    return status, perf_counter() - t0, msg
+
+
+def run_all_nb(dir_name, num_jobs, timeout, force=False, src_dir=SRC_DIR):
+    """
+    This method executes all the notebooks in dir_name whose hash has
+    changed since their last successful run (all of them if force=True),
+    and returns a report. A worker process that dies makes its notebook
+    fail with status "error", not the whole report. The cache is written
+    as soon as each notebook is done, so that the notebooks that ran
+    successfully before an interrupt are not run again.
+
+    Parameters
+    ----------
+    dir_name: str
+    num_jobs: int
+    timeout: int
+    force: bool
+    src_dir: str
+        folder of the *.py sources that are part of the hashes
+
+    Returns
+    -------
+    list[tuple[str, str, float, str]]
+        one (fname, status, run time, error message) per notebook. The
+        status of skipped notebooks is "cached"
+
+    """
+    fnames = sorted(fname for fname in os.listdir(dir_name) if
+                    fname[-6:] == '.ipynb')
+    old_fname_to_hash = read_cache(dir_name)
+    sources_hash = get_sources_hash(src_dir)
+    fname_to_hash = {fname: get_nb_hash(os.path.join(dir_name, fname),
+                                        sources_hash) for fname in fnames}
+    report = []
+    to_run = []
+    for fname in fnames:
+        if not force and old_fname_to_hash.get(fname) == \
+                fname_to_hash[fname]:
+            report.append((fname, 'cached', 0.0, ''))
+        else:
+            to_run.append(fname)
+    new_fname_to_hash = {fname: nb_hash for fname, nb_hash in
+                         old_fname_to_hash.items() if fname in fnames}
+    # drops the notebooks that no longer exist, even if none is run
+    write_cache(dir_name, new_fname_to_hash)
+    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+        future_to_fname = {
+            executor.submit(run_nb, dir_name, fname, timeout): fname
+            for fname in to_run}
+        for future in as_completed(future_to_fname):
+            fname = future_to_fname[future]
+            try:
+                status, time, msg = future.result()
+            except Exception as e:
+                # e.g., BrokenProcessPool if a worker crashed
+                status, time, msg = 'error', 0.0, repr(e)
+            print(f"------------ {fname}: {status}, {time:.1f} s")
+            report.append((fname, status, time, msg))
+            if status == 'ok':
+                new_fname_to_hash[fname] = fname_to_hash[fname]
+            else:
+                new_fname_to_hash.pop(fname, None)
+            write_cache(dir_name, new_fname_to_hash)
+    return sorted(report)
+
+
+def print_report(report, wall_time):
+    """
+    This method prints the report returned by run_all_nb()
+
+    Parameters
+    ----------
+    report: list[tuple[str, str, float, str]]
+    wall_time: float
+
+    Returns
+    -------
+    None
+
+    """
+    width = max([len(row[0]) for row in report] + [8])
+    print(f"{'notebook':<{width}}  {'status':<7}  {'time(s)':>8}")
+    for fname, status, time, msg in report:
+        print(f"{fname:<{width}}  {status:<7}  {time:>8.1f}  {msg}")
+    sum_time = sum(row[2] for row in report)
+    print(f"wall time={wall_time:.1f} s, sum of notebook times="
+          f"{sum_time:.1f} s")
+
+
+if __name__ == "__main__":
+    def main():
+        parser = argparse.ArgumentParser(
+            description="Run all the notebooks in a folder.")
+        parser.add_argument('--dir', type=str, default='jupyter_notebooks')
+        parser.add_argument('--jobs', type=int, default=os.cpu_count())
+        parser.add_argument('--timeout', type=int, default=1200,
+                            help='time limit per notebook, in seconds')
+        parser.add_argument('--force', action='store_true',
+                            help='ignore the cache and run every notebook')
+        args = parser.parse_args()
+        t0 = perf_counter()
+        report = run_all_nb(args.dir, args.jobs, args.timeout, args.force)
+        print_report(report, perf_counter() - t0)
+        if any(row[1] in ['error', 'timeout'] for row in report):
+            sys.exit(1)
+
+
+    main()
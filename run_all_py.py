@@ -16,6 +16,8 @@ file_blacklist = [
     '__init__.py',
     'run_all_nb.py',
     'run_all_py.py',
+    'run_batch.py',
+    'Net_Service.py',
     'classgraph.py'
 ]
 for dir_name in dir_whitelist:
@@ -0,0 +1,401 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from Net import Net
+from globals import *
+from utils import *
+
+'''
+
+This script runs one Net, or a whole grid of Nets, headless (no plotting),
+and writes the results to a file. Every parameter of Net may be given a
+list of values, in which case the script runs every combination (the
+cartesian product) of those values. Parameters may be given on the
+command line or in a JSON config file whose keys are the long option names
+below. Command line values override config file values. The output format
+(JSON lines, CSV, npz, or a Results_DB database) is set by the extension
+of the output file.
+
+Every run gets its own random number stream, spawned from the root seed
+--seed by np.random.SeedSequence, so the results are reproducible and do
+not depend on --jobs. The root seed (drawn from the OS if not given) and
+the index of each run are written with the results. Run number i can be
+repeated alone with Net(..., seed=np.random.SeedSequence(seed,
+spawn_key=(i,))).
+
+Examples:
+
+python run_batch.py --beta_hat 0.5 1 3 20 --p0 0.3 0.5 0.7 --num_iter 20 \
+    --backend numpy --jobs 4 --out results.jsonl
+
+python run_batch.py --config grid.json --out results.npz --save_marginals
+
+python run_batch.py --beta_hat 0.5 1 3 --num_iter 20 --num_rows 64 \
+    --num_cols 64 --out results.db
+
+'''
+
+SCALAR_FIELDS = ["beta", "beta_hat", "jj", "h", "lam", "num_iter", "p0",
+                 "do_reversing", "do_gauss_seidel", "backend", "num_rows",
+                 "num_cols", "tol", "num_iter_done", "mag", "av_eff",
+                 "av_eff_flag", "av_ent", "av_cond_info", "seed",
+                 "seed_index", "time"]
+GRID_PARAMS = ["jj", "h", "lam", "num_iter", "p0", "do_reversing",
+               "do_gauss_seidel", "backend", "num_rows", "num_cols", "tol"]
+
+
+def float_or_none(x):
+    """
+    This method converts a command line string to a float, or to None if
+    the string is "None". Used for p0 and tol.
+
+    Parameters
+    ----------
+    x: str
+
+    Returns
+    -------
+    float|None
+
+    """
+    if x in ["None", "none", "random"]:
+        return None
+    return float(x)
+
+
+def str_to_bool(x):
+    """
+    This method converts a command line string to a bool
+
+    Parameters
+    ----------
+    x: str
+
+    Returns
+    -------
+    bool
+
+    """
+    assert x in ["True", "False", "true", "false", "1", "0"], \
+        f"{x} is not a bool"
+    return x in ["True", "true", "1"]
+
+
+def get_parser():
+    """
+    This method returns the command line parser of this script.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Run a grid of Ising dbnets (class Net) headless.")
+    parser.add_argument("--config", type=str, default=None,
+                        help="JSON file with default values for the "
+                             "options below")
+    beta_group = parser.add_mutually_exclusive_group()
+    beta_group.add_argument("--beta", type=float, nargs="+", default=None)
+    beta_group.add_argument("--beta_hat", type=float, nargs="+",
+                            default=None,
+                            help="beta*jj/BETA_JJ_CURIE")
+    parser.add_argument("--jj", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--h", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--lam", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--num_iter", type=int, nargs="+", default=[20])
+    parser.add_argument("--p0", type=float_or_none, nargs="+",
+                        default=[.2], help="a float, or None for random")
+    parser.add_argument("--do_reversing", type=str_to_bool, nargs="+",
+                        default=[False])
+    parser.add_argument("--do_gauss_seidel", type=str_to_bool, nargs="+",
+                        default=[False])
+    parser.add_argument("--backend", type=str, nargs="+",
+                        default=[BATCH_BACKEND],
+                        choices=["python", "numpy", "numba"])
+    parser.add_argument("--num_rows", type=int, nargs="+",
+                        default=[DGRAPH_NUM_ROWS])
+    parser.add_argument("--num_cols", type=int, nargs="+",
+                        default=[DGRAPH_NUM_COLS])
+    parser.add_argument("--tol", type=float_or_none, nargs="+",
+                        default=[None],
+                        help="a float, or None to always do num_iter "
+                             "iterations")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="root seed of the random number streams")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of parallel worker processes")
+    parser.add_argument("--out", type=str, default="results.jsonl",
+                        help="output file, ending in .jsonl, .csv, .npz, "
+                             "or .db (appended to)")
+    parser.add_argument("--save_marginals", action="store_true",
+                        help="also write P(S_i^Y) for every node (not "
+                             "available for .csv)")
+    return parser
+
+
+def parse_args(argv=None):
+    """
+    This method parses the command line. If a config file is given, its
+    values are used as defaults, so that command line values override them.
+    In particular, --beta (resp. --beta_hat) on the command line overrides
+    a beta_hat (resp. beta) of the config file. A config file may not set
+    both beta and beta_hat, nor keys that are not options of this script.
+
+    Parameters
+    ----------
+    argv: list[str]|None
+
+    Returns
+    -------
+    argparse.Namespace
+
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        cmd_args = args
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown_keys = set(config) - (set(vars(parser.parse_args([]))) -
+                                      {"config"})
+        assert not unknown_keys, \
+            f"unknown keys in {args.config}: {sorted(unknown_keys)}"
+        assert "beta" not in config or "beta_hat" not in config, \
+            f"{args.config} sets both beta and beta_hat"
+        for key, value in config.items():
+            # allow scalars in the config file for the list options
+            if key not in ["seed", "jobs", "out", "save_marginals"] and \
+                    not isinstance(value, list):
+                config[key] = [value]
+        parser.set_defaults(**config)
+        args = parser.parse_args(argv)
+        # get_grid() prefers beta, so a beta from the config file must not
+        # shadow a --beta_hat from the command line
+        if cmd_args.beta_hat is not None:
+            args.beta = None
+        elif cmd_args.beta is not None:
+            args.beta_hat = None
+    if args.beta is None and args.beta_hat is None:
+        args.beta_hat = [1.0]
+    if args.seed is None:
+        args.seed = np.random.SeedSequence().entropy
+    return args
+
+
+def get_grid(args):
+    """
+    This method returns a list of dictionaries, one for each combination of
+    the parameter values in args. Each dictionary holds the keyword
+    arguments of Net, plus beta_hat.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+
+    Returns
+    -------
+    list[dict]
+
+    """
+    grid = []
+    if args.beta is not None:
+        beta_values = [("beta", x) for x in args.beta]
+    else:
+        beta_values = [("beta_hat", x) for x in args.beta_hat]
+    param_lists = [getattr(args, name) for name in GRID_PARAMS]
+    for (beta_name, beta_value), *values in itertools.product(
+            beta_values, *param_lists):
+        params = dict(zip(GRID_PARAMS, values))
+        if beta_name == "beta":
+            params["beta"] = beta_value
+            params["beta_hat"] = beta_value * params["jj"] / BETA_JJ_CURIE
+        else:
+            params["beta_hat"] = beta_value
+            params["beta"] = beta_value * BETA_JJ_CURIE / params["jj"]
+        grid.append(params)
+    return grid
+
+
+def run_net(params, save_marginals=False, callback=None):
+    """
+    This method runs one Net, without printing, and returns a dictionary
+    with its parameters, final metrics and run time. It is the unit of work
+    of the worker processes.
+
+    Parameters
+    ----------
+    params: dict
+        keyword arguments of Net, plus beta_hat, and optionally the root
+        seed "seed" and the index "seed_index" of this run (see
+        run_grid()). The backend defaults to BATCH_BACKEND, and
+        make_nodes to False
+    save_marginals: bool
+        True iff P(S_i^Y) (as a list of [P(S_i^Y=-1), P(S_i^Y=+1)]) is
+        included in the result, under the key "y_probs"
+    callback: Callable[[Net], None]|None
+        passed to Net, called after each iteration
+
+    Returns
+    -------
+    dict
+
+    """
+    net_params = {key: value for key, value in params.items() if
+                  key not in ["beta_hat", "seed", "seed_index"]}
+    net_params.setdefault("backend", BATCH_BACKEND)
+    # the Node objects are only used for plotting
+    net_params.setdefault("make_nodes", False)
+    seed = None
+    if params.get("seed") is not None:
+        seed = np.random.SeedSequence(params["seed"],
+                                      spawn_key=(params["seed_index"],))
+    t0 = perf_counter()
+    net = Net(**net_params, verbose=False, seed=seed, callback=callback)
+    time = perf_counter() - t0
+    av_ent, av_cond_info = net.get_av_entropy_and_cond_info()
+    result = dict(params)
+    result.update({"num_rows": net.num_rows,
+                   "num_cols": net.num_cols,
+                   "num_iter_done": net.num_iter_done,
+                   "mag": net.get_mag(),
+                   "av_eff": net.av_eff if net.num_iter_done else None,
+                   "av_eff_flag": bool(net.av_eff_flag) if
+                   net.num_iter_done else False,
+                   "av_ent": av_ent,
+                   "av_cond_info": av_cond_info,
+                   "time": time})
+    if save_marginals:
+        result["y_probs"] = net.y_probs.tolist()
+    return result
+
+
+def run_grid(grid, num_jobs=1, save_marginals=False, seed=None):
+    """
+    This method runs a Net for each element of grid, using num_jobs worker
+    processes, and returns the results in the same order as grid. The ith
+    Net gets the ith seed spawned from the root seed `seed` (see
+    utils.spawn_seeds()), whichever worker runs it.
+
+    Parameters
+    ----------
+    grid: list[dict]
+    num_jobs: int
+    save_marginals: bool
+    seed: int|None
+        root seed. If None, it is drawn from the OS
+
+    Returns
+    -------
+    list[dict]
+
+    """
+    # the seeds are passed to the workers, and recorded, as the root
+    # entropy and the spawn key, from which run_net() rebuilds them
+    seeds = spawn_seeds(seed, len(grid))
+    grid = [dict(params, seed=run_seed.entropy,
+                 seed_index=run_seed.spawn_key[0]) for params, run_seed in
+            zip(grid, seeds)]
+    if num_jobs <= 1:
+        return [run_net(params, save_marginals) for params in grid]
+    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+        return list(executor.map(run_net, grid,
+                                 [save_marginals] * len(grid)))
+
+
+def write_results(results, out):
+    """
+    This method writes results to the file `out`. The format is given by
+    the extension of `out`:
+
+    .jsonl: one JSON object per run
+
+    .csv: one row per run, scalar fields only
+
+    .npz: one array per field, indexed by run. Marginals, if present, are
+    stored in an array "y_probs" of shape (num_runs, num_dnodes, 2), so
+    all the runs must have the same lattice shape
+
+    .db: the results are added to the Results_DB database `out`, which is
+    created if it does not exist
+
+    Parameters
+    ----------
+    results: list[dict]
+    out: str
+
+    Returns
+    -------
+    None
+
+    """
+    ext = os.path.splitext(out)[1]
+    if ext == ".jsonl":
+        with open(out, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    elif ext == ".csv":
+        assert not any("y_probs" in result for result in results), \
+            "marginals cannot be written to a .csv file"
+        with open(out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SCALAR_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    elif ext == ".npz":
+        arrays = {}
+        for field in SCALAR_FIELDS:
+            values = [result[field] for result in results]
+            if field in ["p0", "tol", "av_eff"]:
+                values = [np.nan if x is None else x for x in values]
+            if field == "seed":
+                # the root seed may not fit in an int64
+                values = [str(x) for x in values]
+            arrays[field] = np.array(values)
+        if results and "y_probs" in results[0]:
+            assert len({(result["num_rows"], result["num_cols"]) for
+                        result in results}) == 1, \
+                "marginals of different lattice shapes cannot be written " \
+                "to a .npz file"
+            arrays["y_probs"] = np.array([result["y_probs"] for result
+                                          in results])
+        np.savez(out, **arrays)
+    elif ext == ".db":
+        from Results_DB import Results_DB
+        with Results_DB(out) as db:
+            db.insert_results(results)
+    else:
+        assert False, f"unknown output format {ext}"
+
+
+def main(argv=None):
+    """
+    This method runs the grid described by the command line argv and
+    writes the results.
+
+    Parameters
+    ----------
+    argv: list[str]|None
+
+    Returns
+    -------
+    None
+
+    """
+    args = parse_args(argv)
+    grid = get_grid(args)
+    t0 = perf_counter()
+    results = run_grid(grid, args.jobs, args.save_marginals, args.seed)
+    write_results(results, args.out)
+    print(f"{len(results)} runs, {perf_counter() - t0:.2f} s, "
+          f"written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
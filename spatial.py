@@ -0,0 +1,425 @@
+import numpy as np
+
+from utils import *
+
+'''
+
+This module calculates spatial statistics of lattice snapshots: two-point
+correlation functions, structure factors, the correlation length, and the
+sizes of the domains of equal spins. A snapshot is an array of shape
+(num_rows, num_cols) holding either spins S_i = +-1, e.g., from
+Multispin_MC.get_spins() or sample_snapshots(), or any per-site field,
+e.g., P(S_i^Y=-1) or the efficiency of a Net (np.nan marks undefined
+sites). Functions take a batch of snapshots, of shape (num_samples,
+num_rows, num_cols), and return averages over the batch.
+
+Correlations are calculated with FFTs (O(N log N) per snapshot, N =
+num_rows*num_cols, instead of O(N^2) for the sum over all pairs of
+sites), and domains are labelled by a vectorized connected-components
+algorithm. The batch is processed chunk_size snapshots at a time, in
+float32, so thousands of 1024x1024 snapshots only need memory for the
+batch itself (1 byte per spin with dtype int8) plus a few chunks.
+
+Beware that Net.sample_spins() draws the spins of different sites
+independently, so its snapshots have no connected correlations between
+different sites. Correlated snapshots come from Multispin_MC, which keeps
+the correlations.
+
+'''
+
+
+def sample_snapshots(net, num_samples, chunk_size=16):
+    """
+    This method returns num_samples snapshots of spins drawn from the
+    marginals of net by Net.sample_spins(), drawn chunk_size at a time so
+    that only the int8 result is held for the whole batch
+
+    Parameters
+    ----------
+    net: Net
+    num_samples: int
+    chunk_size: int
+
+    Returns
+    -------
+    np.array
+        shape (num_samples, num_rows, num_cols), dtype int8
+
+    """
+    spins = np.empty((num_samples, net.num_rows, net.num_cols),
+                     dtype=np.int8)
+    for k in range(0, num_samples, chunk_size):
+        num = min(chunk_size, num_samples - k)
+        spins[k: k + num] = net.sample_spins(num).reshape(
+            num, net.num_rows, net.num_cols)
+    return spins
+
+
+def get_chunks(fields, connected, chunk_size):
+    """
+    This generator yields the snapshots of fields, chunk_size at a time, in
+    float32, with the mean subtracted if connected=True, and a mask of the
+    defined (not np.nan) sites. The mean of each site over the batch is
+    subtracted if there is more than one snapshot, the mean over the
+    lattice otherwise.
+
+    Parameters
+    ----------
+    fields: np.array
+        shape (num_samples, num_rows, num_cols)
+    connected: bool
+    chunk_size: int
+
+    Returns
+    -------
+    Iterator[tuple[np.array, np.array|None]]
+        each chunk, with np.nan replaced by 0, and its mask, or None if
+        all its sites are defined
+
+    """
+    mean = 0
+    if connected:
+        if len(fields) > 1:
+            mean = np.zeros(fields.shape[1:])
+            count = np.zeros(fields.shape[1:])
+            for k in range(0, len(fields), chunk_size):
+                chunk = np.asarray(fields[k: k + chunk_size], dtype=float)
+                mean += np.nansum(chunk, axis=0)
+                count += np.sum(~np.isnan(chunk), axis=0)
+            with np.errstate(invalid="ignore"):
+                mean = np.where(count > 0, mean / count, 0)
+        else:
+            mean = np.nanmean(fields)
+        mean = np.asarray(mean, dtype=np.float32)
+    for k in range(0, len(fields), chunk_size):
+        chunk = np.asarray(fields[k: k + chunk_size], dtype=np.float32)
+        mask = ~np.isnan(chunk)
+        chunk = chunk - mean
+        if mask.all():
+            yield chunk, None
+        else:
+            yield np.where(mask, chunk, 0).astype(np.float32), \
+                mask.astype(np.float32)
+
+
+def get_structure_factor(fields, connected=True, chunk_size=16):
+    """
+    This method returns the structure factor
+
+    S(k) = <|\\sum_r f_r exp(-i k.r)|^2>/N
+
+    averaged over the snapshots, for the wave vectors k = 2*pi*(a/num_rows,
+    b/num_cols), in the layout of np.fft.rfft2 (a = 0, ..., num_rows - 1,
+    b = 0, ..., num_cols//2). np.nan sites count as 0 (after subtracting
+    the mean).
+
+    For a single snapshot, connected=True subtracts the mean over the
+    lattice, so S(0) is 0 by construction. The connected S(0) only
+    measures fluctuations for a batch of several snapshots.
+
+    Parameters
+    ----------
+    fields: np.array
+        shape (num_samples, num_rows, num_cols)
+    connected: bool
+        True iff the mean is subtracted (see get_chunks()), so that S(0)
+        is the susceptibility-like fluctuation of the sum, without the
+        N*mag^2 of an ordered phase
+    chunk_size: int
+
+    Returns
+    -------
+    np.array
+        shape (num_rows, num_cols//2 + 1)
+
+    """
+    num_samples, num_rows, num_cols = fields.shape
+    power = np.zeros((num_rows, num_cols // 2 + 1))
+    for chunk, _ in get_chunks(fields, connected, chunk_size):
+        ft = np.fft.rfft2(chunk)
+        power += np.sum(ft.real ** 2 + ft.imag ** 2, axis=0)
+    return power / (num_samples * num_rows * num_cols)
+
+
+def get_correlation_fn(fields, connected=True, periodic=False,
+                       chunk_size=16):
+    """
+    This method returns the two-point correlation function
+
+    G(d) = <f_r f_{r+d}>
+
+    averaged over the snapshots and over all the pairs of defined sites (r,
+    r+d) of the lattice, for every displacement d = (dr, dc). It is the
+    inverse FFT of |FFT(f)|^2 (Wiener-Khinchin), divided by the number of
+    pairs, the same for the mask of defined sites. For an open lattice
+    (periodic=False), the snapshots are zero padded to shape (2*num_rows,
+    2*num_cols), so that the pairs do not wrap around.
+
+    Parameters
+    ----------
+    fields: np.array
+        shape (num_samples, num_rows, num_cols)
+    connected: bool
+        True iff the mean is subtracted (see get_chunks()), i.e., G is the
+        connected correlation function
+    periodic: bool
+        True iff the lattice has periodic boundary conditions
+    chunk_size: int
+
+    Returns
+    -------
+    np.array, np.array, np.array
+        G, of shape (2*num_rows - 1, 2*num_cols - 1) (open) or (num_rows,
+        num_cols) (periodic), np.nan where there are no pairs, and the
+        displacements dr, of shape (len(G), 1), and dc, of shape (1,
+        G.shape[1]), of its entries
+
+    """
+    num_samples, num_rows, num_cols = fields.shape
+    shape = (num_rows, num_cols) if periodic else \
+        (2 * num_rows, 2 * num_cols)
+
+    def autocorrelation(x):
+        ft = np.fft.rfft2(x, s=shape)
+        return np.fft.irfft2(ft.real ** 2 + ft.imag ** 2, s=shape)
+
+    sums = np.zeros(shape)
+    num_pairs = np.zeros(shape)
+    # number of pairs at each displacement, when all sites are defined
+    full_pairs = autocorrelation(np.ones((num_rows, num_cols),
+                                         dtype=np.float32))
+    for chunk, mask in get_chunks(fields, connected, chunk_size):
+        sums += np.sum(autocorrelation(chunk), axis=0)
+        if mask is None:
+            num_pairs += len(chunk) * full_pairs
+        else:
+            num_pairs += np.sum(autocorrelation(mask), axis=0)
+    num_pairs = np.round(num_pairs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = np.where(num_pairs > 0, sums / num_pairs, np.nan)
+    # displacement 0 in the middle
+    corr = np.fft.fftshift(corr)
+    dr = np.arange(shape[0]) - shape[0] // 2
+    dc = np.arange(shape[1]) - shape[1] // 2
+    if not periodic:
+        # the first row and column are displacements -num_rows and
+        # -num_cols, which have no pairs
+        corr = corr[1:, 1:]
+        dr, dc = dr[1:], dc[1:]
+    return corr, dr[:, np.newaxis], dc[np.newaxis, :]
+
+
+def get_radial_average(values, dr, dc, bin_width=1.0):
+    """
+    This method averages values(d) over the displacements d with the same
+    distance |d|, rounded to a multiple of bin_width, ignoring np.nan.
+
+    Parameters
+    ----------
+    values: np.array
+        shape (len(dr), dc.shape[1]), e.g., the G of get_correlation_fn()
+    dr: np.array
+        shape (len(values), 1)
+    dc: np.array
+        shape (1, values.shape[1])
+    bin_width: float
+
+    Returns
+    -------
+    np.array, np.array
+        the distances, and the average of values at each distance
+
+    """
+    bins = np.round(np.sqrt(dr ** 2 + dc ** 2) / bin_width).astype(int)
+    defined = ~np.isnan(values)
+    bins = bins[defined]
+    sums = np.bincount(bins, weights=values[defined])
+    counts = np.bincount(bins)
+    present = counts > 0
+    return np.nonzero(present)[0] * bin_width, sums[present] / \
+        counts[present]
+
+
+def get_correlation_length(fields, chunk_size=16, structure_factor=None):
+    """
+    This method returns the second moment correlation length
+
+    xi = sqrt(S(0)/S(k_min) - 1)/(2*sin(|k_min|/2))
+
+    where S is the connected structure factor (see
+    get_structure_factor()) and k_min is the smallest nonzero wave vector,
+    2*pi/num_cols along the rows or 2*pi/num_rows along the columns. The
+    result is the average of the two directions (of the one with more
+    than 1 site if the lattice is a line). It equals the exponential
+    correlation length when G(d) decays as exp(-|d|/xi), and, unlike a
+    fit of G(d), it needs no choice of a fit range.
+
+    At least 2 snapshots are required, since S(0) is 0 for a single one
+    (see get_structure_factor()).
+
+    Parameters
+    ----------
+    fields: np.array
+        shape (num_samples, num_rows, num_cols), num_samples > 1
+    chunk_size: int
+    structure_factor: np.array|None
+        the result of get_structure_factor(fields), if already calculated
+
+    Returns
+    -------
+    float
+
+    """
+    num_samples, num_rows, num_cols = fields.shape
+    assert num_samples > 1, \
+        "the correlation length needs more than one snapshot"
+    if structure_factor is None:
+        structure_factor = get_structure_factor(fields, True, chunk_size)
+    s0 = structure_factor[0, 0]
+    xis = []
+    for size, k_min in [(num_cols, (0, 1)), (num_rows, (1, 0))]:
+        if size > 1:
+            s1 = structure_factor[k_min]
+            ratio = max(s0 / s1 - 1, 0.0) if s1 > 0 else np.inf
+            xis.append(np.sqrt(ratio) / (2 * np.sin(np.pi / size)))
+    return float(np.mean(xis))
+
+
+def label_domains(spins):
+    """
+    This method labels the domains of the snapshots, i.e., the connected
+    components of the sites with equal spins, nearest neighbors being
+    connected. All the snapshots are labelled at once by the same
+    vectorized algorithm: each round, every bond between two sites of
+    equal spin and different labels hooks the larger label onto the
+    smaller one, then the labels are replaced by their roots by pointer
+    jumping (label = label[label], until nothing changes). Bonds whose two
+    sites have the same label are dropped for the following rounds.
+
+    Parameters
+    ----------
+    spins: np.array
+        shape (num_samples, num_rows, num_cols), any two values (e.g., -1
+        and +1)
+
+    Returns
+    -------
+    np.array
+        shape (num_samples, num_rows, num_cols), int64. The label of a
+        site is the smallest flat index (row*num_cols + col) of the sites
+        of its domain
+
+    """
+    num_samples, num_rows, num_cols = spins.shape
+    num = num_rows * num_cols
+    ids = np.arange(num_samples * num).reshape(spins.shape)
+    right = spins[:, :, :-1] == spins[:, :, 1:]
+    down = spins[:, :-1, :] == spins[:, 1:, :]
+    bond_a = np.concatenate([ids[:, :, :-1][right], ids[:, :-1, :][down]])
+    bond_b = np.concatenate([ids[:, :, 1:][right], ids[:, 1:, :][down]])
+    labels = ids.ravel().copy()
+    while len(bond_a):
+        label_a = labels[bond_a]
+        label_b = labels[bond_b]
+        differ = label_a != label_b
+        bond_a, bond_b = bond_a[differ], bond_b[differ]
+        label_a, label_b = label_a[differ], label_b[differ]
+        if not len(bond_a):
+            break
+        # both labels are roots, so the larger one becomes a child
+        np.minimum.at(labels, np.maximum(label_a, label_b),
+                      np.minimum(label_a, label_b))
+        while True:
+            new_labels = labels[labels]
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+    # labels within each snapshot
+    return labels.reshape(spins.shape) - \
+        (np.arange(num_samples) * num)[:, np.newaxis, np.newaxis]
+
+
+def get_domain_sizes(spins, chunk_size=16):
+    """
+    This method returns the domains of all the snapshots (see
+    label_domains()), labelled chunk_size snapshots at a time.
+
+    Parameters
+    ----------
+    spins: np.array
+        shape (num_samples, num_rows, num_cols)
+    chunk_size: int
+
+    Returns
+    -------
+    np.array, np.array, np.array
+        for each domain, the index of its snapshot, its spin, and its
+        number of sites
+
+    """
+    sample_ids = []
+    domain_spins = []
+    sizes = []
+    num = spins.shape[1] * spins.shape[2]
+    for k in range(0, len(spins), chunk_size):
+        chunk = spins[k: k + chunk_size]
+        labels = label_domains(chunk)
+        flat_labels = (labels + (np.arange(len(chunk)) * num)[
+            :, np.newaxis, np.newaxis]).ravel()
+        roots, counts = np.unique(flat_labels, return_counts=True)
+        sample_ids.append(k + roots // num)
+        domain_spins.append(chunk.reshape(-1)[roots])
+        sizes.append(counts)
+    return np.concatenate(sample_ids), np.concatenate(domain_spins), \
+        np.concatenate(sizes)
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    from Multispin_MC import Multispin_MC
+    from globals import *
+
+
+    def main1():
+        # Y alone mixes the two independent sublattice Ising models of the
+        # stationary state (see Exact_Strip.py), so a snapshot of one of
+        # them is built from Y(t) on the black sites and Y(t+1) on the
+        # white ones. Its correlation length and domains grow as beta
+        # approaches the critical point beta_hat=1
+        num_rows = num_cols = 64
+        black = (np.add.outer(np.arange(num_rows), np.arange(num_cols)) %
+                 2 == 0)
+        for beta_hat in [.5, .8, .9, .95]:
+            mc = Multispin_MC(beta_hat * BETA_JJ_CURIE, 1, num_iter=500,
+                              p0=.5, num_rows=num_rows, num_cols=num_cols,
+                              num_replicas=512, seed=1, verbose=False)
+            spins = mc.get_spins()
+            mc.sweep()
+            spins = np.where(black, spins, mc.get_spins())
+            xi = get_correlation_length(spins)
+            corr, dr, dc = get_correlation_fn(spins)
+            dist, corr_r = get_radial_average(corr, dr, dc)
+            _, _, sizes = get_domain_sizes(spins)
+            print(f"beta_hat={beta_hat}, xi={xi:.3f}, "
+                  f"G(1)={corr_r[1]:.4f}, G(4)={corr_r[4]:.4f}, "
+                  f"mean domain size={np.mean(sizes):.2f}, "
+                  f"largest={np.max(sizes)}")
+
+
+    def main2():
+        num_samples, num_rows, num_cols = 32, 1024, 1024
+        spins = np.where(np.random.default_rng(0).random(
+            (num_samples, num_rows, num_cols)) < .5, -1, 1).astype(np.int8)
+        for name, f in [
+                ("structure factor", lambda: get_structure_factor(spins)),
+                ("correlation fn", lambda: get_correlation_fn(spins)),
+                ("domains", lambda: get_domain_sizes(spins))]:
+            t0 = perf_counter()
+            f()
+            print(f"{name}: {(perf_counter() - t0) / num_samples * 1000:.1f}"
+                  f" ms per 1024x1024 snapshot")
+
+
+    main1()
+    main2()
@@ -0,0 +1,175 @@
+import numpy as np
+
+from utils import *
+
+'''
+
+This module finds the symmetries of the lattice of a Net, and the orbits
+of its sites under those symmetries, so that the sweeps need to calculate
+only one representative site per orbit.
+
+The open rectangular lattice is invariant under the reflections of its
+rows and of its columns (4 symmetries). A square lattice is also invariant
+under its diagonal reflections and its 90 degree rotations (the 8
+symmetries of the dihedral group D4). A symmetry of the lattice is a
+symmetry of the dynamics if it also leaves P(S_i^X) and the coupling
+constants invariant, as is the case for a uniform p0 and uniform jj, h,
+lam. The Y marginals P(S_i^Y) then have the same symmetry (each sweep is
+equivariant), so it is preserved by all the iterations (when they are not
+Gauss-Seidel ones). A random p0 or random couplings (disorder) generally
+leave only the identity, in which case there is nothing to gain.
+
+A symmetry is represented by the permutation `perm` of the 0 based site
+ids such that site i is mapped to site perm[i].
+
+'''
+
+
+def get_lattice_perms(num_rows, num_cols):
+    """
+    This method returns the permutations of the sites of the open
+    rectangular lattice of shape (num_rows, num_cols) given by its
+    symmetries: 4 for a rectangle, 8 for a square. The first one is the
+    identity.
+
+    Parameters
+    ----------
+    num_rows: int
+    num_cols: int
+
+    Returns
+    -------
+    np.array
+        shape (num_symmetries, num_rows*num_cols), int
+
+    """
+    row, col = np.divmod(np.arange(num_rows * num_cols), num_cols)
+    last_row, last_col = num_rows - 1, num_cols - 1
+    new_rows_cols = [(row, col),
+                     (last_row - row, col),
+                     (row, last_col - col),
+                     (last_row - row, last_col - col)]
+    if num_rows == num_cols:
+        new_rows_cols += [(col, row),
+                          (last_col - col, last_row - row),
+                          (col, last_row - row),
+                          (last_col - col, row)]
+    return np.array([new_row * num_cols + new_col for new_row, new_col in
+                     new_rows_cols])
+
+
+def is_bond_invariant(perm, nei_ids, bond_jj):
+    """
+    This method returns True iff the coupling constant of every bond (i,
+    j) equals the coupling constant of the bond (perm[i], perm[j]).
+
+    Parameters
+    ----------
+    perm: np.array
+        shape (num_dnodes,)
+    nei_ids: np.array
+        shape (num_dnodes, 4), as in Net.nei_ids
+    bond_jj: np.array
+        shape (num_dnodes, 4), as in Net.bond_jj
+
+    Returns
+    -------
+    bool
+
+    """
+    num = len(nei_ids)
+    ids, ks = np.nonzero(nei_ids >= 0)
+    neis = nei_ids[ids, ks]
+    # bond (i, j) is stored under the key i*num + j
+    keys = ids * num + neis
+    order = np.argsort(keys)
+    new_keys = perm[ids] * num + perm[neis]
+    pos = np.searchsorted(keys[order], new_keys)
+    if np.any(pos == len(keys)) or \
+            np.any(keys[order][np.minimum(pos, len(keys) - 1)] != new_keys):
+        # perm does not map bonds to bonds
+        return False
+    return bool(np.all(bond_jj[ids[order][pos], ks[order][pos]] ==
+                       bond_jj[ids, ks]))
+
+
+def get_invariant_perms(num_rows, num_cols, x_probs, nei_ids, bond_jj,
+                        site_h, site_lam):
+    """
+    This method returns the permutations of get_lattice_perms() that leave
+    P(S_i^X) and the coupling constants exactly invariant. The identity is
+    always returned.
+
+    Parameters
+    ----------
+    num_rows: int
+    num_cols: int
+    x_probs: np.array
+        shape (num_dnodes, 2)
+    nei_ids: np.array
+        shape (num_dnodes, 4)
+    bond_jj: np.array
+        shape (num_dnodes, 4)
+    site_h: np.array
+        shape (num_dnodes,)
+    site_lam: np.array
+        shape (num_dnodes,)
+
+    Returns
+    -------
+    np.array
+        shape (num_symmetries, num_dnodes), int
+
+    """
+    perms = []
+    for perm in get_lattice_perms(num_rows, num_cols):
+        if np.array_equal(x_probs[perm], x_probs) and \
+                np.array_equal(site_h[perm], site_h) and \
+                np.array_equal(site_lam[perm], site_lam) and \
+                is_bond_invariant(perm, nei_ids, bond_jj):
+            perms.append(perm)
+    return np.array(perms)
+
+
+def get_orbits(perms):
+    """
+    This method returns the orbits of the sites under the group of
+    permutations perms. The representative of an orbit is its smallest
+    site id.
+
+    Parameters
+    ----------
+    perms: np.array
+        shape (num_symmetries, num_dnodes). Must be a group
+
+    Returns
+    -------
+    np.array, np.array
+        the representatives of all the orbits, in increasing order, shape
+        (num_orbits,), and the representative of the orbit of each site,
+        shape (num_dnodes,)
+
+    """
+    rep_of = np.min(perms, axis=0)
+    return np.unique(rep_of), rep_of
+
+
+if __name__ == "__main__":
+    def main():
+        num_rows = num_cols = 5
+        num = num_rows * num_cols
+        nei_ids = get_nei_ids(num_rows, num_cols)
+        bond_jj = 1.0 * (nei_ids >= 0)
+        zeros = np.zeros(num)
+        for name, x_probs in [
+                ("uniform p0", np.tile([.2, .8], (num, 1))),
+                ("random p0", np.random.default_rng(0).uniform(
+                    0, 1, (num, 2)))]:
+            perms = get_invariant_perms(num_rows, num_cols, x_probs,
+                                        nei_ids, bond_jj, zeros, zeros)
+            reps, rep_of = get_orbits(perms)
+            print(f"{name}: {len(perms)} symmetries, {len(reps)} orbits")
+            print(rep_of.reshape(num_rows, num_cols))
+
+
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from animate import *
+
+HEIGHT, WIDTH = 120, 200
+
+
+def install_ffmpeg(tmp_path, monkeypatch, body):
+    # a stand-in for the ffmpeg executable, first on the PATH
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    path = bin_dir / "ffmpeg"
+    path.write_text(f"#!{sys.executable}\nimport sys\n{body}\n")
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def get_frames(num_frames):
+    for k in range(num_frames):
+        yield np.full((HEIGHT, WIDTH, 3), k, dtype=np.uint8)
+
+
+def test_mp4_pipes_every_frame(tmp_path, monkeypatch):
+    # the stand-in writes the raw frames that it reads to the output file
+    install_ffmpeg(tmp_path, monkeypatch,
+                   "open(sys.argv[-1], 'wb').write(sys.stdin.buffer.read())")
+    out = str(tmp_path / "movie.mp4")
+    assert write_frames(get_frames(4), out) == 4
+    raw = np.fromfile(out, dtype=np.uint8).reshape(4, HEIGHT, WIDTH, 3)
+    assert (raw[:, 0, 0, 0] == np.arange(4)).all()
+
+
+def test_mp4_ffmpeg_exiting_early_is_an_error(tmp_path, monkeypatch):
+    install_ffmpeg(tmp_path, monkeypatch, "sys.exit(1)")
+    with pytest.raises(AssertionError, match="ffmpeg failed"):
+        write_frames(get_frames(50), str(tmp_path / "movie.mp4"))
+
+
+def test_mp4_ffmpeg_is_waited_for_if_frames_raise(tmp_path, monkeypatch):
+    install_ffmpeg(tmp_path, monkeypatch,
+                   "open(sys.argv[-1], 'wb').write(sys.stdin.buffer.read())")
+    out = str(tmp_path / "movie.mp4")
+
+    def frames():
+        yield from get_frames(2)
+        raise RuntimeError("no more frames")
+
+    with pytest.raises(RuntimeError):
+        write_frames(frames(), out)
+    # ffmpeg got the end of its input and exited
+    assert os.path.getsize(out) == 2 * HEIGHT * WIDTH * 3
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import socket
+import threading
+from time import perf_counter, sleep
+
+import pytest
+
+from Net_Service import *
+
+
+@pytest.fixture
+def service(tmp_path):
+    # a service with a single worker, run in a thread
+    service = Net_Service(str(tmp_path / "net_service.sock"), num_workers=1)
+    started = threading.Event()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.serve(started))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(60)
+    yield service
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(60)
+
+
+def connect(service, params):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(service.socket_path)
+    file = sock.makefile("rwb")
+    file.write((json.dumps({"op": "run", "params": params}) +
+                "\n").encode())
+    file.flush()
+    return sock, file
+
+
+def wait_until(condition, timeout=60):
+    t0 = perf_counter()
+    while not condition():
+        assert perf_counter() - t0 < timeout, "timed out"
+        sleep(.05)
+
+
+def test_queued_job_of_a_disconnected_client_is_cancelled(service):
+    # the only worker is kept busy by the run of client A
+    sock_a, file_a = connect(service, dict(
+        beta_hat=.5, jj=1, num_iter=10**6, num_rows=16, num_cols=16))
+    try:
+        assert json.loads(file_a.readline())["type"] == "iter"
+        # client B submits a run, which is queued, and disconnects
+        sock_b, file_b = connect(service, dict(
+            beta_hat=.7, jj=1, num_iter=1, num_rows=16, num_cols=16))
+        wait_until(lambda: len(service.jobs) == 2)
+        job_b = [job for job in service.jobs.values() if
+                 json.loads(job.key)["num_iter"] == 1][0]
+        file_b.close()
+        sock_b.close()
+        # the queued run is cancelled without waiting for the worker. It
+        # is either removed from the pool, or, if the pool has already
+        # handed it to the worker's call queue, stopped at its first
+        # iteration
+        wait_until(lambda: len(service.jobs) == 1, timeout=10)
+        assert job_b.future.cancelled() or \
+            job_b.job_id in service._cancelled_ids
+    finally:
+        # the running run stops once client A disconnects too
+        file_a.close()
+        sock_a.close()
+    wait_until(lambda: not service._id_to_job)
+    assert not job_b.messages
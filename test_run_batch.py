@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from run_batch import *
+
+
+def write_config(tmp_path, config):
+    path = tmp_path / "grid.json"
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_command_line_beta_hat_beats_config_beta(tmp_path):
+    config = write_config(tmp_path, {"beta": [.3], "p0": .5})
+    args = parse_args(["--config", config, "--beta_hat", "2"])
+    grid = get_grid(args)
+    assert [params["beta_hat"] for params in grid] == [2.0]
+    assert grid[0]["p0"] == .5
+
+
+def test_command_line_beta_beats_config_beta_hat(tmp_path):
+    config = write_config(tmp_path, {"beta_hat": [2, 3]})
+    args = parse_args(["--config", config, "--beta", ".3"])
+    assert [params["beta"] for params in get_grid(args)] == [.3]
+
+
+def test_config_beta_is_used_without_command_line_beta(tmp_path):
+    config = write_config(tmp_path, {"beta": .3})
+    args = parse_args(["--config", config, "--num_iter", "5"])
+    grid = get_grid(args)
+    assert [params["beta"] for params in grid] == [.3]
+    assert grid[0]["num_iter"] == 5
+
+
+def test_config_with_beta_and_beta_hat_is_rejected(tmp_path):
+    config = write_config(tmp_path, {"beta": .3, "beta_hat": 2})
+    with pytest.raises(AssertionError, match="both beta and beta_hat"):
+        parse_args(["--config", config])
+
+
+def test_config_with_unknown_key_is_rejected(tmp_path):
+    config = write_config(tmp_path, {"beta": .3, "num_iters": 5})
+    with pytest.raises(AssertionError, match="num_iters"):
+        parse_args(["--config", config])
+
+
+def test_run_net_does_not_make_nodes():
+    nets = []
+    result = run_net(dict(beta=.3, jj=1, num_iter=2, num_rows=4,
+                          num_cols=4), callback=nets.append)
+    assert result["num_iter_done"] == 2
+    assert not nets[-1].y_nodes
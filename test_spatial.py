@@ -0,0 +1,92 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from spatial import *
+
+
+def label_domains_bfs(spins):
+    # labels of the domains of one snapshot, by breadth first search
+    num_rows, num_cols = spins.shape
+    labels = np.full(spins.shape, -1)
+    for start in range(num_rows * num_cols):
+        r0, c0 = divmod(start, num_cols)
+        if labels[r0, c0] >= 0:
+            continue
+        labels[r0, c0] = start
+        queue = deque([(r0, c0)])
+        while queue:
+            r, c = queue.popleft()
+            for r1, c1 in [(r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)]:
+                if 0 <= r1 < num_rows and 0 <= c1 < num_cols and \
+                        labels[r1, c1] < 0 and spins[r1, c1] == spins[r, c]:
+                    labels[r1, c1] = start
+                    queue.append((r1, c1))
+    return labels
+
+
+def get_correlation_fn_direct(fields, connected, periodic):
+    # G(d) as a sum over all the pairs of defined sites
+    num_samples, num_rows, num_cols = fields.shape
+    if connected:
+        count = np.sum(~np.isnan(fields), axis=0)
+        mean = np.where(count > 0, np.nansum(fields, axis=0) /
+                        np.maximum(count, 1), 0)
+        fields = fields - mean
+    if periodic:
+        drs = np.arange(num_rows) - num_rows // 2
+        dcs = np.arange(num_cols) - num_cols // 2
+    else:
+        drs = np.arange(-num_rows + 1, num_rows)
+        dcs = np.arange(-num_cols + 1, num_cols)
+    corr = np.full((len(drs), len(dcs)), np.nan)
+    for i, dr in enumerate(drs):
+        for j, dc in enumerate(dcs):
+            total, num_pairs = 0.0, 0
+            for r in range(num_rows):
+                for c in range(num_cols):
+                    r1, c1 = r + dr, c + dc
+                    if periodic:
+                        r1, c1 = r1 % num_rows, c1 % num_cols
+                    elif not (0 <= r1 < num_rows and 0 <= c1 < num_cols):
+                        continue
+                    for f in fields:
+                        if not np.isnan(f[r, c]) and \
+                                not np.isnan(f[r1, c1]):
+                            total += f[r, c] * f[r1, c1]
+                            num_pairs += 1
+            if num_pairs:
+                corr[i, j] = total / num_pairs
+    return corr, drs, dcs
+
+
+def test_label_domains_matches_bfs():
+    rng = np.random.default_rng(0)
+    for shape, p in [((5, 4, 6), .5), ((3, 9, 9), .3), ((2, 1, 7), .5)]:
+        spins = np.where(rng.random(shape) < p, -1, 1).astype(np.int8)
+        labels = label_domains(spins)
+        for k in range(len(spins)):
+            assert (labels[k] == label_domains_bfs(spins[k])).all()
+
+
+@pytest.mark.parametrize("periodic", [False, True])
+@pytest.mark.parametrize("connected", [False, True])
+def test_correlation_fn_matches_pair_sum(connected, periodic):
+    rng = np.random.default_rng(1)
+    fields = rng.random((3, 4, 5))
+    fields[0, 1, 2] = fields[2, 3, 0] = np.nan
+    corr, dr, dc = get_correlation_fn(fields, connected, periodic,
+                                      chunk_size=2)
+    corr_direct, drs, dcs = get_correlation_fn_direct(fields, connected,
+                                                      periodic)
+    assert (dr.ravel() == drs).all() and (dc.ravel() == dcs).all()
+    assert np.allclose(corr, corr_direct, atol=1e-5, equal_nan=True)
+
+
+def test_correlation_length_needs_several_snapshots():
+    spins = np.where(np.random.default_rng(2).random((1, 8, 8)) < .5,
+                     -1, 1).astype(np.int8)
+    assert get_structure_factor(spins)[0, 0] == pytest.approx(0, abs=1e-6)
+    with pytest.raises(AssertionError):
+        get_correlation_length(spins)
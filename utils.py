@@ -21,3 +21,122 @@ def coin_toss_entropy(prob):
     else:
         return -prob*np.log(prob) -(1-prob)*np.log(1-prob)
 
+
+def plogp(probs):
+    """
+    This method returns the array probs*log(probs), calculated elementwise,
+    with the convention that 0*log(0) = 0. It is used to calculate
+    entropies of many distributions at once.
+
+    Parameters
+    ----------
+    probs: np.array
+        array of probabilities of any shape
+
+    Returns
+    -------
+    np.array
+        array of the same shape as probs
+
+    """
+    probs = np.asarray(probs, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(probs > 0, probs * np.log(probs), 0.0)
+
+
+def get_nei_ids(num_rows, num_cols):
+    """
+    This method returns the 0 based ids of the nearest neighbors of every
+    node of a rectangular lattice with num_rows rows and num_cols columns,
+    as an array of shape (num_rows*num_cols, 4). Row i-1 of this array
+    holds the same neighbors, in the same order, as Node(i,
+    ...).nearest_nei (minus 1), padded at the end with -1.
+
+    Parameters
+    ----------
+    num_rows: int
+    num_cols: int
+
+    Returns
+    -------
+    np.array
+
+    """
+    ids = np.arange(num_rows * num_cols)
+    row, col = np.divmod(ids, num_cols)
+    nei_ids = np.stack([ids + 1, ids - 1, ids + num_cols, ids - num_cols],
+                       axis=1)
+    valid = np.stack([col < num_cols - 1, col > 0, row < num_rows - 1,
+                      row > 0], axis=1)
+    nei_ids = np.where(valid, nei_ids, -1)
+    # move the missing neighbors to the end, keeping the order of the rest
+    order = np.argsort(~valid, axis=1, kind="stable")
+    return np.take_along_axis(nei_ids, order, axis=1)
+
+
+def get_bond_jj(nei_ids, jj_right, jj_down):
+    """
+    This method converts the coupling constants of the bonds of a
+    rectangular lattice, given as two arrays over the sites, into the
+    (NUM_DNODES, 4) array `bond_jj` used by class Net, in which
+    bond_jj[i, k] is the coupling constant of the bond between node i and
+    its kth nearest neighbor nei_ids[i, k]. Both ends of a bond get the
+    same coupling constant.
+
+    Parameters
+    ----------
+    nei_ids: np.array
+        shape (NUM_DNODES, 4), 0 based ids of the nearest neighbors, padded
+        with -1, as in Net.nei_ids
+    jj_right: np.array
+        shape (num_rows, num_cols), coupling constant of the bond between
+        each site and the site to its right. The last column is ignored
+    jj_down: np.array
+        shape (num_rows, num_cols), coupling constant of the bond between
+        each site and the site below it. The last row is ignored
+
+    Returns
+    -------
+    np.array
+        shape (NUM_DNODES, 4)
+
+    """
+    num_cols = np.shape(jj_right)[1]
+    jj_right = np.asarray(jj_right, dtype=float).ravel()
+    jj_down = np.asarray(jj_down, dtype=float).ravel()
+    ids = np.arange(len(nei_ids))[:, np.newaxis]
+    valid = nei_ids >= 0
+    nei = np.where(valid, nei_ids, 0)
+    delta = np.where(valid, nei_ids - ids, 0)
+    bond_jj = np.zeros(nei_ids.shape)
+    if num_cols > 1:
+        bond_jj = np.where(delta == 1, jj_right[ids], bond_jj)
+        bond_jj = np.where(delta == -1, jj_right[nei], bond_jj)
+    bond_jj = np.where(delta == num_cols, jj_down[ids], bond_jj)
+    bond_jj = np.where(delta == -num_cols, jj_down[nei], bond_jj)
+    return bond_jj
+
+
+def spawn_seeds(seed, num):
+    """
+    This method returns num independent seeds, spawned from one root seed
+    by np.random.SeedSequence. Each one can be passed as the `seed` of a
+    Net (or of a np.random.default_rng()) in a different worker process or
+    batch member. The streams do not overlap, and the ith seed depends only
+    on the root seed and on i, so results do not depend on how the work is
+    scheduled.
+
+    Parameters
+    ----------
+    seed: int|np.random.SeedSequence|None
+        root seed. If None, the root is seeded from the OS
+    num: int
+
+    Returns
+    -------
+    list[np.random.SeedSequence]
+
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(num)